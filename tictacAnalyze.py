@@ -0,0 +1,244 @@
+# Bulk analysis of tic-tac-toe games: the engine's evaluation of every
+# position of saved games or of a dataset (tictacDataset.py), and the
+# blunders played in them.
+"""
+    Usage: python3 tictacAnalyze.py INPUT OUT [--format=csv|bin] [--blunders]
+                                    [--workers=N] [--chunk=N]
+
+    INPUT is a saveDir (each save is a position) or a dataset (positions
+    and games). For each position of each game, writes to OUT (- for
+    stdout, CSV only) a row of:
+        game        Num of the game in INPUT, from 0
+        name        Save file's name, or #<game> (CSV only)
+        ply         Pieces on the board
+        turn        Player to move, X or O (0/1 in bin)
+        board       Board.code() of the board
+        value       Engine's evaluation for the player to move: 10 win,
+                    0 draw, -10 loss
+        best        Engine's best square
+        played      Square played, -1 if none
+        loss        Value lost by the move played (0 if it's as good as best)
+        blunder     1 if loss > 0 (CSV only, in bin it's loss > 0)
+    --format=bin writes ANALYSIS_RECORD structs instead of CSV (the default).
+    --blunders writes only the rows of blunders.
+    Games are analyzed in chunks of --chunk (CHUNK_GAMES) by a pool of
+    --workers (all CPUs) processes.
+"""
+
+import os
+import sys
+import csv
+import time
+import struct
+import collections
+import concurrent.futures
+
+from tictacEngine import X, O, empty, draw, Board, AI, Snapshot, \
+                         SNAPSHOT_PATH, read_save
+from tictacDataset import Position, GameRecord, read_records
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+CHUNK_GAMES = 256       # Games per task of a worker
+MAX_WORKERS = os.cpu_count()
+PENDING_CHUNKS = 4      # Chunks queued per worker, bounds memory use
+
+# game, board, ply, turn, value, best, played, loss
+ANALYSIS_RECORD = struct.Struct("<IHBBbbbb")
+CSV_FIELDS = ("game", "name", "ply", "turn", "board", "value", "best",
+              "played", "loss", "blunder")
+
+# Shared state set up in each worker process by init_worker()
+table = None
+
+
+#==============================================================================
+
+def init_worker(shared_table):
+    """ Set up the table of solved positions in a worker process. """
+    global table
+    table = shared_table
+
+def evaluate(board:Board, turn):
+    """ Return (value, best square) of `board` for `turn` to move, or
+        (value, -1) if the game's over.
+    """
+    result = board.get_game_result()
+    if result == None:
+        return AI.minimax(board, turn, True, table=table)
+    if result == draw:
+        return (0, -1)
+    return (10 if result == turn else -10, -1)
+
+def analyze_game(turn, board, moves):
+    """ Return rows (ply, turn, board code, value, best, played, loss) of
+        the positions of the game from `board` with `turn` to move and
+        `moves` played. Analysis stops at the end of the game or at an
+        illegal move.
+    """
+    rows = []
+    board = Board(board[:])
+    for i in range(len(moves) + 1):
+        if board.get_game_result() != None:
+            break
+        value, best = evaluate(board, turn)
+        ply = 9 - board.board.count(empty)
+        if i == len(moves):
+            rows.append((ply, turn, board.code(), value, best, -1, 0))
+            break
+
+        played = moves[i]
+        if not 0 <= played <= 8 or board[played] != empty:
+            rows.append((ply, turn, board.code(), value, best, played, 0))
+            break
+        child = board.copy()
+        child.board[played] = turn
+        other = O if turn == X else X
+        after = -evaluate(child, other)[0]
+        rows.append((ply, turn, board.code(), value, best, played,
+                     value - after))
+        board = child
+        turn = other
+    return rows
+
+def analyze_chunk(games):
+    """ Worker's task: analyze `games`, a list of (game num, name, turn,
+        board, moves). Returns list of (game num, name, rows).
+    """
+    return [(game_no, name, analyze_game(turn, board, moves))
+            for game_no, name, turn, board, moves in games]
+
+def read_games(path):
+    """ Generator of (game num, name, turn, board, moves) of the games in
+        saveDir or dataset at `path`.
+    """
+    if os.path.isdir(path):
+        names = sorted(entry.name for entry in os.scandir(path)
+                       if not entry.name.startswith(".") and entry.is_file())
+        game_no = 0
+        for name in names:
+            try:
+                turn, board = read_save(os.path.join(path, name))
+            except (ValueError, OSError):
+                continue    # Corrupted
+            yield (game_no, name, turn, board, [])
+            game_no += 1
+    else:
+        game_no = 0
+        for record in read_records(path):
+            if isinstance(record, Position):
+                yield (game_no, "#%d" % game_no, record.turn, record.board, [])
+            elif isinstance(record, GameRecord):
+                yield (game_no, "#%d" % game_no, record.turn, record.board,
+                       record.moves)
+            else:
+                continue    # Scores
+            game_no += 1
+
+def chunked(items, size):
+    """ Generator of lists of up to `size` consecutive `items`. """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def analyze(games, workers=MAX_WORKERS, chunk_games=CHUNK_GAMES):
+    """ Generator of (game num, name, rows) of iterable `games` (as
+        read_games()), in order, analyzed by a pool of `workers` processes.
+        Only a few chunks per worker are read ahead of the results.
+    """
+    shared_table = Snapshot(SNAPSHOT_PATH)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers,
+                initializer=init_worker,
+                initargs=(shared_table,)) as executor:
+            pending = collections.deque()
+            for chunk in chunked(games, chunk_games):
+                pending.append(executor.submit(analyze_chunk, chunk))
+                if len(pending) >= workers * PENDING_CHUNKS:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    finally:
+        shared_table.close()
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    paths = []
+    out_format = "csv"
+    blunders_only = False
+    workers = MAX_WORKERS
+    chunk_games = CHUNK_GAMES
+    try:
+        for arg in sys.argv[1:]:
+            if arg.startswith("--format="):
+                out_format = arg[len("--format="):]
+                if out_format not in ("csv", "bin"):
+                    raise ValueError("unknown format: %s" % out_format)
+            elif arg == "--blunders":
+                blunders_only = True
+            elif arg.startswith("--workers="):
+                workers = int(arg[len("--workers="):])
+            elif arg.startswith("--chunk="):
+                chunk_games = int(arg[len("--chunk="):])
+            elif arg.startswith("--"):
+                raise ValueError("unknown option: %s" % arg)
+            else:
+                paths.append(arg)
+        if len(paths) != 2:
+            raise ValueError("INPUT and OUT are needed")
+        if paths[1] == "-" and out_format == "bin":
+            raise ValueError("bin output can't go to stdout")
+    except ValueError as e:
+        print(e)
+        print(__doc__)
+        exit(2)
+    in_path, out_path = paths
+
+    if out_path == "-":
+        out = sys.stdout
+    elif out_format == "csv":
+        out = open(out_path, "w", newline="")
+    else:
+        out = open(out_path, "wb")
+    writer = csv.writer(out) if out_format == "csv" else None
+    if writer != None:
+        writer.writerow(CSV_FIELDS)
+
+    start = time.perf_counter()
+    num_games = num_positions = num_blunders = 0
+    try:
+        for game_no, name, rows in analyze(read_games(in_path), workers,
+                                           chunk_games):
+            num_games += 1
+            num_positions += len(rows)
+            for ply, turn, code, value, best, played, loss in rows:
+                if loss > 0:
+                    num_blunders += 1
+                elif blunders_only:
+                    continue
+                if writer != None:
+                    writer.writerow((game_no, name, ply, "XO"[turn], code,
+                                     value, best, played, loss,
+                                     int(loss > 0)))
+                else:
+                    out.write(ANALYSIS_RECORD.pack(game_no, code, ply, turn,
+                                                   value, best, played, loss))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    finally:
+        if out != sys.stdout:
+            out.close()
+
+    secs = time.perf_counter() - start
+    print("%d games, %d positions, %d blunders in %.2fs (%.0f positions/s)" %
+            (num_games, num_positions, num_blunders, secs,
+             num_positions / secs if secs else 0), file=sys.stderr)
@@ -0,0 +1,312 @@
+# Benchmarks for the tic-tac-toe server and engine.
+# Each benchmark prints its measurements and checks them against a target,
+# the script exits with status 1 if any benchmark misses its target.
+"""
+    Usage: python3 tictacBench.py [BENCHMARK...] [--runs=N]
+
+    Benchmarks:
+        startup     Server's time from launch to being ready for connections
+        latency     Round trip of requests to the server over TCP and a Unix 
+                    domain socket
+        lobby       Joining and matching players in the PvP lobby's matchmaker
+        journal     Writing moves to the move journal and scanning them
+        parallel    Root split parallel search's speedup by num of workers
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import tempfile
+import statistics
+import subprocess
+import random
+
+import tictacEngine as engine
+import tictacServer as server
+import tictacJournal as journal
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "tictacServer.py")
+
+RUNS = 5                # Times each measurement is repeated
+ROUND_TRIPS = 200       # Requests per latency measurement
+LOBBY_PLAYERS = 100000  # Players joining per lobby measurement
+JOURNAL_MOVES = 200000  # Moves written per journal measurement
+
+# Targets
+STARTUP_TARGET = 1.0    # Max secs from launching server to it being ready
+READY_TIMEOUT = 30.0    # Secs to wait for server to get ready at all
+LATENCY_TARGET = 0.005  # Max secs of a round trip to a local server
+LOBBY_TARGET = 0.00002  # Max secs per player joining (and leaving) lobby
+JOURNAL_WRITE_TARGET = 0.00001  # Max secs per move journaled
+JOURNAL_SCAN_TARGET = 0.000002  # Max secs per move read from the journal
+
+# Positions for the parallel benchmark, (board, player to move)
+PARALLEL_POSITIONS = (
+    ([engine.X] + [engine.empty]*8, engine.O),
+    ([engine.empty]*4 + [engine.X] + [engine.empty]*4, engine.O),
+    ([engine.X, engine.empty, engine.empty, engine.empty, engine.O] + 
+     [engine.empty]*4, engine.X),
+)
+
+# Requests for the latency benchmark: (name, request, reply length)
+LATENCY_REQUESTS = (
+    # AI's reply in a position, ANSR
+    ("query", b"QURY:O,0,2,2,2,1,2,2,2,2", 24),
+    # Game where AI wins on its move, BORD and OVER
+    ("load (2 replies)", b"LOAD:X,1,1,2,0,0,2,2,2,0", 22+24),
+)
+
+
+#==============================================================================
+
+def free_port():
+    """ Return a TCP port that's free for listening on. """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+def start_server(*args):
+    """ Launch the server with `args` and wait for it to be ready.
+        Returns (server:subprocess.Popen, port, secs taken to get ready).
+    """
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, SERVER_PATH, str(port)] +
+                              list(args), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
+    output = ""
+    while "ready" not in output:
+        if time.perf_counter() - start > READY_TIMEOUT:
+            stop_server(server)
+            raise TimeoutError("server not ready in %.0fs" % READY_TIMEOUT)
+        char = server.stdout.read(1)
+        if char == "":
+            raise RuntimeError("server exited: %r" % output)
+        output += char
+    return (server, port, time.perf_counter() - start)
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def report(name, times, target):
+    """ Print median/min/max of `times` (secs) and whether the median is
+        within `target`. Returns True if it is.
+    """
+    median = statistics.median(times)
+    print("  %-36s median %9.3fms  min %9.3fms  max %9.3fms  %s" % (name,
+            median*1000, min(times)*1000, max(times)*1000,
+            "" if target == None else
+            ("OK" if median <= target else "OVER %.0fms" % (target*1000))))
+    return target == None or median <= target
+
+def bench_startup(runs):
+    """ Time building and mapping the engine's snapshot, and server's
+        startup with and without it.
+    """
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "tictac.snapshot")
+
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            engine.Snapshot.build(path)
+            times.append(time.perf_counter() - start)
+        report("snapshot build", times, None)
+
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            engine.Snapshot(path).close()
+            times.append(time.perf_counter() - start)
+        report("snapshot map", times, None)
+
+    for name, args in (("server ready (snapshot)", ()),
+                       ("server ready (no snapshot)", ("--no-snapshot",))):
+        times = []
+        for i in range(runs):
+            server, port, secs = start_server(*args)
+            stop_server(server)
+            times.append(secs)
+        passed &= report(name, times, STARTUP_TARGET)
+
+    return passed
+
+def round_trips(server_addr, request, reply_len, n):
+    """ Send `request` to server and wait for its `reply_len` bytes of 
+        reply `n` times over one connection. Returns list of secs taken.
+    """
+    times = []
+    if isinstance(server_addr, str):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(server_addr)
+    else:
+        conn = socket.create_connection(server_addr)
+    with conn:
+        for i in range(n):
+            start = time.perf_counter()
+            conn.sendall(request)
+            received = 0
+            while received < reply_len:
+                data = conn.recv(reply_len - received)
+                if data == b"":
+                    raise ConnectionError("server closed the connection")
+                received += len(data)
+            times.append(time.perf_counter() - start)
+        conn.sendall(engine.Packet(engine.Packet.close).to_bytes())
+    return times
+
+def bench_latency(runs):
+    """ Time round trips of requests to the server in its socket 
+        configurations.
+    """
+    passed = True
+    unix_path = os.path.join(tempfile.mkdtemp(), "tictac.sock")
+    for config, args in (("nodelay", ()), 
+                         ("nagle", ("--no-nodelay",)),
+                         ("nodelay quickack", ("--quickack",)),
+                         ("unix", ("unix:" + unix_path,))):
+        server, port, secs = start_server(*args)
+        server_addr = unix_path if config == "unix" else ("127.0.0.1", port)
+        try:
+            for name, request, reply_len in LATENCY_REQUESTS:
+                times = []
+                for i in range(runs):
+                    times += round_trips(server_addr, request, 
+                                         reply_len, ROUND_TRIPS)
+                passed &= report("%s, %s" % (name, config), times, 
+                                 LATENCY_TARGET)
+        finally:
+            stop_server(server)
+    os.rmdir(os.path.dirname(unix_path))
+
+    return passed
+
+def bench_lobby(runs):
+    """ Time players joining the matchmaker, every 4th of them leaving
+        before being matched, as FIFO and with rating buckets.
+    """
+    passed = True
+    rnd = random.Random(1)
+    ratings = [rnd.randrange(10000) for i in range(LOBBY_PLAYERS)]
+    for name, bucket_width in (("fifo", None), ("buckets of 100", 100),
+                               ("buckets of 1", 1)):
+        times = []
+        for i in range(runs):
+            matchmaker = server.Matchmaker(bucket_width)
+            start = time.perf_counter()
+            for player, rating in enumerate(ratings):
+                matchmaker.join(player, rating)
+                if player % 4 == 3:
+                    matchmaker.leave(player)
+            times.append((time.perf_counter() - start) / LOBBY_PLAYERS)
+        passed &= report("join, %s (%d waiting)" % (name, 
+                            len(matchmaker)), times, LOBBY_TARGET)
+
+    return passed
+
+def bench_journal(runs):
+    """ Time journaling moves, over several segments, and reading them back
+        (as NumPy arrays if NumPy is installed).
+    """
+    passed = True
+    write_times = []
+    scan_times = []
+    for i in range(runs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = journal.Journal(tmp_dir, segment_size=
+                                     journal.JOURNAL_RECORD.size * 50000)
+            session = writer.new_session()
+            start = time.perf_counter()
+            for move in range(JOURNAL_MOVES):
+                writer.record(session, move % 19683, move % 9, move % 9, 
+                              0.001, journal.by_ai)
+            writer.close()
+            write_times.append((time.perf_counter() - start) / JOURNAL_MOVES)
+
+            reader = journal.JournalReader(tmp_dir)
+            start = time.perf_counter()
+            moves = journal.summarize(reader)["moves"]
+            scan_times.append((time.perf_counter() - start) / moves)
+
+    passed &= report("write", write_times, JOURNAL_WRITE_TARGET)
+    passed &= report("scan (%s)" % ("numpy" if journal.numpy != None else 
+                     "struct"), scan_times, JOURNAL_SCAN_TARGET)
+
+    return passed
+
+def bench_parallel(runs):
+    """ Time searching the PARALLEL_POSITIONS sequentially by minimax and
+        by root split parallel search with 1, 2, ... and all CPUs' worth of
+        workers, and print the speedup over 1 worker.
+    """
+    def search_all(search):
+        start = time.perf_counter()
+        for board, player in PARALLEL_POSITIONS:
+            search(engine.Board(board[:]), player)
+        return time.perf_counter() - start
+
+    report("minimax", [search_all(lambda board, player:
+                        engine.AI.minimax(board, player, True)) 
+                        for i in range(runs)], None)
+
+    cpus = os.cpu_count()
+    print("  (%d CPUs)" % cpus)
+    counts = sorted(set([1, 2] + [2**i for i in range(2, cpus.bit_length())] 
+                        + [cpus]))
+    one_worker = None
+    for workers in counts:
+        parallel = engine.ParallelSearch(workers)
+        try:
+            search_all(parallel.search)     # Start the workers
+            times = [search_all(parallel.search) for i in range(runs)]
+        finally:
+            parallel.close()
+        if one_worker == None:
+            one_worker = statistics.median(times)
+        report("root split, %d workers: %.2fx" % (workers, 
+                one_worker / statistics.median(times)), times, None)
+
+    return True
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "latency": bench_latency,
+    "lobby": bench_lobby,
+    "journal": bench_journal,
+    "parallel": bench_parallel,
+}
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    runs = RUNS
+    names = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--runs="):
+            runs = int(arg[len("--runs="):])
+        elif arg in BENCHMARKS:
+            names.append(arg)
+        else:
+            print(__doc__)
+            exit(2)
+
+    passed = True
+    for name in names or BENCHMARKS:
+        print(name)
+        passed &= BENCHMARKS[name](runs)
+
+    exit(0 if passed else 1)
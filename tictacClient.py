@@ -10,8 +10,18 @@
 
 import socket
 import os
+import sys
 import curses
 import time
+import selectors
+import threading
+import collections
+from random import uniform, choice
+
+import tictacEngine as engine
+import struct
+import bisect
+from array import array
 
 #==============================================================================
 # Symbolic constants
@@ -27,6 +37,7 @@ humanWon = 'C'
 cpuWon   = 'S'
 drawn    = 'N'
 ended    = 'E'
+inPlay   = 'P'  # Game goes on (in query answers)
 
 #==============================================================================
 # Terminal Display
@@ -53,6 +64,10 @@ m_Banner = [(0,0), (1,0), (4,0), (5,0), (10,0), (11,0), (12,0), (13,0), (14,0),
             (0,2), (1,2), (4,2), (5,2), (10,2), (11,2), (12,2), (13,2), (14,2),
     (15,2) ] 
 
+# Banner's pixel map (pixelChar, pixelAttr), built once from m_Banner.
+bannerMap = [[(' ', curses.A_REVERSE if (col,row) in m_Banner else None) 
+                for col in range(16)] for row in range(3)]
+
 
 #==============================================================================
 # Game
@@ -82,6 +97,11 @@ m_X = [(1,1), (2,1),               (5,1), (6,1),
 
 m_empty = []
 
+# Sprites for the squares, built once from pixel maps. 
+# For each of the 5 rows of a square, the list of lit cols.
+spriteO = [[col for col in range(8) if (col,row) in m_O] for row in range(5)]
+spriteX = [[col for col in range(8) if (col,row) in m_X] for row in range(5)]
+
 # Winning cross
 r1 = 1  # row 1
 r2 = 2  # row 2
@@ -117,19 +137,50 @@ arrowUp = "KEY_UP"
 arrowDown = "KEY_DOWN"
 arrowLeft = "KEY_LEFT"
 arrowRight = "KEY_RIGHT"
+pageUpKey = "KEY_PPAGE"
+pageDownKey = "KEY_NPAGE"
 returnKey = "\n"
 
+# Events
+keyEvent = 0    # A key was pressed
+netEvent = 1    # Server connection is readable
+
+idleTickInSecs = 0.5    # Max wait for events when idle (catches resizes)
+busyTickInSecs = 0.1    # Max wait for events while waiting for server
+
 # Game Movements
 up = 0
 down = 1
 left = 2
 right = 3
 random = 4
+pageLeft = 5    # Jump a page of saved games back
+pageRight = 6   # Jump a page of saved games forward
 
 #==============================================================================
 # Networking
 #==============================================================================
 timeOutInSecs = 5
+unixPrefix = "unix:"    # serverIP=unix:/path for server's Unix domain socket
+
+# Reconnecting with exponential backoff (with full jitter)
+backoffBaseInSecs = 0.5
+backoffCapInSecs = 30
+
+# TCP keepalive
+keepIdleInSecs = 30     # Idle time before probing
+keepIntvlInSecs = 10    # Time b/w probes
+keepCnt = 3             # Unanswered probes before dropping connection
+
+# Game engine modes ([NETWORKING] mode=)
+netServer = "server"    # Always play against the server (default)
+netLocal = "local"      # Always play against the in-process engine
+netAuto = "auto"        # In-process engine when server is unreachable
+
+# Connection states
+connOffline = 0     # Waiting before next connection attempt
+connConnecting = 1  # Connection attempt in progress
+connOnline = 2      # Connected to server
 
 # Packet Types
 newGame = b"NEWG"       # Start a new game       'NEWG'
@@ -141,6 +192,8 @@ gameOver    = b"OVER"   # Game is over           'OVER:<C/S/N>,<i>,...<i>'
 closeConn   = b"CLOS"   # Close connection       'CLOS'
 error   = b"EROR"       # Error                  'EROR:<UNKNOWN CMD/BAD MOVE/
                         #                               NO GAME>'
+query   = b"QURY"       # Ask AI's reply         'QURY:<X/O>,<i>,...<i>'
+answer  = b"ANSR"       # AI's reply to query    'ANSR:<C/S/N/P>,<i>,...<i>'
 # Errors
 unknownCmd = 0
 badMove = 1
@@ -194,30 +247,38 @@ class Menu:
         # Check config loading
         if not self.__client.cm.configLoaded:
             self.__message = self.__client.cm.errorMessage
-            # Check Network connection 
-            if not self.__client.nm.connected:
-                self.__message += ' + ' + self.__client.nm.errorMessage
-        else:
-            # Check Network connection 
-            if not self.__client.nm.connected:
-                self.__message = self.__client.nm.errorMessage
+
+        # Connection status last drawn
+        self.__connStatus = None
 
     def run(self):
-        """ Main menu loop. """
+        """ Main menu loop. Redraws only after some input or a change of
+            connection status.
+        """
 
+        redraw = True
         while True:
+
+            # Connection status changed
+            if self.connectionStatus() != self.__connStatus:
+                redraw = True
             
             # Draw menu
-            self.drawMenu()
+            if redraw:
+                self.drawMenu()
+                redraw = False
 
             # Wait for Input
-            key = self.__client.input.getKey()
-            if key == 'q':
-                break
+            for event, key in self.__client.input.waitEvents(idleTickInSecs):
+                if event != keyEvent:
+                    continue
+                redraw = True
+                if key == 'q':
+                    return
 
-            # Process Input
-            if self.handleInput(key) == 1:
-                break
+                # Process Input
+                if self.handleInput(key) == 1:
+                    return
     
     def drawMenu(self):
 
@@ -230,6 +291,10 @@ class Menu:
         # Draw options
         self.drawOptions(6,6)
 
+        # Draw connection status
+        self.__connStatus = self.connectionStatus()
+        self.__client.display.drawText(3, 12, self.__connStatus, curses.A_DIM)
+
         # Draw a message if any
         if self.__message:
             maxX, maxY = self.__client.display.getDisplayDimensions()
@@ -251,16 +316,22 @@ class Menu:
         # Render the menu onto screen
         self.__client.display.render()
 
-    def drawBanner(self, x, y):
-
-        # Create pixelMap
-        bannerMap = [[(' ', None)]*16 for row in range(3)]
+    def connectionStatus(self):
+        """ Returns text describing the connection to server. """
+        nm = self.__client.nm
+        if self.__client.cm.netMode == netLocal:
+            return "Engine: local"
+        elif nm.state != connOnline and self.__client.cm.netMode == netAuto:
+            return "Server: offline (playing locally)"
+        elif nm.state == connOnline:
+            return "Server: connected"
+        elif nm.state == connConnecting:
+            return "Server: connecting..."
+        else:
+            retryIn = max(0, int(nm.nextAttempt - time.time() + 0.999))
+            return "Server: offline (retry in %ds)" % retryIn
 
-        # Light the 'pixels'
-        for row in range(3):
-            for col in range(16):
-                if (col,row) in m_Banner:
-                    bannerMap[row][col] = (' ', curses.A_REVERSE)
+    def drawBanner(self, x, y):
 
         # Draw pixel map
         self.__client.display.drawPixelMap(bannerMap, x, y)
@@ -296,9 +367,11 @@ class Menu:
                         aR = ' '
                     if len(self.__client.cm.savedGames) == 1:
                         aR = ' '
-                    self.__message = "%s(%s)%s" % (aL, 
+                    self.__message = "%s(%s)%s %d/%d" % (aL, 
                             self.__client.cm.savedGames[(
-                                self.__client.cm.selectedGame)], aR)
+                                self.__client.cm.selectedGame)].name, aR,
+                            self.__client.cm.selectedGame+1,
+                            len(self.__client.cm.savedGames))
         else:
             self.__client.display.drawText(x-3, y+1, "Load Saved Game")
 
@@ -335,6 +408,10 @@ class Menu:
             self.movePointer(right)
         elif iKey == arrowLeft or iKey == 'a':
             self.movePointer(left)
+        elif iKey == pageUpKey:
+            self.movePointer(pageLeft)
+        elif iKey == pageDownKey:
+            self.movePointer(pageRight)
 
         # Enter/Space
         elif iKey == returnKey or iKey == ' ':
@@ -395,6 +472,21 @@ class Menu:
                         if self.__client.cm.selectedGame == -1:
                             self.__client.cm.selectedGame = len(
                                     self.__client.cm.savedGames)-1
+
+        elif pDir == pageLeft or pDir == pageRight:
+
+            # iLoadGame
+            if self.__pointer[iLoadGame] == True:
+
+                # Jump a page of saved games, stopping at first/last one
+                if self.__client.cm.saveDirLoaded:
+                    if self.__client.cm.selectedGame != None:
+                        step = SaveIndex.pageSize
+                        if pDir == pageLeft:
+                            step *= -1
+                        self.__client.cm.selectedGame = min(max(
+                                self.__client.cm.selectedGame+step, 0),
+                                len(self.__client.cm.savedGames)-1)
                     
 
 
@@ -420,21 +512,24 @@ class Menu:
 
     def newGame(self):
 
-        # Check network connection
-        if not self.__client.nm.connected:
-            if not self.__client.nm.connect(self.__client.cm.getServAddr()):
-                self.__message = self.__client.nm.errorMessage
-                return
+        # Pick server or local engine
+        link = self.__client.getLink()
+        if link == None:
+            self.__client.nm.reconnectNow()
+            self.__message = "Not connected to server"
+            if self.__client.nm.errorMessage:
+                self.__message += ": " + self.__client.nm.errorMessage
+            return
 
         # Send newGame to server
-        if not self.__client.nm.sendNewGame():
-            self.__message = self.__client.nm.errorMessage
+        if not link.sendNewGame():
+            self.__message = link.errorMessage
             return
 
         # Receive Board from server
-        packet = self.__client.nm.recv()
+        packet = link.recv()
         if packet == None:
-            self.__message = self.__client.nm.errorMessage
+            self.__message = link.errorMessage
             return
         packType = packet[0]
         payload = packet[1]
@@ -456,7 +551,7 @@ class Menu:
 
         # Start a Game from board received
         self.__client.gm.startGame(boardObj, turn, self.showScore, 
-                                    self.__client)
+                                    self.__client, link)
 
     def loadGame(self):
 
@@ -466,21 +561,24 @@ class Menu:
             self.__message = self.__client.cm.errorMessage
             return
 
-        # Check network connection
-        if not self.__client.nm.connected:
-            if not self.__client.nm.connect(self.__client.cm.getServAddr()):
-                self.__message = self.__client.nm.errorMessage
-                return
+        # Pick server or local engine
+        link = self.__client.getLink()
+        if link == None:
+            self.__client.nm.reconnectNow()
+            self.__message = "Not connected to server"
+            if self.__client.nm.errorMessage:
+                self.__message += ": " + self.__client.nm.errorMessage
+            return
         
         # Send the loaded game to server
-        if not self.__client.nm.sendLoadGame(*loadedGame):
-            self.__message = self.__client.nm.errorMessage
+        if not link.sendLoadGame(*loadedGame):
+            self.__message = link.errorMessage
             return
 
         # Receive Board from server
-        packet = self.__client.nm.recv()
+        packet = link.recv()
         if packet == None:
-            self.__message = self.__client.nm.errorMessage
+            self.__message = link.errorMessage
             return
         packType = packet[0]
         payload = packet[1]
@@ -502,11 +600,12 @@ class Menu:
 
         # Start a Game from board received
         self.__client.gm.startGame(boardObj, turn, self.showScore, 
-                                    self.__client)
+                                    self.__client, link)
 
 
     def loadConfig(self):
         self.__client.cm.loadConfigFile(configFile)
+        self.__client.nm.connect(self.__client.cm.getServAddr())
         if self.__client.cm.configLoaded:
             self.__message = "Config loaded successfully."
         else:
@@ -522,8 +621,10 @@ class Menu:
 class Game:
     """ Class for managing and displaying the actual game. """
 
-    def __init__(self, board, turn, showScore ,client):
+    def __init__(self, board, turn, showScore ,client, link=None):
         self.__client = client
+        # Engine the game is played against (NetworkManager/LocalEngine)
+        self.__link = link if link != None else client.nm
         self.board = board
         self.turn = turn
         self.showScore = showScore
@@ -537,28 +638,74 @@ class Game:
                            iReserve: False   # reserved    - True / False
                            }
 
+        # Time the move awaiting server's reply was sent / None
+        self.__pendingSince = None
+
+        # Prefetching: AI's replies to each possible move are asked from 
+        # server while player is deciding.
+        self.__prefetch = client.cm.prefetch and self.__link == client.nm
+        self.__answers = {}     # Position after move -> (result, board[9])
+        self.__queries = collections.deque()    # Positions asked about
+        self.__confirming = collections.deque() # (result, board[9]) shown
+                                                # for moves server hasn't 
+                                                # replied to yet
+
         # Set pointer to an empty square
         if not self.board.isEmpty():
             self.movePointer(random)
 
-    def run(self):
-        """ Main Game loop. """
-
-        while True:
+        self.prefetchReplies()
 
-            # Draw the Game
-            self.drawGame()
+    def run(self):
+        """ Main Game loop. 
+            Waits on keyboard and server connection together, so the game
+            stays responsive while the server is thinking. Redraws only when
+            something changed.
+        """
 
-            # Wait for Input
-            key = self.__client.input.getKey()
-            if key == 'q':
-                if not self.gameOver:
-                    self.end(ended)
-                break
+        try:
+            redraw = True
+            while True:
+
+                # Check on the pending move
+                if self.__pendingSince != None:
+                    if time.time() - self.__pendingSince > timeOutInSecs:
+                        self.__message = (
+                                "Timeout Error while receiving from server")
+                        self.end(ended)
+                    redraw = True   # Animate the thinking indicator
+
+                # Draw the Game
+                if redraw:
+                    self.drawGame()
+                    redraw = False
+
+                # Wait for Input or server
+                conn = None
+                if self.__link.connected:
+                    conn = self.__link.conn
+                tick = idleTickInSecs
+                if self.__pendingSince != None:
+                    tick = busyTickInSecs
+                for event, key in self.__client.input.waitEvents(tick, conn):
+                    redraw = True
+
+                    if event == netEvent:
+                        self.handleReply()
+                        continue
+
+                    if key == 'q':
+                        if self.__pendingSince != None:
+                            self.cancel()
+                        elif not self.gameOver:
+                            self.end(ended)
+                        return
 
-            # Process Input
-            if self.handleInput(key) == 1:
-                break
+                    # Process Input
+                    if self.handleInput(key) == 1:
+                        return
+        finally:
+            self.abandonReplies()
 
     def drawGame(self):
 
@@ -588,6 +735,15 @@ class Game:
                                             curses.A_REVERSE)
             self.__message = None
 
+        # Draw the thinking indicator while waiting for server's move
+        elif self.__pendingSince != None:
+            maxX, maxY = self.__client.display.getDisplayDimensions()
+            maxY -= 2 if DEBUG else 1
+            spinner = "|/-\\"[int(time.time()/busyTickInSecs) % 4]
+            self.__client.display.drawText(0, maxY, 
+                            " Thinking %s  (q to cancel) " % spinner,
+                            curses.A_REVERSE)
+
         # Draw A Debug Bar
         if DEBUG:
             maxX, maxY = self.__client.display.getDisplayDimensions()
@@ -602,25 +758,24 @@ class Game:
 
     def drawBoard(self, bx, by):
 
-        # Get board pixel map
-        boardMap = self.board.createBoardMap()
-
-        # Highlight input pointer
+        # Input pointer
+        pointer = None
         if self.__pointer[iBoard] != False:
             sq_row, sq_col = self.__pointer[iBoard]
 
             if self.board.board[sq_row][sq_col] != empty:
                 raise Exception("Game.drawBoard(): pointer at occupied pos")
 
-            m_sq = m_O if self.turn == O else m_X
-            Board.fillSquare(sq_row, sq_col, m_sq, boardMap, (curses.A_REVERSE 
-                                                              | curses.A_DIM))
+            pointer = (sq_row, sq_col)
 
-
-        # Draw the cross
+        # The cross
+        line = None
         if self.gameOver:
             if self.gameEnd == humanWon or self.gameEnd == cpuWon:
-                Board.addCross(self.board.winLine(), boardMap)
+                line = self.board.winLine()
+
+        # Get board pixel map
+        boardMap = self.board.getBoardMap(pointer, self.turn, line)
        
         # Draw the board
         self.__client.display.drawPixelMap(boardMap, bx, by)
@@ -639,6 +794,10 @@ class Game:
 
 
     def handleInput(self, iKey):
+
+        # Nothing to do till server replies
+        if self.__pendingSince != None:
+            return
         
         # Movements
         if iKey == arrowDown or iKey == 's':
@@ -814,24 +973,111 @@ class Game:
             return self.saveGame()
 
     def move(self, row, col):
+        """ Play a move and send it to server. The reply is handled by
+            handleReply() once it arrives.
+        """
         
         # Update the board
         self.board.move(self.turn, row, col)
         self.__pointer[iBoard] = False
-        self.drawGame()
+        prefetched = self.__answers.get(tuple(Board.linearize(
+                                                    self.board.board)))
         
         # Send Move to server
-        self.__client.nm.sendMove(row,col)
+        if not self.__link.sendMove(row,col):
+            self.__message = self.__link.errorMessage
+            self.end(ended)
+            return
+
+        if prefetched == None:
+            self.__pendingSince = time.time()
+            return
+
+        # Show the prefetched reply now, server's reply will just confirm it
+        self.__confirming.append(prefetched)
+        self.updateFromReply(*prefetched)
+
+    def prefetchReplies(self):
+        """ Ask server for AI's reply to every possible move of player. """
+        if not self.__prefetch or self.gameOver:
+            return
+        if not self.__link.connected:
+            return
+
+        lBoard = Board.linearize(self.board.board)
+        for sq in range(9):
+            if lBoard[sq] != empty:
+                continue
+            position = lBoard[:]
+            position[sq] = self.turn
+            position = tuple(position)
+            if position in self.__answers or position in self.__queries:
+                continue
+            if not self.__link.sendQuery(self.turn^1, position):
+                return
+            self.__queries.append(position)
+
+    def abandonReplies(self):
+        """ Let the replies still due from server be discarded. """
+        n = len(self.__queries) + len(self.__confirming)
+        if n != 0 and self.__link.connected:
+            self.__link.discardReplies(n)
+        self.__queries.clear()
+        self.__confirming.clear()
+
+    def updateFromReply(self, result, boardList):
+        """ Update the game with a reply: the board after AI's move and the
+            result (or inPlay).
+        """
+        # Update Board from reply
+        self.board = Board(Board.convertTo2D(boardList))
+
+        if result != inPlay:
+            self.end(result)
+            return
+
+        # Move pointer to an random empty square as game's not over.
+        self.movePointer(random)
+        self.prefetchReplies()
+
+    def cancel(self):
+        """ Abort the game while server's reply to a move is pending. """
+        self.__pendingSince = None
+        if self.__link.sendEndGame():
+            # Replies to both the MOVE and ENDG are still on their way
+            self.__link.discardReplies(2)
+        self.end(ended)
+
+    def handleReply(self):
+        """ Receive and handle a packet from server. """
 
         # Get Reply from server
-        packet = self.__client.nm.recv()
+        packet = self.__link.recv()
         if packet == None:
-            self.__message = self.__client.nm.errorMessage
+            self.__pendingSince = None
+            self.__message = self.__link.errorMessage
             # End Game
             self.end(ended)
             return
         packType = packet[0]
         payload = packet[1]
+
+        # Answer to a query
+        if packType == answer:
+            if self.__queries:
+                self.__answers[self.__queries.popleft()] = payload
+            return
+        self.__pendingSince = None
+
+        # Reply to a move already played from prefetched reply
+        if self.__confirming:
+            shown = self.__confirming.popleft()
+            if packType == board and shown == (inPlay, payload):
+                return
+            if packType == gameOver and shown == payload:
+                return
+            self.__message = "Server's reply differed from prefetched one"
+
         if packType == error:
             if payload == unknownCmd:
                 self.__message = "Invalid packet sent to server"
@@ -842,26 +1088,28 @@ class Game:
             # End Game
             self.end(ended)
             return
+        if packType == closeConn:
+            self.__message = "Connection closed by server"
+            self.end(ended)
+            return
         if packType != board and packType != gameOver:
             self.__message = "Wrong reply. Was excepting 'BORD'|'OVER'."
             # End Game
             self.end(ended)
             return
+        if self.gameOver:
+            return  # Nothing to update on an ended game
 
         if packType == gameOver:
-            self.end(payload[0])
-            payload = payload[1]
-
-        boardGrid = Board.convertTo2D(payload)
-
-        # Update Board from reply
-        self.board = Board(boardGrid)
-
-        # Move pointer to an random empty square if the game's not over.
-        if not self.gameOver:
-            self.movePointer(random)
+            self.updateFromReply(*payload)
+        else:
+            self.updateFromReply(inPlay, payload)
 
     def end(self, gameEnd):
+        if self.__pendingSince != None:
+            # Server's reply to the move is late, it's no use now.
+            self.__pendingSince = None
+            self.__link.discardReplies(1)
         self.gameOver = True
         self.__client.gm.gameOver = True
         self.gameEnd = gameEnd
@@ -902,6 +1150,9 @@ class Board:
     """ Class for representing game Board. 
         A board occupies 28x17 char-cells in total.
     """
+    # Rendered board maps keyed by (board, pointer, pointerShape, line)
+    mapCache = {}
+    mapCacheSize = 4096
     
     def __init__(self, board=None):
         if board == None:
@@ -993,10 +1244,37 @@ class Board:
         self.board[row][col] = shape
 
     
-    def createBoardMap(self):
-        """ Takes a 3x3 board 2d-array and returns a 28x17 char-cell grid with
-            each cell value & attributes as (value, attrs).
+    def getBoardMap(self, pointer=None, pointerShape=None, line=None):
+        """ Returns the 28x17 pixel map of the board with the input pointer
+            at `pointer` (row,col) drawn dimly as `pointerShape` and the 
+            winning cross across `line`. 
+            Maps are cached, so the returned map must not be modified.
         """
+        key = (tuple(Board.linearize(self.board)), pointer, 
+                pointerShape if pointer != None else None, line)
+        boardMap = Board.mapCache.get(key)
+        if boardMap != None:
+            return boardMap
+
+        boardMap = self.createBoardMap()
+
+        # Highlight input pointer
+        if pointer != None:
+            sprite = spriteO if pointerShape == O else spriteX
+            Board.fillSquare(pointer[0], pointer[1], sprite, boardMap, 
+                                (curses.A_REVERSE | curses.A_DIM))
+
+        # Draw the cross
+        Board.addCross(line, boardMap)
+
+        if len(Board.mapCache) >= Board.mapCacheSize:
+            Board.mapCache.clear()
+        Board.mapCache[key] = boardMap
+        return boardMap
+
+    @staticmethod
+    def createEmptyMap():
+        """ Returns 28x17 char-cell grid of an empty board. """
 
         # Initialize an empty board "pixel" map.
         boardMap = [[(" ", None)]*28 for row in range(17)]
@@ -1011,6 +1289,16 @@ class Board:
             for col in range(28):
                 boardMap[row][col] = (" ", curses.A_REVERSE)
 
+        return boardMap
+
+    def createBoardMap(self):
+        """ Takes a 3x3 board 2d-array and returns a 28x17 char-cell grid with
+            each cell value & attributes as (value, attrs).
+        """
+
+        # Copy of the empty board "pixel" map.
+        boardMap = [row[:] for row in emptyBoardMap]
+
         # Fill in squares
         for sq_row in range(len(self.board)):
             for sq_col in range(len(self.board[0])):
@@ -1019,36 +1307,30 @@ class Board:
                 if self.board[sq_row][sq_col] == empty:
                     continue
                 elif self.board[sq_row][sq_col] == O:
-                    m_sq = m_O
+                    sprite = spriteO
                 elif self.board[sq_row][sq_col] == X:
-                    m_sq = m_X
+                    sprite = spriteX
 
                 # Paint the square
-                Board.fillSquare(sq_row, sq_col, m_sq, boardMap, 
+                Board.fillSquare(sq_row, sq_col, sprite, boardMap, 
                                     curses.A_REVERSE)
         
         return boardMap
                 
     @staticmethod
-    def fillSquare(row, col, m_sq, boardMap, attr):
-        """ Fill an particular square with pixel map `m_sq` """
+    def fillSquare(row, col, sprite, boardMap, attr):
+        """ Fill an particular square with `sprite` (see spriteO/spriteX) """
         
         # Translate 3x3 board's (row,col) to 28x17 pixelMap's row,col
         # sq_width+margin = 10
         # sq_height+margin = 6
         pMapRow, pMapCol = (row*6, col*10)
 
-        # Draw a dim highlighted move in this square
-        for m_row in range(pMapRow, pMapRow+5):
-            for m_col in range(pMapCol, pMapCol+8):
-                
-                # Transform m_row,m_col relative to row,col
-                r_row = m_row - pMapRow
-                r_col = m_col - pMapCol
-
-                # Dim Light the cell
-                if (r_col, r_row) in m_sq:
-                    boardMap[m_row][m_col] = (" ", attr )
+        # Light the sprite's cells in this square
+        for r_row, r_cols in enumerate(sprite):
+            mapRow = boardMap[pMapRow+r_row]
+            for r_col in r_cols:
+                mapRow[pMapCol+r_col] = (" ", attr)
         
     @staticmethod
     def addCross(line, boardMap):
@@ -1074,50 +1356,163 @@ class Board:
 
 
         # Set cross chars
-        for pRow in range(len(boardMap)):
-            for pCol in range(len(boardMap[0])):
-                if (pCol, pRow) in m_crossT[line]:
-                    boardMap[pRow][pCol] = (crossCh, boardMap[pRow][pCol][1])
+        for pCol, pRow in m_crossT[line]:
+            boardMap[pRow][pCol] = (crossCh, boardMap[pRow][pCol][1])
+
+# Pixel map of an empty board, built once.
+emptyBoardMap = Board.createEmptyMap()
 
 class NetworkManager:
-    """ Class for managing networking with server """
-    serverAddr:tuple    # (IP_addr, port) for server
+    """ Class for managing networking with server.
+        Connecting happens in a background thread, which keeps reconnecting
+        with exponential backoff whenever the connection is lost. All the
+        sending/receiving happens on the caller's thread, and only when
+        `connected`.
+    """
+    serverAddr:tuple    # (IP_addr, port) for server, or str path of its 
+                        # Unix domain socket
     conn:socket.socket  # Socket connected to game server
     connected:bool
+    state:int           # connOffline/connConnecting/connOnline
+    nextAttempt:float   # Time of next connection attempt when connOffline
     errorMessage:str    # Error message for connection 
 
     def __init__(self, serverAddr):
         self.serverAddr = serverAddr
         self.conn = None
         self.connected = False
+        self.state = connConnecting
+        self.nextAttempt = 0
         self.errorMessage = "Server Connection not initialized"
+        self.__discard = 0  # Num of coming replies nobody is waiting for
 
-        self.connect(self.serverAddr)
+        self.__attempts = 0 # Failed attempts since last connection
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__stop = False
+        self.__connector = threading.Thread(target=self.__connectLoop, 
+                                            daemon=True)
+        self.__connector.start()
 
 
     def connect(self, serverAddr):
+        """ Connect to `serverAddr` in background, dropping the current 
+            connection if it's to another address. 
+            Returns True if already connected.
+        """
+        with self.__lock:
+            if serverAddr != self.serverAddr:
+                self.serverAddr = serverAddr
+                if self.connected:
+                    self.conn.close()
+                    self.connected = False
+        self.reconnectNow()
+        return self.connected
+
+    def reconnectNow(self):
+        """ Skip the backoff wait before next connection attempt. """
+        self.__attempts = 0
+        self.__wake.set()
+
+    def __connectionLost(self):
+        """ Drop the connection and let the connector thread reconnect. """
+        with self.__lock:
+            if self.connected:
+                self.conn.close()
+                self.connected = False
+                self.state = connOffline
+                self.nextAttempt = time.time()
+        self.__wake.set()
+
+    def __connectLoop(self):
+        """ Connector thread: (re)connect to server whenever disconnected. """
+        while not self.__stop:
+            if self.connected:
+                # Sleep till connection is lost or address changes
+                self.__wake.wait()
+                self.__wake.clear()
+                continue
+
+            self.state = connConnecting
+            serverAddr = self.serverAddr
+            conn = self.__createConnection(serverAddr)
+            if self.__stop:
+                break
+
+            if conn != None:
+                with self.__lock:
+                    if serverAddr != self.serverAddr:
+                        # Address changed while connecting, retry new one
+                        conn.close()
+                        continue
+                    self.conn = conn
+                    self.__discard = 0
+                    self.__attempts = 0
+                    self.errorMessage = None
+                    self.connected = True
+                    self.state = connOnline
+                continue
+
+            # Backoff with full jitter before next attempt
+            delay = uniform(0, min(backoffCapInSecs, 
+                                    backoffBaseInSecs * 2**self.__attempts))
+            self.__attempts = min(self.__attempts+1, 16)
+            self.nextAttempt = time.time() + delay
+            self.state = connOffline
+            self.__wake.wait(delay)
+            self.__wake.clear()
+
+    def __createConnection(self, serverAddr):
+        """ Returns a socket connected to `serverAddr` or None on failure. """
 
         # Create a connected socket with game server
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.settimeout(timeOutInSecs)
+        if isinstance(serverAddr, str):
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.settimeout(timeOutInSecs)
         try:
-            self.conn.connect(serverAddr)
+            conn.connect(serverAddr)
         except socket.timeout:
             self.errorMessage = (
                         "Unable to connect to server: Connection timeout")
-            self.connected = False
         except socket.gaierror:
             self.errorMessage = "Unable to connect to server: socket.gaierror"
-            self.connected = False
         except OSError:
             self.errorMessage = "Unable to connect to server"
-            self.connected = False
         else:
-            self.errorMessage = None
-            self.connected = True
+            if conn.family == socket.AF_INET:
+                NetworkManager.setKeepAlive(conn)
+            return conn
+
+        conn.close()
+        return None
+
+    @staticmethod
+    def setKeepAlive(conn):
+        """ Enable TCP keepalive probes on `conn`, so a dead server is noticed
+            even when idle.
+        """
+        try:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                                keepIdleInSecs)
+            if hasattr(socket, "TCP_KEEPINTVL"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                                keepIntvlInSecs)
+            if hasattr(socket, "TCP_KEEPCNT"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT,
+                                keepCnt)
+        except OSError:
+            pass
 
     def __del__(self):
 
+        # Stop the connector thread
+        self.__stop = True
+        self.__wake.set()
+
         # Gracefully disconnect
         if self.connected:
             self.sendClose()
@@ -1162,13 +1557,15 @@ class NetworkManager:
         if not self.connected:
             raise Exception("nm: sendNewGame()- No connection established")
 
-        # Flush the network buffer
-        self.__flush()
+        # Flush the network buffer (unless replies to discard are due)
+        if self.__discard == 0:
+            self.__flush()
 
         try:
             self.conn.sendall(newGame)
         except OSError:
             self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
             return False
         
         return True
@@ -1184,6 +1581,7 @@ class NetworkManager:
             self.conn.sendall(endGame)
         except OSError:
             self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
             return False
         
         return True
@@ -1200,6 +1598,7 @@ class NetworkManager:
             self.conn.sendall(move+b':'+payload)
         except OSError:
             self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
             return False
         
         return True
@@ -1224,6 +1623,27 @@ class NetworkManager:
             self.conn.sendall(loadGame+b':'+payload)
         except OSError:
             self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
+            return False
+        
+        return True
+
+    def sendQuery(self, turn, board):
+        """ Send query packet ('QURY:t,i,i,i,i,i,i,i,i,i') to server, asking
+            for AI's reply in position `board` with AI playing `turn`.
+            Returns False on fail/ True on success
+        """
+        if not self.connected:
+            raise Exception("nm: sendQuery()- No connection established")
+
+        turn = 'O' if turn == O else 'X'
+        boardStr = ",".join(str(i) for i in board)
+        payload = bytes(f"{turn},{boardStr}", "UTF-8")
+        try:
+            self.conn.sendall(query+b':'+payload)
+        except OSError:
+            self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
             return False
         
         return True
@@ -1239,10 +1659,15 @@ class NetworkManager:
             self.conn.sendall(closeConn)
         except OSError:
             self.errorMessage = "Error while trying to send to server"
+            self.__connectionLost()
             return False
         
         return True
 
+    def discardReplies(self, n):
+        """ Make recv() skip the next `n` packets from server. """
+        self.__discard += n
+
     def recv(self):
         """ Recieves a packet from server and returns (PackType, Payload) 
             Return None on failure.
@@ -1250,8 +1675,17 @@ class NetworkManager:
                error        unknownCmd|badMove|noGame
                board         int[9]
                gameOver     (result, int[9])
+               answer       (result|inPlay, int[9])
                closeConn     None
         """
+        while self.__discard > 0:
+            self.__discard -= 1
+            if self.__recvPacket() == None:
+                self.__discard = 0
+                return None
+        return self.__recvPacket()
+
+    def __recvPacket(self):
         if not self.connected:
             raise Exception("nm: recv()- No connection established")
 
@@ -1262,6 +1696,7 @@ class NetworkManager:
             if packType == b'': # Connection closed
                 self.errorMessage = (
                         "Connection closed by server while receiving")
+                self.__connectionLost()
                 return None
 
             elif packType == error:
@@ -1318,7 +1753,7 @@ class NetworkManager:
 
                 return (board, payload)
 
-            elif packType == gameOver:
+            elif packType == gameOver or packType == answer:
                 # Payload Seperator
                 if self.recvSep() == None:
                     return None
@@ -1337,8 +1772,10 @@ class NetworkManager:
                 payloadStr = str(payload, "UTF-8")
                 result, payloadStr = payloadStr.split(",", maxsplit=1)
                 payloadList = payloadStr.split(",")
-                if result not in (humanWon, cpuWon, drawn) or (
-                    len(payloadList) != 9):
+                results = (humanWon, cpuWon, drawn)
+                if packType == answer:
+                    results += (inPlay,)
+                if result not in results or len(payloadList) != 9:
 
                     self.errorMessage = "Error while receiving from server"
                     self.__flush()
@@ -1351,7 +1788,7 @@ class NetworkManager:
                     self.__flush()
                     return None
 
-                return (gameOver, (result,payload))
+                return (packType, (result,payload))
 
             elif packType == closeConn:
                 return (closeConn, None)
@@ -1359,6 +1796,10 @@ class NetworkManager:
         except socket.timeout:
             self.errorMessage = "Timeout Error while receiving from server"
             return None
+        except OSError:
+            self.errorMessage = "Error while receiving from server"
+            self.__connectionLost()
+            return None
 
 
 
@@ -1404,18 +1845,196 @@ class NetworkManager:
 
 
 
+class LocalEngine:
+    """ In-process stand-in for NetworkManager. 
+        Runs the server's game logic and CPU player (tictacEngine) directly,
+        so no server is needed. Replies are queued as (PackType, Payload) and
+        signalled through a socketpair, so they can be waited on just like
+        the server's.
+    """
+    conn:socket.socket  # Readable when a reply is queued
+    connected:bool
+    state:int
+    errorMessage:str
+
+    def __init__(self):
+        self.connected = True
+        self.state = connOnline
+        self.errorMessage = None
+        self.conn, self.__signal = socket.socketpair()
+        self.__replies = collections.deque()
+        self.__discard = 0
+        self.__game = engine.Game()
+        self.__ai = engine.AI()
+
+    def connect(self, serverAddr):
+        return True
+
+    def reconnectNow(self):
+        pass
+
+    def __reply(self, packType, payload):
+        self.__replies.append((packType, payload))
+        self.__signal.send(b'.')
+
+    def __aiMove(self):
+        x, y, evaluation = self.__ai.best_move(self.__game.board)
+        self.__game.move(x, y)
+
+    def __replyBoardOrOver(self):
+        """ Reply with the board, or the result if the game has ended. """
+        game = self.__game
+        if not game.game_ended:
+            self.__reply(board, game.board.board[:])
+            return
+
+        if game.game_result == self.__ai.player:
+            result = cpuWon
+        elif game.game_result == self.__ai.player^1:
+            result = humanWon
+        else:
+            result = drawn
+        self.__reply(gameOver, (result, game.board.board[:]))
+
+    def sendNewGame(self):
+        self.__game.start_new_game()
+        self.__ai.set_player(choice((X,O)))
+        if self.__ai.player == X:
+            self.__aiMove()
+        self.__reply(board, self.__game.board.board[:])
+        return True
+
+    def sendEndGame(self):
+        if not self.__game.game_on:
+            self.__reply(error, noGame)
+            return True
+        self.__game.end_game()
+        self.__replyBoardOrOver()
+        return True
+
+    def sendMove(self, row, col):
+        if not self.__game.game_on:
+            self.__reply(error, noGame)
+            return True
+        if self.__game.board[row*3+col] != empty:
+            self.__reply(error, badMove)
+            return True
+
+        self.__game.move(col, row)
+        if not self.__game.game_ended:
+            self.__aiMove()
+        self.__replyBoardOrOver()
+        return True
+
+    def sendLoadGame(self, turn, boardList):
+        if turn not in (X,O):
+            raise Exception("engine: sendLoadGame()- Invalid `turn`")
+
+        self.__ai.set_player(turn^1)
+        self.__game.load_game(engine.Board(boardList[:]))
+        if not self.__game.game_ended:
+            if self.__game.turn == self.__ai.player:
+                self.__aiMove()
+            self.__reply(board, self.__game.board.board[:])
+        if self.__game.game_ended:
+            self.__replyBoardOrOver()
+        return True
+
+    def sendClose(self):
+        self.__reply(closeConn, None)
+        return True
+
+    def discardReplies(self, n):
+        """ Make recv() skip the next `n` replies. """
+        self.__discard += n
+
+    def recv(self):
+        """ Returns the next reply as (PackType, Payload), see 
+            NetworkManager.recv(). Returns None if there's none.
+        """
+        while self.__replies:
+            self.conn.recv(1)
+            packet = self.__replies.popleft()
+            if self.__discard > 0:
+                self.__discard -= 1
+                continue
+            return packet
+
+        self.errorMessage = "No reply from local engine"
+        return None
+
+
 class InputManager:
     """ Class for managing user input from console """
     
-    def __init__(self, term):
+    def __init__(self, term, display=None):
         self.__terminal = term
+        self.__display = display
+
+        # Wait on stdin and (optionally) a socket together
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(sys.stdin, selectors.EVENT_READ, keyEvent)
+        self.__conn = None
 
     def getKey(self):
         """ Retrives the key pressed in draw mode as str.
             Note: This function will wait till a key is pressed.
         """
         assert self.__terminal.mode == draw
-        return self.__terminal.getScreen().getkey()
+        key = self.__terminal.getScreen().getkey()
+
+        # Terminal was resized
+        if key == "KEY_RESIZE" and self.__display != None:
+            self.__display.refreshDimensions()
+
+        return key
+
+    def waitEvents(self, timeout=None, conn=None):
+        """ Wait till a key is pressed or socket `conn` becomes readable, for
+            at most `timeout` secs. 
+            Returns a list of (keyEvent, key:str) and (netEvent, None) events,
+            empty if timed out.
+        """
+        assert self.__terminal.mode == draw
+
+        # Watch the socket
+        if conn != self.__conn:
+            if self.__conn != None:
+                self.__selector.unregister(self.__conn)
+            self.__conn = None
+            if conn != None and conn.fileno() != -1:
+                self.__selector.register(conn, selectors.EVENT_READ, netEvent)
+                self.__conn = conn
+
+        # curses might already hold keys read from stdin
+        keys = self.__readKeys()
+
+        events = []
+        for selKey, mask in self.__selector.select(0 if keys else timeout):
+            if selKey.data == netEvent:
+                events.append((netEvent, None))
+            else:
+                keys += self.__readKeys()
+
+        return [(keyEvent, key) for key in keys] + events
+
+    def __readKeys(self):
+        """ Returns list of keys pressed, without waiting. """
+        stdscr = self.__terminal.getScreen()
+        keys = []
+        stdscr.nodelay(True)
+        try:
+            while True:
+                key = stdscr.getkey()
+                # Terminal was resized
+                if key == "KEY_RESIZE" and self.__display != None:
+                    self.__display.refreshDimensions()
+                keys.append(key)
+        except curses.error:    # No more input
+            pass
+        finally:
+            stdscr.nodelay(False)
+        return keys
 
     def input(prompt):
         """ Take input from console (normal mode) after prompt."""
@@ -1426,7 +2045,11 @@ class InputManager:
 
 
 class DisplayManager:
-    """ Class for managing the output display. """
+    """ Class for managing the output display. 
+        Everything is drawn into a back buffer of (char, attr) cells. On
+        render() the back buffer is diffed against the last rendered frame
+        and only the runs of changed cells are written to the screen.
+    """
     displayMode:int # draw/normal
 
     def __init__(self, term, displayMode=draw):
@@ -1436,11 +2059,21 @@ class DisplayManager:
         self.__terminal.setMode(draw)
         self.displayMode = draw
 
+        self.refreshDimensions()
+
+    def refreshDimensions(self):
+        """ Re-read screen dimensions and repaint the whole screen on next
+            render(). Call it when the terminal is resized.
+        """
+        assert self.displayMode == draw
+        self.__rows, self.__cols = self.__terminal.getScreen().getmaxyx()
+        self.__front = None     # Last rendered frame, None if unknown
+        self.clear()
+
     def getDisplayDimensions(self):
-        """ Returns (numOfRows, numOfColumns) in the display """
+        """ Returns (numOfColumns, numOfRows) in the display """
         assert self.displayMode == draw
-        y,x = self.__terminal.getScreen().getmaxyx()
-        return (x,y)
+        return (self.__cols, self.__rows)
 
     def drawPixelMap(self, pMap, o_x, o_y):
         """ Draw a 2d pixel map onto screen with origin at (o_x,o_y).
@@ -1449,43 +2082,66 @@ class DisplayManager:
         if o_x < 0 or o_y < 0:
             raise Exception("Display: drawPixelMap - invalid origin coords")
 
-        n_rows = len(pMap)
-        n_cols = len(pMap[0])
-
-        stdscr = self.__terminal.getScreen()
-
         # y is row no. and x is col no.
-        for y in range(n_rows):
-            for x in range(n_cols):
-                char, attr = pMap[y][x]
-                maxyx = stdscr.getmaxyx()
-                if (o_y+y) >= maxyx[0] or (o_x+x) >= maxyx[1]:
-                    continue
-                if attr == None:
-                    stdscr.addch(o_y+y, o_x+x, char)
-                else:
-                    stdscr.addch(o_y+y, o_x+x, char, attr)
+        for y in range(min(len(pMap), self.__rows-o_y)):
+            n_cols = min(len(pMap[y]), self.__cols-o_x)
+            if n_cols <= 0:
+                break
+            self.__back[o_y+y][o_x:o_x+n_cols] = [
+                    (char, attr or curses.A_NORMAL) 
+                    for char, attr in pMap[y][:n_cols]]
 
     def drawText(self, x, y, text, attr=None):
 
-        stdscr = self.__terminal.getScreen()
-        for ch in text:
-            maxyx = stdscr.getmaxyx()
-            if y >= maxyx[0] or x >= maxyx[1]:
-                break
-            if attr == None:
-                stdscr.addch(y, x, ch)
-            else:
-                stdscr.addch(y, x, ch, attr)
-            x += 1
+        if y >= self.__rows or x >= self.__cols:
+            return
+        text = text[:self.__cols-x]
+        attr = attr or curses.A_NORMAL
+        self.__back[y][x:x+len(text)] = [(ch, attr) for ch in text]
     
     def clear(self):
         """ Clear the previous stuff drawn to screen. """
-        self.__terminal.getScreen().erase()
+        self.__back = [[(' ', curses.A_NORMAL)]*self.__cols 
+                        for row in range(self.__rows)]
 
     def render(self):
         """ Render the stuff drawn on screen. """
-        self.__terminal.getScreen().refresh()
+        stdscr = self.__terminal.getScreen()
+
+        if self.__front == None:
+            # Unknown screen contents, start from a blank one
+            stdscr.erase()
+            self.__front = [[(' ', curses.A_NORMAL)]*self.__cols 
+                            for row in range(self.__rows)]
+
+        for y in range(self.__rows):
+            backRow = self.__back[y]
+            frontRow = self.__front[y]
+            if backRow == frontRow:
+                continue
+
+            # Write runs of changed cells sharing an attribute
+            x = 0
+            while x < self.__cols:
+                if backRow[x] == frontRow[x]:
+                    x += 1
+                    continue
+                attr = backRow[x][1]
+                start = x
+                while (x < self.__cols and backRow[x] != frontRow[x] and 
+                        backRow[x][1] == attr):
+                    x += 1
+                try:
+                    stdscr.addstr(y, start, "".join(cell[0] for cell in 
+                                                backRow[start:x]), attr)
+                except curses.error:
+                    # Writing the bottom-right cell moves the cursor off 
+                    # screen, the cell itself is written.
+                    pass
+
+        stdscr.refresh()
+        self.__front = self.__back
+        self.clear()
 
     def printToConsole(*args, **kwargs):
         """ Print to console when in normal mode """
@@ -1556,6 +2212,466 @@ class Terminal:
         self.__stdscr = None
 
 
+class SaveRecord:
+    """ Index entry for a saved game """
+    __slots__ = ("name", "timestamp", "turn", "moves")
+    name:str
+    timestamp:int   # Time of saving
+    turn:int        # X/O, or None for a corrupted save file
+    moves:int       # Num of occupied squares
+
+    def __init__(self, name, timestamp, turn, moves):
+        self.name = name
+        self.timestamp = timestamp
+        self.turn = turn
+        self.moves = moves
+
+
+class SaveIndex:
+    """ Persistent index of the games saved in saveDir.
+        The index lives in '<saveDir>/.saveindex' as a header followed by
+        fixed-size records, so the i-th saved game can be read with a seek.
+        Records are read lazily a page at a time. The header remembers the
+        mtime of saveDir, so saveDir is only scanned when something else has
+        added or removed files in it.
+    """
+    saveDir:str
+    indexFile:str
+    nextSaveNo:int  # Used for naming the next save file
+
+    magic = b"TTGI"
+    version = 1
+    indexName = ".saveindex"
+    pageSize = 64
+
+    # magic, version, saveDir's mtime_ns, nextSaveNo, num of records
+    headerFmt = "<4sHqQQ"
+    # name, timestamp, turn (255 if corrupted), moves
+    recordFmt = "<64sqBB"
+
+    def __init__(self, saveDir):
+        self.saveDir = saveDir
+        self.indexFile = os.path.join(saveDir, self.indexName)
+        self.nextSaveNo = 0
+        self.__count = 0
+        self.__page = None      # (pageNo, [SaveRecord])
+        self.__records = None   # All records, if index couldn't be written
+
+        dirMtime = self.__loadHeader()
+        if dirMtime == None:
+            self.rebuild()
+        elif dirMtime != self.__dirMtime():
+            self.rescan()
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, i):
+        """ Returns the i-th SaveRecord. Reads its page from index if needed.
+        """
+        if not (0 <= i < self.__count):
+            raise IndexError("SaveIndex: index out of range")
+
+        if self.__records != None:
+            return self.__records[i]
+
+        pageNo = i // self.pageSize
+        if self.__page == None or self.__page[0] != pageNo:
+            start = pageNo * self.pageSize
+            n = min(self.pageSize, self.__count - start)
+            with open(self.indexFile, 'rb') as f:
+                f.seek(struct.calcsize(self.headerFmt) + 
+                            start*struct.calcsize(self.recordFmt))
+                data = f.read(n*struct.calcsize(self.recordFmt))
+            self.__page = (pageNo, [SaveIndex.unpackRecord(fields) 
+                    for fields in struct.iter_unpack(self.recordFmt, data)])
+
+        return self.__page[1][i % self.pageSize]
+
+    @classmethod
+    def packRecord(self, record):
+        return struct.pack(self.recordFmt, bytes(record.name, "UTF-8"),
+                            record.timestamp, 
+                            255 if record.turn == None else record.turn,
+                            record.moves)
+
+    @staticmethod
+    def unpackRecord(fields):
+        name, timestamp, turn, moves = fields
+        return SaveRecord(str(name.rstrip(b"\0"), "UTF-8"), timestamp,
+                            None if turn == 255 else turn, moves)
+
+    def add(self, turn, board):
+        """ Write a new save file and index it.
+            Returns the save name or None on failure.
+        """
+        # Pick a fresh name, save files might've been made by someone else
+        while True:
+            saveName = f"save{self.nextSaveNo}"
+            self.nextSaveNo += 1
+            try:
+                with open(os.path.join(self.saveDir, saveName), 'x') as f:
+                    f.write(str(turn))
+                    f.write(' ')
+                    f.write(",".join(str(i) for i in board))
+                break
+            except FileExistsError:
+                continue
+            except OSError:
+                return None
+
+        record = SaveRecord(saveName, int(time.time()), turn,
+                            sum(1 for sq in board if sq != empty))
+        if self.__records != None:
+            self.__records.append(record)
+            self.__count += 1
+            return saveName
+        try:
+            with open(self.indexFile, 'r+b') as f:
+                f.seek(struct.calcsize(self.headerFmt) + 
+                            self.__count*struct.calcsize(self.recordFmt))
+                f.write(SaveIndex.packRecord(record))
+                self.__count += 1
+                f.seek(0)
+                f.write(self.__packHeader())
+        except OSError:
+            # Save file is there, next scan will index it.
+            return saveName
+
+        # Appended record might belong to the cached page
+        self.__page = None
+        return saveName
+
+    def rebuild(self):
+        """ Index saveDir from scratch. """
+        self.__writeIndex([self.__recordFor(entry) 
+                            for entry in self.__scanDir()])
+
+    def rescan(self):
+        """ Bring index up to date with saveDir's contents. """
+        onDisk = {entry.name: entry for entry in self.__scanDir()}
+        records = [record for record in self.__iterRecords() 
+                    if record.name in onDisk]
+        indexed = set(record.name for record in records)
+        records += [self.__recordFor(onDisk[name]) for name in onDisk 
+                    if name not in indexed]
+        self.__writeIndex(records)
+
+    def __scanDir(self):
+        for entry in os.scandir(self.saveDir):
+            if entry.name.startswith('.'):  # Index and its temp files
+                continue
+            if not entry.is_file():
+                continue
+            if len(bytes(entry.name, "UTF-8")) > 64:
+                continue
+            yield entry
+
+    def __recordFor(self, entry):
+        """ Make a SaveRecord for save file at os.DirEntry `entry`. """
+        try:
+            turn, board = engine.read_save(entry.path)
+        except (ValueError, OSError):
+            turn, board = None, []
+        try:
+            timestamp = int(entry.stat().st_mtime)
+        except OSError:
+            timestamp = 0
+
+        # Keep new names clear of existing 'save<n>' files
+        if entry.name.startswith("save") and entry.name[4:].isdigit():
+            self.nextSaveNo = max(self.nextSaveNo, int(entry.name[4:])+1)
+
+        return SaveRecord(entry.name, timestamp, turn, 
+                            sum(1 for sq in board if sq != empty))
+
+    def __iterRecords(self):
+        if self.__records != None:
+            yield from self.__records
+            return
+        recordSize = struct.calcsize(self.recordFmt)
+        with open(self.indexFile, 'rb') as f:
+            f.seek(struct.calcsize(self.headerFmt))
+            for page in range(0, self.__count, self.pageSize):
+                data = f.read(recordSize*min(self.pageSize, 
+                                                self.__count-page))
+                for fields in struct.iter_unpack(self.recordFmt, data):
+                    yield SaveIndex.unpackRecord(fields)
+
+    def __dirMtime(self):
+        try:
+            return os.stat(self.saveDir).st_mtime_ns
+        except OSError:
+            return None
+
+    def __packHeader(self):
+        return struct.pack(self.headerFmt, self.magic, self.version,
+                            self.__dirMtime() or 0, self.nextSaveNo, 
+                            self.__count)
+
+    def __loadHeader(self):
+        """ Returns saveDir's mtime recorded in index or None if there's no
+            valid index.
+        """
+        try:
+            with open(self.indexFile, 'rb') as f:
+                header = f.read(struct.calcsize(self.headerFmt))
+                size = os.fstat(f.fileno()).st_size
+            magic, version, dirMtime, nextSaveNo, count = struct.unpack(
+                                                    self.headerFmt, header)
+        except (OSError, struct.error):
+            return None
+        if magic != self.magic or version != self.version:
+            return None
+        if size < len(header) + count*struct.calcsize(self.recordFmt):
+            return None
+
+        self.nextSaveNo = nextSaveNo
+        self.__count = count
+        return dirMtime
+
+    def __writeIndex(self, records):
+        self.__count = len(records)
+        self.__page = None
+        tmpFile = self.indexFile + ".tmp"
+        try:
+            with open(tmpFile, 'wb') as f:
+                f.write(self.__packHeader())
+                for record in records:
+                    f.write(SaveIndex.packRecord(record))
+            os.replace(tmpFile, self.indexFile)
+        except OSError:
+            # Keep the index in memory for this session
+            self.__records = records
+            return
+        self.__records = None
+
+        # Writing the index touched saveDir, record the new mtime
+        try:
+            with open(self.indexFile, 'r+b') as f:
+                f.write(self.__packHeader())
+        except OSError:
+            pass
+
+
+class ScoreIndex:
+    """ Indexed store for the plain-text score file.
+        Keeps a sorted array of timestamps for each result, so counting the
+        scores within any time window costs two bisects per result. The
+        arrays are persisted in a '<scoreFile>.idx' sidecar along with the
+        offset of scoreFile they cover; only bytes appended after that offset
+        are ever parsed again. Scores indexed since the arrays were written
+        are appended to a log at the end of the sidecar, which is folded
+        into the arrays once it's logMax long. A missing or stale sidecar is
+        rebuilt from the score file.
+    """
+    scoreFile:str
+    indexFile:str
+    times:dict      # result -> array('d') of sorted timestamps
+
+    magic = b"TTSI"
+    version = 2
+    results = (humanWon, drawn, cpuWon)
+    logMax = 1024   # Scores logged before the arrays are rewritten
+
+    # magic, version, st_dev, st_ino, offset, array lengths, log length
+    headerFmt = "<4sHQQQQQQQ"
+    logFmt = "<cd"  # result, timestamp
+
+    def __init__(self, scoreFile):
+        self.scoreFile = scoreFile
+        self.indexFile = scoreFile + ".idx"
+        self.reset()
+        self.load()
+        self.sync()
+
+    def reset(self):
+        self.times = {result: array('d') for result in self.results}
+        self.offset = 0         # Bytes of scoreFile already indexed
+        self.tail = b""         # Incomplete last line read so far
+        self.fileId = None      # (st_dev, st_ino) of indexed scoreFile
+        self.__saved = None     # (array lengths, log length) in sidecar
+        self.__unsaved = []     # (result, timestamp) not in sidecar yet
+
+    def load(self):
+        """ Load the sidecar index. Leaves the index empty if it's missing or
+            doesn't match scoreFile anymore.
+        """
+        try:
+            st = os.stat(self.scoreFile)
+            with open(self.indexFile, 'rb') as f:
+                header = f.read(struct.calcsize(self.headerFmt))
+                (magic, version, dev, ino, offset, *lengths, 
+                    logLen) = struct.unpack(self.headerFmt, header)
+                if magic != self.magic or version != self.version:
+                    return
+                if (dev, ino) != (st.st_dev, st.st_ino) or (
+                        offset > st.st_size):
+                    return
+                times = {}
+                for result, n in zip(self.results, lengths):
+                    times[result] = array('d')
+                    times[result].fromfile(f, n)
+                log = f.read(logLen * struct.calcsize(self.logFmt))
+                entries = list(struct.iter_unpack(self.logFmt, log))
+                if len(entries) != logLen:
+                    return
+        except (OSError, EOFError, struct.error):
+            return
+
+        self.times = times
+        self.offset = offset
+        self.fileId = (dev, ino)
+        for result, timestamp in entries:
+            self.addTime(str(result, "UTF-8"), timestamp)
+        self.__saved = (tuple(lengths), logLen)
+        self.__unsaved = []
+
+    def save(self):
+        """ Write the scores indexed since last save to the sidecar index.
+            Returns False on failure.
+        """
+        if self.fileId == None:
+            return False
+
+        # A partial last line is read again after a restart
+        offset = self.offset - len(self.tail)
+        if self.__saved == None or (
+                self.__saved[1] + len(self.__unsaved) > self.logMax):
+            return self.__rewrite(offset)
+
+        lengths, logLen = self.__saved
+        try:
+            with open(self.indexFile, 'r+b') as f:
+                f.seek(struct.calcsize(self.headerFmt) + 
+                       sum(lengths) * array('d').itemsize + 
+                       logLen * struct.calcsize(self.logFmt))
+                for result, timestamp in self.__unsaved:
+                    f.write(struct.pack(self.logFmt, bytes(result, "UTF-8"), 
+                                        timestamp))
+                logLen += len(self.__unsaved)
+
+                # Header last, so it never covers a missing entry
+                f.flush()
+                f.seek(0)
+                f.write(struct.pack(self.headerFmt, self.magic, 
+                            self.version, *self.fileId, offset, *lengths,
+                            logLen))
+        except OSError:
+            self.__saved = None     # Sidecar's state unknown, rewrite it
+            return False
+        self.__saved = (lengths, logLen)
+        self.__unsaved = []
+        return True
+
+    def __rewrite(self, offset):
+        """ Write the whole sidecar index, without log. Returns False on 
+            failure.
+        """
+        lengths = tuple(len(self.times[result]) for result in self.results)
+        tmpFile = self.indexFile + ".tmp"
+        try:
+            with open(tmpFile, 'wb') as f:
+                f.write(struct.pack(self.headerFmt, self.magic, self.version,
+                            *self.fileId, offset, *lengths, 0))
+                for result in self.results:
+                    self.times[result].tofile(f)
+            os.replace(tmpFile, self.indexFile)
+        except OSError:
+            return False
+        self.__saved = (lengths, 0)
+        self.__unsaved = []
+        return True
+
+    def sync(self):
+        """ Index the lines appended to scoreFile since the last sync. """
+        try:
+            st = os.stat(self.scoreFile)
+        except OSError:
+            return
+
+        # Reindex from scratch if file was replaced or truncated
+        fileId = (st.st_dev, st.st_ino)
+        if fileId != self.fileId or st.st_size < self.offset:
+            self.reset()
+            self.fileId = fileId
+
+        if st.st_size == self.offset:
+            return
+
+        try:
+            with open(self.scoreFile, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except OSError:
+            return
+        self.offset += len(data)
+
+        lines = (self.tail + data).split(b'\n')
+        self.tail = lines.pop()
+        for line in lines:
+            self.addLine(line)
+
+        self.save()
+
+    def addLine(self, line):
+        """ Index a 'playerWon|drawn|cpuWon <timestamp>' line. """
+        fields = line.split()
+        if len(fields) != 2:
+            return
+        try:
+            result = str(fields[0], "UTF-8")
+            timestamp = float(fields[1])
+        except ValueError:
+            return
+        if result not in self.times:
+            return
+        self.addTime(result, timestamp)
+        self.__unsaved.append((result, timestamp))
+
+    def addTime(self, result, timestamp):
+        """ Insert `timestamp` in the sorted array of `result`. """
+        # Scores are appended in time order, so insort is rarely needed
+        times = self.times[result]
+        if len(times) == 0 or timestamp >= times[-1]:
+            times.append(timestamp)
+        else:
+            bisect.insort(times, timestamp)
+
+    def append(self, result, timestamp):
+        """ Append a score to scoreFile and index it.
+            Returns False on failure.
+        """
+        # Catch up with the file so the new line can be indexed in memory
+        self.sync()
+
+        line = bytes(f"{result} {timestamp}\n", "UTF-8")
+        try:
+            with open(self.scoreFile, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+        except OSError:
+            return False
+
+        # Nobody else appended in between - index it without rereading
+        if offset == self.offset and self.tail == b"":
+            self.offset += len(line)
+            self.addLine(line)
+            self.save()
+        return True
+
+    def count(self, timeFrom, timeTo):
+        """ Returns [playerWins, draws, cpuWins] with timeFrom < t < timeTo.
+        """
+        scores = []
+        for result in self.results:
+            times = self.times[result]
+            n = (bisect.bisect_left(times, timeTo) - 
+                    bisect.bisect_right(times, timeFrom))
+            scores.append(max(n, 0))
+        return scores
+
+
 class ConfigManager:
     """ Class to read and write config for the game """
     configLoaded:bool  # Config is fully loaded
@@ -1567,34 +2683,36 @@ class ConfigManager:
         self.loadConfigFile(configfile)
 
     def calcScores(self):
-        """ Reads scoreFile and return (playerWins, draws, cpuWins) within 
-            score filter.
-        """
+        """ Returns (playerWins, draws, cpuWins) within score filter. """
         if not self.scoreLoaded:
             return (None, None, None)
 
-        scores = [0,0,0]
-        with open(self.__scoreFile, 'r') as f:
-            for line in f:
-                line = line.strip()
-                fields = line.split()
-                if len(fields) != 2:
-                    continue
-                if fields[0] not in [humanWon, drawn, cpuWon]:
-                    continue
-                try:
-                    time = float(fields[1])
-                except ValueError:
-                    continue
+        self.__scoreIndex.sync()
+        return self.__scoreIndex.count(self.__scoreFrom, self.__scoreTo)
 
-                if time > self.__scoreFrom and time < self.__scoreTo:
-                    if fields[0] == humanWon:
-                        scores[0] += 1
-                    elif fields[0] == drawn:
-                        scores[1] += 1
-                    elif fields[0] == cpuWon:
-                        scores[2] += 1
-        return scores
+    def calcDailyScores(self, days=7):
+        """ Returns [(dayStart, [playerWins, draws, cpuWins]), ...] for the
+            last `days` days (oldest first), limited to score filter.
+        """
+        if not self.scoreLoaded:
+            return []
+
+        self.__scoreIndex.sync()
+
+        # Local midnights, days aren't all 24h long across DST changes
+        now = time.localtime()
+        def midnight(day):
+            """ Returns local midnight starting `day` days ago. """
+            return time.mktime((now.tm_year, now.tm_mon, now.tm_mday - day,
+                                0, 0, 0, 0, 0, -1))
+
+        histogram = []
+        for day in range(days-1, -1, -1):
+            dayStart = midnight(day)
+            histogram.append((dayStart, self.__scoreIndex.count(
+                                max(dayStart, self.__scoreFrom),
+                                min(midnight(day-1), self.__scoreTo))))
+        return histogram
 
     def saveScore(self, score):
         """ Append 'playerWon|drawn|cpuWon <timestamp> to score file. 
@@ -1607,17 +2725,10 @@ class ConfigManager:
         if score not in [humanWon, cpuWon, drawn]:
             raise Exception("cm:saveScore() - invalid score passed")
 
-        try:
-            with open(self.__scoreFile, 'a') as f:
-                f.write(score)
-                f.write(' ')
-                f.write(str(int(time.time())))
-                f.write('\n')
-
-            return True
-        except OSError:
+        if not self.__scoreIndex.append(score, int(time.time())):
             self.errorMessage = "Unable to update Score"
             return False
+        return True
 
 
     def loadSelectedGame(self):
@@ -1633,36 +2744,11 @@ class ConfigManager:
             return None
 
         try:
-            with open(os.path.join(self.__saveDir, 
-                        self.savedGames[self.selectedGame]), 'r') as f:
-                rawGame = f.read()
-                rawGame = rawGame.strip()
-                fields = rawGame.split()
-                if len(fields) != 2:
-                    self.errorMessage = "Corrupted Save File"
-                    return None
-                try:
-                    turn = int(fields[0])
-                except ValueError:
-                    self.errorMessage = "Corrupted Save File"
-                    return None
-                else:
-                    if turn not in [O,X]:
-                        self.errorMessage = "Corrupted Save File"
-                        return None
-                boardList = fields[1].split(",")
-                if len(boardList) != 9:
-                    self.errorMessage = "Corrupted Save File"
-                    return None
-
-                try:
-                    boardList = [int(s) for s in boardList]
-                except ValueError:
-                    self.errorMessage = "Corrupted Save File"
-                    return None
-
-                return (turn, boardList)
-
+            return engine.read_save(os.path.join(self.__saveDir,
+                                self.savedGames[self.selectedGame].name))
+        except ValueError:
+            self.errorMessage = "Corrupted Save File"
+            return None
         except OSError:
             self.errorMessage = "Couldn't load Save File"
             return None
@@ -1675,25 +2761,15 @@ class ConfigManager:
         if not self.saveDirLoaded:
             self.errorMessage = "saveDir not loaded"
             return False
-        
-        saveNo = len(self.savedGames)
-        saveName = f"save{saveNo}"
 
-        try:
-            with open(os.path.join(self.__saveDir, saveName), 'w') as f:
-                f.write(str(turn))
-                f.write(' ')
-                f.write(",".join(str(i) for i in board))
-            
-            if len(self.savedGames) == 0:
-                self.selectedGame = 0
-            self.savedGames.append(saveName)
-            return True
-
-        except OSError as e:
+        if self.savedGames.add(turn, board) == None:
             self.errorMessage = "Couldn't Save File"
             return False
 
+        if self.selectedGame == None:
+            self.selectedGame = 0
+        return True
+
     def getServAddr(self):
         return self.__servAddr
 
@@ -1703,10 +2779,13 @@ class ConfigManager:
         self.saveDirLoaded = False
         self.servAddrLoaded = False
         self.__servAddr = ("localhost", 6969)
+        self.netMode = netServer
+        self.prefetch = False
         self.__saveDir = None
         self.__scoreFile = None
         self.__scoreFrom = float('-inf')
         self.__scoreTo = float('inf')
+        self.__scoreIndex = None
         self.savedGames = []
         self.selectedGame = None
         self.errorMessage = "Config not loaded. Trying (localhost, 6969)"
@@ -1731,14 +2810,12 @@ class ConfigManager:
             self.errorMessage = "Config not loaded properly"
 
     def scanSaveDir(self):
+        self.savedGames = []
+        self.selectedGame = None
         if not self.saveDirLoaded:
-            self.savedGames = []
-            self.selectedGame = None
-
-        for entry in os.scandir(self.__saveDir):
-            if entry.is_file():
-                self.savedGames.append(entry.name)
+            return
 
+        self.savedGames = SaveIndex(self.__saveDir)
         if len(self.savedGames) != 0:
             self.selectedGame = 0
 
@@ -1776,15 +2853,28 @@ class ConfigManager:
 
                 elif cType == "NETWORKING":
                     if fields[0] == 'serverip':
-                        self.__servAddr = (fields[1], self.__servAddr[1])
-                        self.servAddrLoaded += 1
+                        if fields[1].startswith(unixPrefix):
+                            # Unix domain socket, no port needed
+                            self.__servAddr = fields[1][len(unixPrefix):]
+                            self.servAddrLoaded = 2
+                        else:
+                            self.__servAddr = (fields[1], self.__servAddr[1])
+                            self.servAddrLoaded += 1
                     elif fields[0] == 'port':
+                        if isinstance(self.__servAddr, str):
+                            continue    # Unix domain socket has no port
                         try:
                             port = int(fields[1])
                             self.__servAddr = (self.__servAddr[0], port)
                             self.servAddrLoaded += 1
                         except ValueError:
                             continue
+                    elif fields[0] == 'prefetch':
+                        self.prefetch = fields[1].lower() in (
+                                                    "1", "yes", "on", "true")
+                    elif fields[0] == 'mode':
+                        if fields[1].lower() in (netServer, netLocal, netAuto):
+                            self.netMode = fields[1].lower()
                 elif cType == "FILTER_SCORE":
                     if fields[0] == 'scoretimefrom':
                         self.setScoreTime("from", fields[1])
@@ -1846,6 +2936,10 @@ class ConfigManager:
             f.close()
         except OSError:
             self.scoreLoaded = False
+            return
+
+        # Index the scores (first load migrates the plain-text file)
+        self.__scoreIndex = ScoreIndex(scoreFile)
 
     def setScoreTime(self, which, timeStr):
         try:
@@ -1878,15 +2972,29 @@ class Client:
     display:DisplayManager
     input:InputManager
     nm:NetworkManager
+    engine:LocalEngine
 
     def __init__(self):
         """ Initialize all needed objects """
         self.terminal = Terminal()
         self.display = DisplayManager(self.terminal)
-        self.input = InputManager(self.terminal)
+        self.input = InputManager(self.terminal, self.display)
         self.cm = ConfigManager(configFile)
         self.gm = GameManager()
         self.nm = NetworkManager(self.cm.getServAddr())
+        self.engine = LocalEngine()
+
+    def getLink(self):
+        """ Returns the engine to play a game against as per config: 
+            NetworkManager, LocalEngine or None if server is unreachable.
+        """
+        if self.cm.netMode == netLocal:
+            return self.engine
+        if self.nm.connected:
+            return self.nm
+        if self.cm.netMode == netAuto:
+            return self.engine
+        return None
 
     def run(self):
         self.gm.startMenu(self)
@@ -0,0 +1,352 @@
+# Exporter and importer of tic-tac-toe datasets: saved games, scores and the
+# server's move journal (tictacJournal.py) in one dense binary file.
+"""
+    Usage: python3 tictacDataset.py export OUT [--saves=DIR] [--scores=FILE]
+                                               [--journal=DIR]
+           python3 tictacDataset.py import IN [--saves=DIR] [--scores=FILE]
+           python3 tictacDataset.py stat IN
+
+    export  Writes the save files in DIR (as positions), the scores in FILE
+            and the games in the server's journal DIR to dataset OUT.
+    import  Writes the positions of dataset IN as save files to DIR and
+            appends its scores to FILE. Games have no text format and are
+            skipped.
+    stat    Prints the number of records of each kind in dataset IN.
+
+    A dataset is a header followed by chunks of up to CHUNK_RECORDS records,
+    each chunk led by its num of records and bytes. Records are:
+        P code                  Position: board to move from
+        G code n move...        Game: start board and the squares played
+        S result timestamp      Score: C, S or N and its Unix time
+    with code the board as a 16-bit base-3 int (Board.code()) plus 1<<15 if
+    O is to move, and n, move and timestamp varints (LEB128).
+    Reading and writing go a chunk at a time, so datasets needn't fit in
+    memory.
+"""
+
+import os
+import sys
+import struct
+import collections
+
+from tictacEngine import X, O, Board, read_save
+from tictacJournal import JournalReader
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+CHUNK_RECORDS = 4096    # Max records in a chunk
+
+# Format
+DATASET_MAGIC = b"TTDS"
+DATASET_VERSION = 1
+DATASET_HEADER = struct.Struct("<4sH2x")    # magic, version
+CHUNK_HEADER = struct.Struct("<II")         # num of records, bytes
+CODE = struct.Struct("<H")
+O_TO_MOVE = 1 << 15     # Flag of codes
+
+# Record kinds
+position_kind = ord("P")
+game_kind = ord("G")
+score_kind = ord("S")
+
+# Score results, as in score files
+score_results = ("C", "S", "N")     # Player won, CPU won, draw
+
+
+#==============================================================================
+
+Position = collections.namedtuple("Position", ("turn", "board"))
+GameRecord = collections.namedtuple("GameRecord", ("turn", "board", "moves"))
+ScoreRecord = collections.namedtuple("ScoreRecord", ("result", "timestamp"))
+
+
+def encode_varint(out:bytearray, n):
+    """ Append unsigned `n` to `out` as a LEB128 varint. """
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def decode_varint(data, pos):
+    """ Return (int, position after it) of the varint at data[pos]. """
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (n, pos)
+        shift += 7
+
+def encode_position(turn, board):
+    """ Return the code of `board` (int[9]) with `turn` to move. """
+    return Board(board).code() | (O_TO_MOVE if turn == O else 0)
+
+def decode_position(code):
+    """ Return (turn, board:int[9]) of position `code`. """
+    return (O if code & O_TO_MOVE else X,
+            Board.from_code(code & ~O_TO_MOVE).board)
+
+
+class DatasetWriter:
+    """ Writer of records (Position, GameRecord, ScoreRecord) to a new
+        dataset at `path`, a chunk at a time.
+    """
+    path:str
+
+    def __init__(self, path, chunk_records=CHUNK_RECORDS):
+        self.path = path
+        self.chunk_records = chunk_records
+        self.counts = collections.Counter()     # Records written, by kind
+        self.__file = open(path, "wb")
+        self.__file.write(DATASET_HEADER.pack(DATASET_MAGIC, DATASET_VERSION))
+        self.__chunk = bytearray()
+        self.__chunk_len = 0
+
+    def write(self, record):
+        chunk = self.__chunk
+        if isinstance(record, Position):
+            chunk.append(position_kind)
+            chunk += CODE.pack(encode_position(record.turn, record.board))
+        elif isinstance(record, GameRecord):
+            chunk.append(game_kind)
+            chunk += CODE.pack(encode_position(record.turn, record.board))
+            encode_varint(chunk, len(record.moves))
+            for move in record.moves:
+                encode_varint(chunk, move)
+        elif isinstance(record, ScoreRecord):
+            chunk.append(score_kind)
+            chunk.append(ord(record.result))
+            encode_varint(chunk, int(record.timestamp))
+        else:
+            raise TypeError("not a dataset record: %r" % (record,))
+        self.counts[type(record).__name__] += 1
+
+        self.__chunk_len += 1
+        if self.__chunk_len >= self.chunk_records:
+            self.flush()
+
+    def write_all(self, records):
+        """ Write each of iterable `records`. Returns num written. """
+        n = 0
+        for record in records:
+            self.write(record)
+            n += 1
+        return n
+
+    def flush(self):
+        """ Write the records so far as a chunk. """
+        if self.__chunk_len:
+            self.__file.write(CHUNK_HEADER.pack(self.__chunk_len,
+                                                len(self.__chunk)))
+            self.__file.write(self.__chunk)
+            self.__chunk.clear()
+            self.__chunk_len = 0
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+
+def read_chunks(path):
+    """ Generator of the chunks of dataset at `path`, each a list of its
+        records. Raises ValueError if it's not a dataset or is corrupted.
+    """
+    with open(path, "rb") as f:
+        header = f.read(DATASET_HEADER.size)
+        if (len(header) != DATASET_HEADER.size or
+                DATASET_HEADER.unpack(header) != (DATASET_MAGIC,
+                                                  DATASET_VERSION)):
+            raise ValueError("%s: not a dataset of version %d" % (path,
+                                                        DATASET_VERSION))
+        while True:
+            chunk_header = f.read(CHUNK_HEADER.size)
+            if chunk_header == b"":
+                return
+            if len(chunk_header) != CHUNK_HEADER.size:
+                raise ValueError("%s: truncated chunk" % path)
+            n, size = CHUNK_HEADER.unpack(chunk_header)
+            data = f.read(size)
+            if len(data) != size:
+                raise ValueError("%s: truncated chunk" % path)
+            try:
+                records = decode_chunk(data, n)
+            except (IndexError, struct.error):
+                raise ValueError("%s: corrupted chunk" % path)
+            yield records
+
+def decode_chunk(data, n):
+    """ Return list of the `n` records encoded in `data`. """
+    records = []
+    pos = 0
+    for i in range(n):
+        kind = data[pos]
+        pos += 1
+        if kind == position_kind:
+            records.append(Position(*decode_position(
+                                    CODE.unpack_from(data, pos)[0])))
+            pos += CODE.size
+        elif kind == game_kind:
+            turn, board = decode_position(CODE.unpack_from(data, pos)[0])
+            pos += CODE.size
+            num_moves, pos = decode_varint(data, pos)
+            moves = []
+            for j in range(num_moves):
+                move, pos = decode_varint(data, pos)
+                moves.append(move)
+            records.append(GameRecord(turn, board, moves))
+        elif kind == score_kind:
+            result = chr(data[pos])
+            timestamp, pos = decode_varint(data, pos+1)
+            records.append(ScoreRecord(result, timestamp))
+        else:
+            raise IndexError("unknown record kind %d" % kind)
+    return records
+
+def read_records(path):
+    """ Generator of the records of dataset at `path`. """
+    for chunk in read_chunks(path):
+        yield from chunk
+
+
+def positions_from_saves(save_dir):
+    """ Generator of Positions of the save files in `save_dir`, corrupted
+        ones skipped.
+    """
+    for entry in sorted(os.scandir(save_dir), key=lambda entry: entry.name):
+        if entry.name.startswith(".") or not entry.is_file():
+            continue    # Client's index
+        try:
+            yield Position(*read_save(entry.path))
+        except (ValueError, OSError):
+            pass
+
+def scores_from_file(score_file):
+    """ Generator of ScoreRecords of the 'C|S|N <timestamp>' lines of
+        `score_file`, bad lines skipped.
+    """
+    with open(score_file, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2 or fields[0] not in score_results:
+                continue
+            try:
+                yield ScoreRecord(fields[0], int(float(fields[1])))
+            except ValueError:
+                pass
+
+def games_from_journal(journal_dir):
+    """ Generator of GameRecords of the games in the server's journal at
+        `journal_dir`. A session's moves make a game until one doesn't
+        follow from the one before (a new game in the session), a game is
+        given as soon as it's over.
+    """
+    games = {}  # (pid, session) -> [turn, start board code, moves, 
+                #                    expected code]
+    for (time_us, session, pid, board, ply, square, search_us,
+            mover) in JournalReader(journal_dir).records():
+        session = (pid, session)
+        game = games.get(session)
+        if game != None and game[3] != board:
+            yield GameRecord(game[0], Board.from_code(game[1]).board,
+                             game[2])
+            game = None
+        if game == None:
+            turn = Board.from_code(board).get_turn()
+            game = games[session] = [turn, board, [], None]
+
+        after = Board.from_code(board)
+        after.board[square] = after.get_turn()
+        game[2].append(square)
+        game[3] = after.code()
+        if after.get_game_result() != None:
+            yield GameRecord(game[0], Board.from_code(game[1]).board,
+                             game[2])
+            del games[session]
+
+    for turn, code, moves, expected in games.values():
+        yield GameRecord(turn, Board.from_code(code).board, moves)
+
+
+def import_dataset(path, save_dir=None, score_file=None):
+    """ Write the Positions of dataset at `path` as save files in
+        `save_dir`, named save<n> like the client's, and append its
+        ScoreRecords to `score_file`. Returns Counter of records imported by
+        kind, and "skipped".
+    """
+    counts = collections.Counter()
+    scores = open(score_file, "a") if score_file != None else None
+    try:
+        save_no = 0
+        for record in read_records(path):
+            if isinstance(record, Position) and save_dir != None:
+                while True:
+                    save_path = os.path.join(save_dir, "save%d" % save_no)
+                    save_no += 1
+                    try:
+                        with open(save_path, "x") as f:
+                            f.write("%d %s" % (record.turn, 
+                                    ",".join(map(str, record.board))))
+                        break
+                    except FileExistsError:
+                        continue
+            elif isinstance(record, ScoreRecord) and scores != None:
+                scores.write("%s %d\n" % (record.result, record.timestamp))
+            else:
+                counts["skipped"] += 1
+                continue
+            counts[type(record).__name__] += 1
+    finally:
+        if scores != None:
+            scores.close()
+    return counts
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    if len(sys.argv) < 3 or sys.argv[1] not in ("export", "import", "stat"):
+        print(__doc__)
+        exit(2)
+    command, path = sys.argv[1:3]
+    sources = {}
+    for arg in sys.argv[3:]:
+        name, sep, value = arg.partition("=")
+        if command == "stat" or not sep or name not in ("--saves",
+                "--scores", "--journal") or (command == "import" and
+                name == "--journal"):
+            print(__doc__)
+            exit(2)
+        sources[name[2:]] = value
+
+    try:
+        if command == "export":
+            writer = DatasetWriter(path)
+            try:
+                if "saves" in sources:
+                    writer.write_all(positions_from_saves(sources["saves"]))
+                if "scores" in sources:
+                    writer.write_all(scores_from_file(sources["scores"]))
+                if "journal" in sources:
+                    writer.write_all(games_from_journal(sources["journal"]))
+            finally:
+                writer.close()
+            counts = writer.counts
+
+        elif command == "import":
+            counts = import_dataset(path, sources.get("saves"), 
+                                    sources.get("scores"))
+
+        else:
+            counts = collections.Counter()
+            for chunk in read_chunks(path):
+                counts.update(type(record).__name__ for record in chunk)
+    except (OSError, ValueError) as e:
+        print(e)
+        exit(1)
+
+    print("%d positions, %d games, %d scores%s" % (counts["Position"],
+            counts["GameRecord"], counts["ScoreRecord"],
+            ", %d skipped" % counts["skipped"] if counts["skipped"] else ""))
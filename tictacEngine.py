@@ -0,0 +1,1040 @@
+# Game logic and CPU player for tic-tac-toe, shared by the server 
+# (tictacServer.py) and the client's offline mode (tictacClient.py).
+
+import os
+import mmap
+import math
+import random
+import struct
+import time
+import types
+import multiprocessing
+import concurrent.futures
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+# BOARD stuff
+X = 0
+O = 1
+empty = 2
+
+# Game
+x_won = X
+o_won = O
+draw = -1
+
+# Symmetries of the board as permutations of squares: the transformed
+# board's square i is the original board's square SYMMETRIES[t][i].
+#  0 1 2
+#  3 4 5
+#  6 7 8
+SYMMETRIES = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),    # identity
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),    # rotate 90
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),    # rotate 180
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),    # rotate 270
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),    # mirror vertical axis
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),    # mirror horizontal axis
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),    # mirror principal diagonal
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),    # mirror secondary diagonal
+)
+
+# Monte Carlo tree search, see MCTS
+MCTS_ITERATIONS = 2000      # Iterations per move, when no time budget
+MCTS_EXPLORATION = math.sqrt(2)     # UCT exploration constant
+
+# Root split parallel search, see ParallelSearch
+no_alpha = -128             # Shared alpha before any root move is searched
+
+# Solved positions file of the server and tools, see Snapshot
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                             "tictac.snapshot")
+
+# Shared state set up in each ParallelSearch worker process
+shared_alpha = None
+
+
+#==============================================================================
+
+class Packet:
+    """ Class for representing a network packet. 
+        Packets of one of many games multiplexed over a connection carry
+        that game's id, they're sent in an envelope GAME:<4-digit id>:<packet>
+    """
+    id:str
+    content:type
+    game_id:int     # None for the connection's own game
+
+    # Packet ids
+    new_game = "NEWG"
+    load_game = "LOAD"
+    end_game = "ENDG"
+    move = "MOVE"
+    board = "BORD"
+    over = "OVER"
+    error = "EROR"
+    close = "CLOS"
+    query = "QURY"  # Stateless query for AI's reply in a position
+    answer = "ANSR"
+    game = "GAME"   # Envelope of a multiplexed game's packet
+    join = "JOIN"   # Wait in lobby for a human opponent
+    pair = "PAIR"   # Opponent found, with side (X/O) to play and game id
+    spectate = "SPEC"   # Watch a lobby game
+    max_game_id = 9999
+
+
+    def __init__(self, id, content=None, game_id=None):
+        if not isinstance(id, str):
+            raise TypeError
+        if id not in (Packet.new_game, Packet.load_game, Packet.end_game,
+                Packet.move, Packet.board, Packet.over, Packet.error,
+                Packet.close, Packet.query, Packet.answer, Packet.join,
+                Packet.pair, Packet.spectate):
+            raise ValueError
+        if game_id != None and not 0 <= game_id <= Packet.max_game_id:
+            raise ValueError
+        self.id = id
+        self.content = content
+        self.game_id = game_id
+
+    def to_bytes(self):
+        s = self.id
+        if self.content != None:
+            s += ':'
+            if isinstance(self.content, list):
+                s += str(self.content)[1:-1].translate(
+                                str.maketrans({ch : ""for ch in " '\""}))
+            else:
+                s += str(self.content)
+        if self.game_id != None:
+            s = "%s:%04d:%s" % (Packet.game, self.game_id, s)
+
+        return bytes(s, "UTF-8")
+
+    @classmethod
+    def from_bytes(self, byte_str):
+        """ Create a Packet object from bytes. 
+            Throw an ValueError exception if not a validly formatted packet.
+        """
+        s = str(byte_str, "UTF-8")
+
+        if s.startswith(Packet.game + ":"):  # Envelope
+            game_id = s[5:9]
+            if len(game_id) != 4 or not game_id.isdigit() or s[9:10] != ":":
+                raise ValueError
+            packet = self.from_bytes(byte_str[10:])
+            if packet.game_id != None:     # Envelopes don't nest
+                raise ValueError
+            packet.game_id = int(game_id)
+            return packet
+
+        if s in (Packet.new_game, Packet.end_game, Packet.close):  # No content body
+            id = s
+            content = None
+        else:
+            id,content = s.split(":", maxsplit=1)
+            if id not in (Packet.load_game, Packet.move, Packet.over, 
+                    Packet.error, Packet.query, Packet.join, Packet.pair,
+                    Packet.spectate):
+                raise ValueError
+
+        # Parse and validate content
+        if content:
+            if id == Packet.move:
+                content = content.split(',')[:2] 
+                if len(content) != 2:
+                    raise Error.e_unknown_cmd()
+                try:
+                    content = list(map(int, content))
+                except ValueError:
+                    raise Error.e_bad_move()
+                if not all(0 <= i <= 2 for i in content):
+                    raise Error.e_bad_move()
+
+            elif id in (Packet.load_game, Packet.query):
+                content = content.split(',')[:10]
+                if len(content) != 10:
+                    raise Error.e_unknown_cmd()
+                if content[0].upper() not in ("X", "O"):
+                    content[0] = 'X'
+                try:
+                    content[1:] = list(map(int, content[1:]))
+                except ValueError:
+                    raise Error.e_unknown_cmd()
+                if not all(i in (X, O, empty) for i in content[1:]):
+                    raise Error.e_unknown_cmd()
+
+            elif id in (Packet.join, Packet.spectate):
+                if len(content) != 4 or not content.isdigit():
+                    raise Error.e_unknown_cmd()
+                content = int(content)  # Player's rating / game's id
+
+            elif id == Packet.pair:
+                # X|O[,dddd] (no game id if lobby has no free ones)
+                if content[:1] not in ("X", "O") or content[1:] and (
+                        len(content) != 6 or content[1] != ',' or 
+                        not content[2:].isdigit()):
+                    raise Error.e_unknown_cmd()
+
+            elif id == Packet.over:
+                content = content.split(',')[:10]
+                if len(content) != 10:
+                    raise Error.e_unknown_cmd()
+                if content[0].upper() not in ("S", "C", "N"):
+                    content[0] = 'N'
+                try:
+                    content[1:] = list(map(int, content[1:]))
+                except ValueError:
+                    raise Error.e_unknown_cmd()
+                if not all(i in (X, O, empty) for i in content[1:]):
+                    raise Error.e_unknown_cmd()
+
+        return self(id,content)
+
+
+class Error(Packet, BaseException):
+    """ Class for representing an error packet. """
+
+    def __init__(self, *args, **kwargs):
+        super(Error, self).__init__(*args, **kwargs)
+        if self.id != Packet.error:
+            raise ValueError
+
+    # Error packets
+    @classmethod
+    def e_unknown_cmd(self):
+        return self("EROR", "UNKNOWN CMD")
+    @classmethod
+    def e_bad_move(self):
+        return self("EROR", "BAD MOVE")
+    @classmethod
+    def e_no_game(self):
+        return self("EROR", "NO GAME")
+
+
+class Board:
+    """ Class for representing tic-tac-toe board.
+        A board is represented as an int[9] of square values(empty, X, O).
+    """
+    __slots__ = ("board",)
+    board:list[int]
+
+    class InvalidMove:
+        """ For throwing invalid move exceptions """
+        pass
+
+    def __init__(self, board_list=None):
+        if board_list == None:
+            board_list = [2]*9
+        # Check for valilidity
+        if not all(isinstance(sq, int) for sq in board_list):
+            raise TypeError("board_list is not int array")
+        if len(board_list) != 9:
+            raise ValueError("board_list's length is not 9")
+        for sq in board_list:
+            if sq not in [X, O, empty]:
+                raise ValueError("board_list contains an invalid sq. value")
+        self.board = board_list
+
+    def __getitem__(self, key):
+        """ Return evaluation of self[key]. """
+        return self.board[key]
+
+    def copy(self):
+        """ Return a new instance(independent) of Board derived from self """
+        return Board(self.board[:])
+
+    @classmethod
+    def create_from_packet(self, board_packet:Packet):
+        if board_packet.id != Packet.board:
+            raise ValueError("wrong packet type")
+
+        return self(list(map(int, board_packet.content.split(","))))
+
+    def to_packet(self):
+        return Packet(Packet.board, self.board[:])
+
+    def code(self):
+        """ Return the board as a base-3 int (square 0 is least significant).
+        """
+        code = 0
+        for sq in reversed(self.board):
+            code = code*3 + sq
+        return code
+
+    @classmethod
+    def from_code(self, code):
+        """ Return the Board of code() `code`. """
+        board_list = []
+        for i in range(9):
+            code, sq = divmod(code, 3)
+            board_list.append(sq)
+        return self(board_list)
+
+    def canonical(self):
+        """ Return (canonical_board:Board, symmetry:tuple) where 
+            canonical_board is the symmetric variant of self with the lowest
+            code() and symmetry the permutation (see SYMMETRIES) taking self
+            to it. A move `sq` on canonical_board is move symmetry[sq] on self.
+        """
+        best = None
+        for symmetry in SYMMETRIES:
+            variant = Board([self.board[sq] for sq in symmetry])
+            code = variant.code()
+            if best == None or code < best[0]:
+                best = (code, variant, symmetry)
+        return (best[1], best[2])
+
+    def is_empty(self):
+        for sq in self.board:
+            if sq != empty:
+                break
+        else:
+            return True
+        return False
+
+    def move(self, x, y, player):
+        # Validate x,y
+        if (not (0 <= x <= 3)) or (not (0 <= y <= 3)):
+            raise InvalidMove()
+
+        # Linearize (x,y) into square_pos
+        sq_pos = y*3 + x
+        
+        if self.board[sq_pos] != empty:
+            print(sq_pos)
+            raise Board.InvalidMove()
+        else:
+            self.board[sq_pos] = player
+
+    def get_game_result(self):
+        """ Returns the result of game(x_won, o_won, draw)  if it has ended, 
+            otherwise return None
+        """
+        # 2d representation in terms of linear indices [0..8]
+        #  0 1 2
+        #  3 4 5
+        #  6 7 8
+
+        # Check for win
+        # For rows
+        for y in range(3):
+            player = None   # Player to check for win
+            for x in range(3):
+                # Linearize (x,y) into square_pos
+                sq_pos = y*3 + x
+
+                if self.board[sq_pos] == empty:
+                    break
+                if player == None:
+                    player = self.board[sq_pos]
+
+                if player != self.board[sq_pos]:
+                    break
+            else:
+                # Player won
+                return player
+        # For cols
+        for x in range(3):
+            player = None # Player to check for win
+            for y in range(3):
+                # Linearize (x,y) into square_pos
+                sq_pos = y*3 + x
+
+                if self.board[sq_pos] == empty:
+                    break
+                if player == None:
+                    player = self.board[sq_pos]
+
+                if player != self.board[sq_pos]:
+                    break
+            else:
+                # Player won
+                return player
+
+        # For diagonals
+        # principal diagonal
+        player = None
+        for sq_pos in [0,4,8]:
+            if self.board[sq_pos] == empty:
+                break
+            if player == None:
+                player = self.board[sq_pos]
+
+            if player != self.board[sq_pos]:
+                break
+        else:
+            # Player won
+            return player
+        # secondary diagonal
+        player = None
+        for sq_pos in [6,4,2]:
+            if self.board[sq_pos] == empty:
+                break
+            if player == None:
+                player = self.board[sq_pos]
+
+            if player != self.board[sq_pos]:
+                break
+        else:
+            # Player won
+            return player
+
+        # Check for draw
+        for sq in self.board:
+            if sq == empty:
+                break
+        else:
+            return draw
+
+        # Game has not ended yet
+        return None
+
+    def get_turn(self):
+        """ Return player with the turn to play (X or O) 
+            Note: Assumes that the game has not ended.
+        """
+        n_x = 0
+        n_o = 0
+
+        for sq in self.board:
+            if sq == X:
+                n_x += 1
+            elif sq == O:
+                n_o += 1
+
+        return (O if n_x > n_o else X)
+
+    def child_boards(self, player):
+        """ A generator method for iterating over all possible board positions
+            from current position for `player`s turn.
+            Returns an iterator to iterate over child `Board` objects.
+            The iterator gives (child:Board, move:int) tuples. (move is move 
+            from parent board to get to the child)
+        """
+        if player not in [X,O]:
+            raise ValueError
+        for sq_pos in range(9):
+            if self[sq_pos] == empty:
+                new_board_list = self.board[:]
+                new_board_list[sq_pos] = player
+                yield (Board(new_board_list), sq_pos)
+                
+
+def read_save(path):
+    """ Returns (turn, board[9]) from a save file of the client's saveDir,
+        written as '<turn> <sq>,<sq>,...'.
+        Raises ValueError if the file is corrupted.
+    """
+    with open(path, "r") as f:
+        fields = f.read().strip().split()
+    if len(fields) != 2:
+        raise ValueError("Corrupted Save File")
+    turn = int(fields[0])
+    if turn not in (X, O):
+        raise ValueError("Corrupted Save File")
+    board = [int(sq) for sq in fields[1].split(",")]
+    if len(board) != 9 or any(sq not in (X, O, empty) for sq in board):
+        raise ValueError("Corrupted Save File")
+    return (turn, board)
+
+
+class Game:
+    """ Class for representing a game session with a client """
+    __slots__ = ("game_on", "game_ended", "game_result", "board", "turn",
+                 "start_board", "started", "moves", "move_times")
+    game_on:bool
+    game_ended:bool
+    game_result:int # (x_won, o_won, draw) / None if (not game_ended)
+    board:Board
+    turn:int   # X or O / None if game_ended or (not game_on)
+    # Record of the game
+    start_board:list[int]   # Board it was started/loaded with
+    started:float           # time.time() it was started/loaded
+    moves:list[int]         # Squares played
+    move_times:list[float]  # time.time() of each move
+
+    def __init__(self, game_on=False, game_ended=False, game_result=None,
+                    board=None, turn=None):
+        # Argument validation
+        if not (isinstance(game_on, bool) and isinstance(game_ended, bool)):
+            raise TypeError
+        if game_result != None and not isinstance(game_result, int):
+            raise TypeError
+        if board != None and not isinstance(board, Board):
+            raise TypeError
+        if turn != None and not isinstance(turn, int):
+            raise TypeError
+        if game_on and (board == None or game_ended or turn not in (X,O)):  
+            raise ValueError
+        if game_ended and (game_result not in (x_won, o_won, draw) or 
+                            board == None or turn != None):
+            raise ValueError
+        if (not game_ended) and (game_result != None):
+            raise ValueError
+        if game_on or game_ended:
+            if board.get_game_result() != game_result:
+                if game_result != draw: # draw might indicate an Aborted Game
+                    raise ValueError
+
+        self.game_on = game_on
+        self.game_ended = game_ended
+        self.game_result = game_result
+        self.board = board
+        self.turn = turn
+        self.start_board = board.board[:] if board != None else None
+        self.started = time.time()
+        self.moves = []
+        self.move_times = []
+
+    def start_new_game(self):
+        self.board = Board()
+        self.game_on = True
+        self.game_ended = False
+        self.game_result = None
+        self.turn = X
+        self.start_record()
+
+    def start_record(self):
+        """ Start recording the moves of the game on self.board. """
+        self.start_board = self.board.board[:]
+        self.started = time.time()
+        self.moves = []
+        self.move_times = []
+
+    def load_game(self, board):
+        if not isinstance(board, Board):
+            raise TypeError
+
+        self.board = board
+        self.game_on = True
+        self.game_ended = False
+        self.start_record()
+
+        # Has game ended?
+        self.game_result = self.board.get_game_result()
+        if self.game_result != None:
+            self.game_on = False
+            self.game_ended = True
+            self.turn = None
+        else:
+            self.turn = self.board.get_turn()
+
+    def end_game(self):
+        """ End/Abort the game based on self.game_result.
+            Note: Assumes the self.game_result is already computed.
+                 (using Board.get_game_result())
+        """
+        if self.game_on:
+            self.game_on = False
+            self.game_ended = True
+            if self.game_result == None: # Abort the game if not already ended.
+                self.game_result = draw
+            self.turn = None
+
+    def move(self, x, y):
+        if not self.game_on:
+            raise RuntimeError("Can't move without a game")
+        
+        self.board.move(x,y,self.turn)
+        self.moves.append(y*3 + x)
+        self.move_times.append(time.time())
+        # Check game_result
+        self.game_result = self.board.get_game_result()
+        if self.game_result != None: # Game has ended
+            self.end_game()
+        else:
+            self.turn = O if self.turn == X else X
+
+    def create_over_packet(self, ai):
+        if not self.game_ended:
+            if self.game_on:
+                raise RuntimeError("Game hasn't ended.")
+            else:
+                raise RuntimeError("No game.")
+
+        if self.game_result == ai.player:   # AI won
+            winner = "S"
+        elif self.game_result == ai.player^1:
+            winner = "C"
+        else:
+            winner = "N"
+
+        return Packet(Packet.over, [winner]+self.board.board)
+
+class AI:
+    """ Class for representing CPU player. """
+    __slots__ = ("player", "table", "mcts", "parallel")
+    player:int # X/O
+    table:object # Transposition table or None
+    mcts:object # MCTS searching its moves instead of minimax, or None
+    parallel:object # ParallelSearch searching instead of minimax, or None
+
+    class Stopped(Exception):
+        """ For aborting a search when its `stop` event is set """
+        pass
+
+    def __init__(self, player=X, table=None, mcts=None, parallel=None):
+        """ `table` is an optional transposition table for the searches,
+            any object with lookup(key) and store(key, value, move, depth)
+            as tictacServer.TranspositionTable.
+            With `mcts` (MCTS), moves are found by Monte Carlo tree search,
+            for boards too big to search to the end.
+            With `parallel` (ParallelSearch), moves are searched across its
+            worker processes.
+        """
+        self.set_player(player)
+        self.table = table
+        self.mcts = mcts
+        self.parallel = parallel
+
+    def set_player(self, player):
+        if player not in (X,O):
+            if isinstance(player, int):
+                raise ValueError
+            raise TypeError
+
+        self.player = player
+
+    def best_move(self, board, stop=None):
+        """ Returns best move as (x,y) 
+            Symmetric positions are searched as one (canonical) position, so
+            they get the same (symmetric) reply.
+            Raises AI.Stopped if threading.Event `stop` gets set meanwhile.
+        """
+        if self.mcts != None:
+            return self.mcts.best_move(board, self.player)
+
+        # Move random for first move
+        if board.is_empty():
+            best_move = (0, random.randint(0,8)) # Eval is 0 for any first move
+        else:
+            canonical_board, symmetry = board.canonical()
+            best_move = self.search(canonical_board, stop)
+            best_move = (best_move[0], symmetry[best_move[1]])
+
+        return (best_move[1]%3, best_move[1]//3, best_move[0])  # (x,y,eval)
+
+    def search(self, board, stop=None):
+        """ Search `board` for self.player's best move.
+            Returns (payoff, best_move:int) as AI.minimax().
+        """
+        if self.parallel != None:
+            return self.parallel.search(board, self.player)
+        return AI.minimax(board, self.player, True, stop, self.table)
+    
+    @staticmethod
+    def minimax(board, turn, maximizing_player, stop=None, table=None):
+        """ Min/max algorithm for tic-tac-toe.
+            Returns (minimax_payoff, best_move:int) where `best_move` is the 
+            move from parent node to get to the child_node with the best payoff.
+            Raises AI.Stopped if threading.Event `stop` gets set meanwhile.
+            Positions found in transposition `table` aren't searched again,
+            the ones searched are stored in it.
+        """
+        if stop != None and stop.is_set():
+            raise AI.Stopped()
+
+        # Check for terminating node and compute payoff
+        game_result = board.get_game_result()
+        if game_result != None:
+            if game_result == draw:
+                payoff = 0
+            elif game_result == turn:
+                payoff = 10
+            else:
+                payoff = -10
+            if not maximizing_player:
+                payoff *= -1
+            return (payoff, -1)
+
+        # Table keeps payoffs for the player to move, searched to the end
+        depth = board.board.count(empty)
+        if table != None:
+            key = board.code()*2 + (turn == O)
+            entry = table.lookup(key)
+            if entry != None and entry[2] >= depth:
+                payoff, best_move = entry[0], entry[1]
+                return (payoff if maximizing_player else -payoff, best_move)
+
+        # Find all child nodes and get the min/max payoff value
+        value = math.inf
+        best_move = -1
+        if maximizing_player:
+            value *= -1
+        for child_node,move in board.child_boards(turn):
+            if maximizing_player:
+                child_payoff = AI.minimax(child_node, O if turn == X else X,
+                                            False, stop, table)[0]
+                if child_payoff > value:
+                    value = child_payoff
+                    best_move = move
+            else:
+                child_payoff = AI.minimax(child_node, O if turn == X else X,
+                                            True, stop, table)[0]
+                if child_payoff < value:
+                    value = child_payoff
+                    best_move = move
+
+        if table != None:
+            table.store(key, value if maximizing_player else -value, 
+                        best_move, depth)
+
+        return (value, best_move)
+
+    @staticmethod
+    def alphabeta(board, turn, alpha, beta):
+        """ Alpha-beta (negamax) search of `board` with `turn` to move.
+            Returns its payoff for `turn` as AI.minimax() if it's within
+            (alpha, beta), else alpha if it's at most alpha and beta if it's
+            at least beta.
+        """
+        game_result = board.get_game_result()
+        if game_result != None:
+            if game_result == draw:
+                payoff = 0
+            elif game_result == turn:
+                payoff = 10
+            else:
+                payoff = -10
+            return min(max(payoff, alpha), beta)
+
+        other = O if turn == X else X
+        for child_node, move in board.child_boards(turn):
+            child_payoff = -AI.alphabeta(child_node, other, -beta, -alpha)
+            if child_payoff > alpha:
+                alpha = child_payoff
+                if alpha >= beta:
+                    break
+        return alpha
+
+
+class MCTS:
+    """ Monte Carlo tree search (UCT) for AI: a tree of positions is grown
+        by playing out random games from them, searching the most promising
+        ones more, within an iteration or time budget per move.
+        The tree is kept between moves, so the moves of a session build on
+        the searches of the ones before. With an `executor`
+        (concurrent.futures), each move is also searched by `workers` more
+        independent trees in its processes (root parallelism) and their
+        stats merged with the tree's at the root.
+    """
+
+    class Node:
+        """ A position of the tree, with the stats of the playouts through
+            it for the player who moved into it.
+        """
+        __slots__ = ("board", "turn", "result", "children", "untried",
+                     "visits", "wins")
+
+        def __init__(self, board, turn, rnd):
+            self.board = board              # int[9]
+            self.turn = turn                # Player to move
+            self.result = Board(board).get_game_result()
+            self.children = {}              # move -> Node
+            self.untried = [] if self.result != None else \
+                           [sq for sq in range(9) if board[sq] == empty]
+            rnd.shuffle(self.untried)
+            self.visits = 0
+            self.wins = 0.0                 # Draws are half a win
+
+    def __init__(self, iterations=MCTS_ITERATIONS, time_budget=None,
+                 exploration=MCTS_EXPLORATION, executor=None, workers=0,
+                 seed=None):
+        """ Each move is searched with `iterations` playouts, or for 
+            `time_budget` secs if given.
+        """
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.exploration = exploration
+        self.executor = executor
+        self.workers = workers
+        self.rnd = random.Random(seed)
+        self.root = None
+
+    def best_move(self, board, player):
+        """ Returns best move for `player` on `board` as AI.best_move(), its
+            eval being the estimated payoff (-10..10).
+        """
+        root = self.__reuse(board.board, player)
+        futures = []
+        if self.executor != None:
+            futures = [self.executor.submit(mcts_search, board.board[:],
+                            player, self.iterations, self.time_budget,
+                            self.exploration, self.rnd.getrandbits(32))
+                       for i in range(self.workers)]
+        MCTS.search(root, self.iterations, self.time_budget, 
+                    self.exploration, self.rnd)
+
+        # Merge the trees' stats at the root
+        stats = {move: [child.visits, child.wins] 
+                 for move, child in root.children.items()}
+        for future in futures:
+            for move, (visits, wins) in future.result().items():
+                stats.setdefault(move, [0, 0.0])
+                stats[move][0] += visits
+                stats[move][1] += wins
+
+        move = max(stats, key=lambda move: stats[move][0])
+        visits, wins = stats[move]
+        payoff = round((wins/visits*2 - 1) * 10)
+        self.root = root
+        return (move%3, move//3, payoff)
+
+    def __reuse(self, board, player):
+        """ Return node of `board` in the tree (with `player` to move) as
+            the new root, or a new root if it's not there.
+        """
+        nodes = [self.root] if self.root != None else []
+        for depth in range(3):  # Up to our move and the opponent's reply
+            for node in nodes:
+                if node.board == board and node.turn == player:
+                    return node
+            nodes = [child for node in nodes 
+                     for child in node.children.values()]
+        return MCTS.Node(board[:], player, self.rnd)
+
+    @staticmethod
+    def search(root, iterations, time_budget, exploration, rnd):
+        """ Grow tree from `root` with `iterations` playouts, or for 
+            `time_budget` secs if given.
+        """
+        deadline = None
+        if time_budget != None:
+            deadline = time.perf_counter() + time_budget
+            iterations = math.inf
+        i = 0
+        while i < iterations:
+            if deadline != None and i % 64 == 0 and \
+                    time.perf_counter() >= deadline:
+                break
+            i += 1
+
+            # Select a path down the tree by UCT, then expand it
+            node = root
+            path = [node]
+            while not node.untried and node.children:
+                log_visits = math.log(node.visits)
+                node = max(node.children.values(), key=lambda child: 
+                           child.wins/child.visits + exploration * 
+                           math.sqrt(log_visits/child.visits))
+                path.append(node)
+            if node.untried:
+                move = node.untried.pop()
+                board = node.board[:]
+                board[move] = node.turn
+                child = MCTS.Node(board, O if node.turn == X else X, rnd)
+                node.children[move] = child
+                node = child
+                path.append(node)
+
+            result = node.result
+            if result == None:
+                result = MCTS.playout(node.board, node.turn, rnd)
+
+            for node in path:
+                node.visits += 1
+                if result == draw:
+                    node.wins += 0.5
+                elif result != node.turn:   # Won by who moved into it
+                    node.wins += 1
+
+    @staticmethod
+    def playout(board, turn, rnd):
+        """ Return result of a game of random moves from `board` with `turn`
+            to move.
+        """
+        board = Board(board[:])
+        squares = [sq for sq in range(9) if board.board[sq] == empty]
+        rnd.shuffle(squares)
+        for sq in squares:
+            board.board[sq] = turn
+            result = board.get_game_result()
+            if result != None:
+                return result
+            turn = O if turn == X else X
+        return draw
+
+
+def mcts_search(board, player, iterations, time_budget, exploration, seed):
+    """ Search `board` (int[9]) with a new MCTS tree, for root parallel
+        searches in other processes. Returns {move: (visits, wins)} of the
+        root.
+    """
+    rnd = random.Random(seed)
+    root = MCTS.Node(board, player, rnd)
+    MCTS.search(root, iterations, time_budget, exploration, rnd)
+    return {move: (child.visits, child.wins) 
+            for move, child in root.children.items()}
+
+
+class ParallelSearch:
+    """ Root split parallel search for AI: the moves at the root are 
+        searched in `workers` processes at once, by alpha-beta with the best
+        payoff found so far at the root (alpha) shared between them, so a 
+        move that can't beat it is cut off early whichever worker finds it.
+        Moves that can only tie it are still searched exactly, so the best
+        move found doesn't depend on the workers' timing.
+    """
+
+    def __init__(self, workers=os.cpu_count()):
+        self.workers = workers
+        self.alpha = multiprocessing.Value("b", no_alpha)
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers,
+                initializer=init_parallel_search, initargs=(self.alpha,))
+
+    def search(self, board, player):
+        """ Search `board` for `player`'s best move. Returns (payoff, 
+            best_move:int) as AI.minimax().
+        """
+        self.alpha.value = no_alpha
+        other = O if player == X else X
+        futures = [self.executor.submit(search_root_move, child.board, other,
+                                        move)
+                   for child, move in board.child_boards(player)]
+        best = (-math.inf, -1)
+        for future in futures:
+            payoff, move, exact = future.result()
+            # Lowest move of the best payoff, as AI.minimax()
+            if exact and (payoff > best[0] or payoff == best[0] and 
+                          move < best[1]):
+                best = (payoff, move)
+        return best
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def init_parallel_search(alpha):
+    """ Set up the shared alpha in a ParallelSearch worker process. """
+    global shared_alpha
+    shared_alpha = alpha
+
+def search_root_move(board, turn, move):
+    """ ParallelSearch worker's task: search root move `move`, leading to 
+        `board` (int[9]) with `turn` (the opponent) to move. Returns 
+        (payoff, move, exact) with exact False if the move can't beat the 
+        shared alpha (and payoff's only an upper bound).
+    """
+    board = Board(board)
+    root_player = O if turn == X else X
+    lower = no_alpha
+    game_result = board.get_game_result()
+    if game_result != None:
+        payoff = 0 if game_result == draw else 10
+    else:
+        # Payoff is the least of the opponent's replies, each searched only
+        # for whether it's below the payoff so far and above the alpha
+        payoff = 10
+        for child_node, reply in board.child_boards(turn):
+            lower = max(lower, shared_alpha.value - 1)  # Ties are searched
+            if payoff <= lower:
+                break
+            payoff = min(payoff, AI.alphabeta(child_node, root_player, 
+                                              lower, payoff))
+
+    exact = payoff > lower
+    if exact:
+        with shared_alpha.get_lock():
+            if payoff > shared_alpha.value:
+                shared_alpha.value = payoff
+    return (payoff, move, exact)
+
+
+class Snapshot:
+    """ Solved table of every position (3^9 boards, either player to move),
+        built once, saved to a versioned file and memory-mapped read-only,
+        so processes using it share its pages instead of each solving the
+        positions again.
+        It's used as a (read-only) transposition table for AI, see AI().
+    """
+    magic = b"TTSN"
+    version = 1             # Bump when AI's evaluation changes
+    header_fmt = struct.Struct("<4sHI") # magic, version, num_entries
+    num_entries = 3**9 * 2  # Entry for key board.code()*2 + (turn == O)
+    entry_fmt = struct.Struct("<bb")    # value for player to move, move
+    unsolved = -128         # Value of entries for ended games
+
+    path:str
+
+    def __init__(self, path):
+        """ Map the snapshot at `path`, (re)building it if it's missing or
+            out of date.
+        """
+        self.path = path
+        try:
+            self.__map = self.__open()
+        except (OSError, ValueError):
+            Snapshot.build(path)
+            self.__map = self.__open()
+
+    def __getstate__(self):
+        """ Other processes map the snapshot by its path. """
+        return self.path
+
+    def __setstate__(self, path):
+        self.path = path
+        self.__map = self.__open()
+
+    def __open(self):
+        """ Return a read-only mmap of the snapshot at self.path.
+            Raises ValueError if it isn't a snapshot of this version.
+        """
+        with open(self.path, "rb") as file:
+            snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = (self.header_fmt.size + 
+                self.num_entries*self.entry_fmt.size)
+        if (len(snapshot) != size or self.header_fmt.unpack_from(snapshot) !=
+                (self.magic, self.version, self.num_entries)):
+            snapshot.close()
+            raise ValueError("not a snapshot of version %d" % self.version)
+        return snapshot
+
+    @classmethod
+    def build(self, path):
+        """ Solve all positions and save them to a snapshot at `path`. """
+        solved = {}
+        table = types.SimpleNamespace(
+            lookup=lambda key: solved.get(key),
+            store=lambda key, value, move, depth: 
+                solved.__setitem__(key, (value, move, depth)))
+
+        entries = bytearray(self.num_entries*self.entry_fmt.size)
+        for code in range(3**9):
+            board = Board([code // 3**sq % 3 for sq in range(9)])
+            if board.get_game_result() != None:
+                for turn in (X, O):
+                    self.entry_fmt.pack_into(entries, 
+                        (code*2 + turn)*self.entry_fmt.size, self.unsolved, -1)
+                continue
+            for turn in (X, O):
+                value, move = AI.minimax(board, turn, True, table=table)
+                self.entry_fmt.pack_into(entries, 
+                        (code*2 + turn)*self.entry_fmt.size, value, move)
+
+        # Replace atomically, processes may be opening it meanwhile
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as file:
+            file.write(self.header_fmt.pack(self.magic, self.version, 
+                                            self.num_entries))
+            file.write(entries)
+        os.replace(tmp_path, path)
+
+    def lookup(self, key):
+        """ Return (value, best move, depth) for `key` as 
+            tictacServer.TranspositionTable.lookup().
+        """
+        value, move = self.entry_fmt.unpack_from(self.__map, 
+                            self.header_fmt.size + key*self.entry_fmt.size)
+        if value == self.unsolved:
+            return None
+        return (value, move, 9)     # Solved to the end
+
+    def store(self, key, value, move, depth):
+        """ Snapshot is read-only, it's solved already. """
+        pass
+
+    def close(self):
+        self.__map.close()
@@ -0,0 +1,274 @@
+# Append-only journal of the moves played on the tic-tac-toe server
+# (tictacServer.py), in fixed-size binary records, and a reader of it for
+# analysis.
+"""
+    Usage: python3 tictacJournal.py DIR
+
+    Prints a summary of the moves journaled in DIR.
+
+    The journal is a directory of segment files moves-<ns>-<pid>.tj, each
+    written by one process and rotated when it reaches a size. A segment is
+    a header followed by records, both JOURNAL_RECORD (32 bytes) long:
+        time_us     int64   Unix time of the move in microseconds
+        session     uint64  Game session the move was played in
+        pid         uint32  Process that journaled it, a session is
+                            identified by (pid, session)
+        board       uint16  Board before the move, as Board.code()
+        ply         uint8   Pieces on the board before the move
+        square      uint8   Square played (0-8)
+        search_us   uint32  Time AI took to find the move (0 for players)
+        mover       uint8   by_client, by_ai or by_player (PvP)
+    With NumPy installed, JournalReader.arrays() gives each segment as a
+    structured array mapped straight from the file.
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+SEGMENT_SIZE = 64 * 1024 * 1024     # Bytes of a segment before rotating it
+BUFFER_SIZE = 64 * 1024             # Bytes buffered before writing them
+
+# Movers
+by_client = 0   # Client against AI
+by_ai = 1
+by_player = 2   # PvP player
+
+# Format
+JOURNAL_MAGIC = b"TTMJ"
+JOURNAL_VERSION = 2
+JOURNAL_HEADER = struct.Struct("<4sHH24x")      # magic, version, record size
+JOURNAL_RECORD = struct.Struct("<qQIHBBIB3x")
+if numpy != None:
+    JOURNAL_DTYPE = numpy.dtype([("time_us", "<i8"), ("session", "<u8"),
+                                 ("pid", "<u4"), ("board", "<u2"), 
+                                 ("ply", "u1"), ("square", "u1"),
+                                 ("search_us", "<u4"), ("mover", "u1"),
+                                 ("pad", "V3")])
+
+
+#==============================================================================
+
+class Journal:
+    """ Writer of a process' moves to the journal in `directory`.
+        Records are buffered in memory, flush() them to make them readable.
+        A forked process gets segments of its own, dropping the records its
+        parent had buffered.
+    """
+    directory:str
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.__fd = None
+        self.__pid = None
+        self.__buffer = bytearray()
+        self.__size = 0     # Of segment, with buffered records
+        self.__sessions = None
+        self.__sessions_pid = None
+
+    def new_session(self):
+        """ Return a new session id, unique across the server's processes
+            and runs along with the pid its moves are journaled with: a 
+            process' ids count up from its first session's Unix time in 
+            microseconds.
+        """
+        if self.__sessions_pid != os.getpid():
+            self.__sessions_pid = os.getpid()
+            self.__sessions = time.time_ns() // 1000
+        self.__sessions += 1
+        return self.__sessions
+
+    def record(self, session, board, ply, square, search_time=0.0,
+               mover=by_client):
+        """ Journal move to `square` in `session`, on `board` (Board.code())
+            with `ply` pieces, found by AI in `search_time` secs.
+        """
+        if self.__pid != os.getpid() or self.__size >= self.segment_size:
+            self.__open_segment()
+        self.__buffer += JOURNAL_RECORD.pack(time.time_ns() // 1000, session,
+                self.__pid, board, ply, square, int(search_time * 1000000),
+                mover)
+        self.__size += JOURNAL_RECORD.size
+        if len(self.__buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def __open_segment(self):
+        """ Start a new segment, as the current one's full or belongs to
+            the parent of this (forked) process.
+        """
+        if self.__pid == os.getpid():
+            self.close()
+        else:
+            self.__buffer.clear()   # Parent's
+        self.__pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "moves-%d-%d.tj" % (
+                                                time.time_ns(), self.__pid))
+        self.__fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                                  os.O_APPEND, 0o644)
+        self.__buffer += JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION,
+                                             JOURNAL_RECORD.size)
+        self.__size = JOURNAL_HEADER.size
+
+    def flush(self):
+        """ Write the buffered records to the segment. """
+        if self.__pid == os.getpid() and self.__buffer:
+            with memoryview(self.__buffer) as view:
+                written = 0
+                while written < len(view):
+                    written += os.write(self.__fd, view[written:])
+            self.__buffer.clear()
+
+    def close(self):
+        if self.__pid == os.getpid():
+            self.flush()
+            os.close(self.__fd)
+        self.__fd = self.__pid = None
+
+
+class JournalReader:
+    """ Reader of the segments of the journal in `directory`, oldest first.
+        Segments are memory-mapped, a partly written last record (of a
+        segment being written) is left out.
+    """
+    directory:str
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self):
+        """ Return paths of the segments. """
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith("moves-") and name.endswith(".tj")]
+        names.sort(key=lambda name: int(name.split("-")[1]))
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def map_segment(path):
+        """ Return (mmap of segment at `path`, num of records in it), or
+            (None, 0) if it has none. Raises ValueError if it's not a
+            segment of this version.
+        """
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < JOURNAL_HEADER.size:
+                return (None, 0)    # Just created
+            segment = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if JOURNAL_HEADER.unpack_from(segment) != (JOURNAL_MAGIC,
+                                    JOURNAL_VERSION, JOURNAL_RECORD.size):
+            segment.close()
+            raise ValueError("%s: not a journal segment of version %d" % (
+                                                    path, JOURNAL_VERSION))
+        count = (size - JOURNAL_HEADER.size) // JOURNAL_RECORD.size
+        if not count:
+            segment.close()
+            return (None, 0)
+        return (segment, count)
+
+    def arrays(self):
+        """ Generator of the segments as NumPy structured arrays (of
+            JOURNAL_DTYPE) viewing their memory maps, without copying or
+            parsing them.
+        """
+        if numpy == None:
+            raise RuntimeError("NumPy is needed for JournalReader.arrays()")
+        for path in self.segments():
+            segment, count = self.map_segment(path)
+            if count:
+                yield numpy.frombuffer(segment, JOURNAL_DTYPE, count,
+                                       JOURNAL_HEADER.size)
+
+    def records(self):
+        """ Generator of the records as tuples (time_us, session, pid, 
+            board, ply, square, search_us, mover), for when NumPy isn't 
+            there.
+        """
+        for path in self.segments():
+            segment, count = self.map_segment(path)
+            if not count:
+                continue
+            with memoryview(segment) as view:
+                yield from JOURNAL_RECORD.iter_unpack(view[JOURNAL_HEADER.size:
+                            JOURNAL_HEADER.size + count*JOURNAL_RECORD.size])
+            segment.close()
+
+
+def summarize(reader:JournalReader):
+    """ Return dict summarizing the moves in the journal of `reader`. """
+    moves = 0
+    sessions = set()
+    first = last = None
+    ai_moves = 0
+    ai_search_us = 0
+    squares = [0] * 9
+
+    if numpy != None:
+        for records in reader.arrays():
+            moves += len(records)
+            ids = numpy.empty(len(records), [("pid", "<u4"), 
+                                             ("session", "<u8")])
+            ids["pid"] = records["pid"]
+            ids["session"] = records["session"]
+            sessions.update(numpy.unique(ids).tolist())
+            first = min(first or records["time_us"].min(),
+                        records["time_us"].min())
+            last = max(last or 0, records["time_us"].max())
+            ai_records = records["mover"] == by_ai
+            ai_moves += int(ai_records.sum())
+            ai_search_us += int(records["search_us"][ai_records].sum())
+            squares = [n + int(m) for n, m in zip(squares,
+                       numpy.bincount(records["square"], minlength=9)[:9])]
+    else:
+        for (time_us, session, pid, board, ply, square, search_us,
+                mover) in reader.records():
+            moves += 1
+            sessions.add((pid, session))
+            if first == None or time_us < first:
+                first = time_us
+            if last == None or time_us > last:
+                last = time_us
+            if mover == by_ai:
+                ai_moves += 1
+                ai_search_us += search_us
+            squares[square] += 1
+
+    return dict(moves=moves, sessions=len(sessions), first=first, last=last,
+                ai_moves=ai_moves, ai_search_us=ai_search_us, squares=squares)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or not os.path.isdir(sys.argv[1]):
+        print(__doc__)
+        exit(2)
+
+    start = time.perf_counter()
+    summary = summarize(JournalReader(sys.argv[1]))
+    secs = time.perf_counter() - start
+
+    print("%d moves in %d sessions, read in %.2fs%s" % (summary["moves"],
+            summary["sessions"], secs, "" if numpy != None else
+            " (without NumPy)"))
+    if summary["moves"]:
+        print("From %s to %s" % tuple(time.strftime("%Y-%m-%d %H:%M:%S",
+                time.localtime(summary[end] / 1000000))
+                for end in ("first", "last")))
+    if summary["ai_moves"]:
+        print("AI moves: %d, %.3fms search on average" % (summary["ai_moves"],
+                summary["ai_search_us"] / summary["ai_moves"] / 1000))
+    if summary["moves"]:
+        print("Squares played:")
+        for row in range(3):
+            print("  " + "  ".join("%5.1f%%" % (n*100 / summary["moves"])
+                    for n in summary["squares"][row*3:row*3+3]))
@@ -30,15 +30,51 @@
                     OVER      ---------------->   The game is over
                     EROR      ---------------->   There's an error
 
+                 - QURY
+                    AI's reply in a position (doesn't touch the game)
+                    ANSR      ---------------->   The board with AI's reply
+
+                 - JOIN:<rating>
+                    Wait in lobby for a human opponent (PvP)
+                    PAIR      ---------------->   Opponent found, your side
+                                                      and game's id
+                    BORD      ---------------->   Start the game
+                    Then MOVE/ENDG/CLOS of either player get BORD/OVER
+                    to both of them
+
+                 - SPEC:<game>
+                    Watch lobby game <game> (as in PAIR)
+                    BORD      ---------------->   Current board and then the
+                    OVER      ---------------->   game's moves, till its end
+
+                 - GAME:<id>:<packet>
+                    Handle <packet> (not CLOS) in the connection's game
+                    <id> (0000-9999), a connection can play many games
+                    GAME:<id>:<reply> ------------>   The replies of <packet>
+
 """
 
 import socket
 import random
-import math
 import sys
+import os
+import time
 import signal
+import stat
+import threading
+import struct
+import selectors
+import multiprocessing
+import multiprocessing.shared_memory
+import multiprocessing.util
+import collections
 import concurrent.futures
 
+from tictacEngine import X, O, empty, draw, Packet, Error, Board, Game, AI, \
+                         Snapshot, SNAPSHOT_PATH
+from tictacStore import GameStore, STORE_PATH
+from tictacJournal import Journal, by_client, by_ai, by_player
+
 
 #==============================================================================
 # Symbolic Constants
@@ -46,480 +82,789 @@ import concurrent.futures
 # Socket 
 HOST = "" # all available interfaces
 PORT = 6969
-
-# BOARD stuff
-X = 0
-O = 1
-empty = 2
-
-# Game
-x_won = X
-o_won = O
-draw = -1
+UNIX_PATH = None    # Path of Unix domain socket to also/only listen on
+
+# Pondering
+PONDER = False          # Precompute AI's replies while client is thinking
+PONDER_NICE = 10        # Niceness of pondering threads
+PONDER_BUDGET = 2.0     # Max secs of pondering per client's turn
+
+# Coalescing identical AI searches across sessions
+COALESCE = False
+COALESCE_WAIT = 0.5     # Secs between checks on a search being waited on
+
+# Transposition table shared by all worker processes
+TABLE = False
+TABLE_SLOTS = 1 << 16
+TABLE_STRIPES = 64      # Locks, each guarding every TABLE_STRIPES-th slot
+
+# Solved positions, memory-mapped by all worker processes (not with TABLE,
+# which takes their place)
+SNAPSHOT = True
+
+# Worker processes
+MAX_WORKERS = os.cpu_count()
+
+# Socket options of client connections
+TCP_NODELAY = True      # Send replies without waiting on unacked data
+TCP_QUICKACK = False    # Ack client's packets right away (Linux only)
+SO_SNDBUF = None        # Send/receive buffer sizes in bytes, None for 
+SO_RCVBUF = None        # system's defaults
+
+# PvP lobby, run by the main process
+RATING_BUCKET = None    # Width of rating buckets players are matched within
+                        # (or with the neighbouring ones), None for FIFO
+LOBBY_RECV_SIZE = 4096
+LOBBY_MAX_OUTPUT = 64 * 1024    # Bytes of replies a lobby player may leave
+                                # unread before being dropped
+SPECTATOR_MAX_OUTPUT = 4 * 1024 # Same for spectators, who are dropped 
+                                # before they hold back a game's players
+LOBBY_PACKET_SIZES = {  # Content length of packets lobby players can send
+    Packet.join: 4, Packet.spectate: 4, Packet.move: 3, Packet.end_game: 0, 
+    Packet.close: 0,
+}
+
+# Game records, see tictacStore.py (None to not store them)
+STORE = STORE_PATH
+
+# Directory of the move journal, see tictacJournal.py (None to not keep it)
+JOURNAL = None
+
+# Selector keys' data of the main process' sockets, besides LobbySessions
+LISTENER = "listener"
+NEW_CONN = "new connection"     # Before its first packet
+
+# New connections, see Router
+FIRST_PACKET_TIMEOUT = 10.0     # Secs a connection has to send its first 
+                                # packet before being closed
+ROUTE_RECHECK = 0.01    # Secs before peeking again at a first packet that
+                        # could still be JOIN/SPEC
+
+# Shared state set up in each worker process by init_worker()
+single_flight = None
+transposition_table = None
+snapshot = None
+game_store = None
+journal = None      # Also the lobby's, in the main process
 
 
 #==============================================================================
 
-class Packet:
-    """ Class for representing a network packet. """
-    id:str
-    content:type
-
-    # Packet ids
-    new_game = "NEWG"
-    load_game = "LOAD"
-    end_game = "ENDG"
-    move = "MOVE"
-    board = "BORD"
-    over = "OVER"
-    error = "EROR"
-    close = "CLOS"
-
-
-    def __init__(self, id, content=None):
-        if not isinstance(id, str):
-            raise TypeError
-        if id not in (Packet.new_game, Packet.load_game, Packet.end_game,
-                Packet.move, Packet.board, Packet.over, Packet.error,
-                Packet.close):
-            raise ValueError
-        self.id = id
-        self.content = content
-
-    def to_bytes(self):
-        s = self.id
-        if self.content != None:
-            s += ':'
-            if isinstance(self.content, list):
-                s += str(self.content)[1:-1].translate(
-                                str.maketrans({ch : ""for ch in " '\""}))
-            else:
-                s += str(self.content)
+class SingleFlight:
+    """ Registry of AI searches in flight, shared by all worker processes
+        through a multiprocessing.Manager.
+        When a search is requested for a position that some session is 
+        already searching, the request waits for that search and takes its
+        result instead of searching again.
+    """
 
-        return bytes(s, "UTF-8")
+    def __init__(self, manager):
+        self.__in_flight = manager.dict()   # key -> (num_waiters, result)
+        self.__stats = manager.dict(searches=0, coalesced=0)
+        self.__cond = manager.Condition(manager.Lock())
 
-    @classmethod
-    def from_bytes(self, byte_str):
-        """ Create a Packet object from bytes. 
-            Throw an ValueError exception if not a validly formatted packet.
+    def search(self, key, search_fn):
+        """ Return search_fn() or the result of an identical search (same
+            `key`) that's already in flight.
         """
-        s = str(byte_str, "UTF-8")
-
-        if s in (Packet.new_game, Packet.end_game, Packet.close):  # No content body
-            id = s
-            content = None
-        else:
-            id,content = s.split(":", maxsplit=1)
-            if id not in (Packet.load_game, Packet.move, Packet.over, Packet.error):
-                raise ValueError
-
-        # Parse and validate content
-        if content:
-            if id == Packet.move:
-                content = content.split(',')[:2] 
-                if len(content) != 2:
-                    raise Error.e_unknown_cmd()
-                try:
-                    content = list(map(int, content))
-                except ValueError:
-                    raise Error.e_bad_move()
-                if not all(0 <= i <= 2 for i in content):
-                    raise Error.e_bad_move()
-
-            elif id == Packet.load_game:
-                content = content.split(',')[:10]
-                if len(content) != 10:
-                    raise Error.e_unknown_cmd()
-                if content[0].upper() not in ("X", "O"):
-                    content[0] = 'X'
-                try:
-                    content[1:] = list(map(int, content[1:]))
-                except ValueError:
-                    raise Error.e_unknown_cmd()
-                if not all(i in (X, O, empty) for i in content[1:]):
-                    raise Error.e_unknown_cmd()
-
-            elif id == Packet.over:
-                content = content.split(',')[:10]
-                if len(content) != 10:
-                    raise Error.e_unknown_cmd()
-                if content[0].upper() not in ("S", "C", "N"):
-                    content[0] = 'N'
-                try:
-                    content[1:] = list(map(int, content[1:]))
-                except ValueError:
-                    raise Error.e_unknown_cmd()
-                if not all(i in (X, O, empty) for i in content[1:]):
-                    raise Error.e_unknown_cmd()
-
-        return self(id,content)
+        with self.__cond:
+            entry = self.__in_flight.get(key)
+            self.__stats["searches"] += 1
+            if entry == None:
+                self.__in_flight[key] = (0, None)
+            else:
+                self.__in_flight[key] = (entry[0]+1, entry[1])
+                self.__stats["coalesced"] += 1
+
+        # Search it
+        if entry == None:
+            result = False  # Failed search
+            try:
+                result = search_fn()
+                return result
+            finally:
+                with self.__cond:
+                    num_waiters = self.__in_flight[key][0]
+                    if num_waiters == 0:
+                        del self.__in_flight[key]
+                    else:
+                        self.__in_flight[key] = (num_waiters, result)
+                    self.__cond.notify_all()
+
+        # Wait for it
+        with self.__cond:
+            while True:
+                num_waiters, result = self.__in_flight[key]
+                if result != None:
+                    break
+                self.__cond.wait(COALESCE_WAIT)
+            if num_waiters == 1:
+                del self.__in_flight[key]
+            else:
+                self.__in_flight[key] = (num_waiters-1, result)
+
+        if result == False:    # Search failed, do it ourselves
+            return search_fn()
+        return result
+
+    def coalescing_rate(self):
+        """ Return fraction of searches served by another search. """
+        stats = self.__stats.copy()
+        if stats["searches"] == 0:
+            return 0.0
+        return stats["coalesced"] / stats["searches"]
+
+
+class TranspositionTable:
+    """ Fixed-size hash table of searched positions in shared memory, read 
+        and written by all worker processes, so what one worker learns
+        about a position is there for the others (and outlives it).
+        Each slot holds (key, value, best move, depth). A slot hit by two
+        keys keeps the one searched deeper. Slots are guarded by striped
+        locks, slot i by lock i % stripes.
+    """
+    slot_fmt = struct.Struct("<IbbBx")  # key+1 (0 if free), value, move, depth
+    stats_fmt = struct.Struct("<QQQQ")  # lookups, hits, stores, collisions
+
+    def __init__(self, slots=TABLE_SLOTS, stripes=TABLE_STRIPES):
+        self.slots = slots
+        self.stripes = stripes
+        self.__locks = [multiprocessing.Lock() for i in range(stripes)]
+        self.__stats_size = stripes * self.stats_fmt.size
+        self.__shm = multiprocessing.shared_memory.SharedMemory(create=True,
+                        size=self.__stats_size + slots*self.slot_fmt.size)
+        self.__shm.buf[:] = bytes(self.__shm.size)
+
+    def __getstate__(self):
+        """ Workers attach to the table by its shared memory name. """
+        return (self.slots, self.stripes, self.__locks, self.__shm.name)
+
+    def __setstate__(self, state):
+        self.slots, self.stripes, self.__locks, name = state
+        self.__stats_size = self.stripes * self.stats_fmt.size
+        self.__shm = multiprocessing.shared_memory.SharedMemory(name)
+
+    def __slot(self, key):
+        """ Return (slot index, slot offset, stripe stats offset) of `key`. """
+        index = (key * 0x9E3779B1 & 0xFFFFFFFF) % self.slots
+        return (index, self.__stats_size + index*self.slot_fmt.size,
+                (index % self.stripes) * self.stats_fmt.size)
+
+    def __count(self, stats_offset, lookups=0, hits=0, stores=0, 
+                collisions=0):
+        """ Add to stripe's stats, with its lock held. """
+        stats = self.stats_fmt.unpack_from(self.__shm.buf, stats_offset)
+        self.stats_fmt.pack_into(self.__shm.buf, stats_offset, 
+                    stats[0]+lookups, stats[1]+hits, stats[2]+stores, 
+                    stats[3]+collisions)
+
+    def lookup(self, key):
+        """ Return (value, best move, depth) stored for `key` or None. """
+        index, offset, stats_offset = self.__slot(key)
+        with self.__locks[index % self.stripes]:
+            slot = self.slot_fmt.unpack_from(self.__shm.buf, offset)
+            hit = slot[0] == key+1
+            self.__count(stats_offset, lookups=1, hits=hit)
+        return slot[1:] if hit else None
+
+    def store(self, key, value, move, depth):
+        """ Store (value, best move, depth) for `key` unless its slot holds 
+            another key searched deeper.
+        """
+        index, offset, stats_offset = self.__slot(key)
+        with self.__locks[index % self.stripes]:
+            slot = self.slot_fmt.unpack_from(self.__shm.buf, offset)
+            collision = slot[0] != 0 and slot[0] != key+1
+            if not (collision and slot[3] > depth):
+                self.slot_fmt.pack_into(self.__shm.buf, offset, 
+                                        key+1, value, move, depth)
+            self.__count(stats_offset, stores=1, collisions=collision)
+
+    def stats(self):
+        """ Return dict of lookups, hits, stores, collisions and occupancy
+            (fraction of slots in use).
+        """
+        totals = [0, 0, 0, 0]
+        for stripe in range(self.stripes):
+            with self.__locks[stripe]:
+                stats = self.stats_fmt.unpack_from(self.__shm.buf, 
+                                                stripe*self.stats_fmt.size)
+            totals = [total+n for total,n in zip(totals, stats)]
+        
+        used = 0
+        for offset in range(self.__stats_size, self.__shm.size, 
+                            self.slot_fmt.size):
+            used += self.__shm.buf[offset:offset+4] != b"\0\0\0\0"
 
+        return dict(zip(("lookups", "hits", "stores", "collisions"), totals),
+                    occupancy=used/self.slots)
 
-class Error(Packet, BaseException):
-    """ Class for representing an error packet. """
+    def close(self, unlink=False):
+        """ Detach from the table, `unlink` frees it (main process only). """
+        self.__shm.close()
+        if unlink:
+            self.__shm.unlink()
 
-    def __init__(self, *args, **kwargs):
-        super(Error, self).__init__(*args, **kwargs)
-        if self.id != Packet.error:
-            raise ValueError
 
-    # Error packets
-    @classmethod
-    def e_unknown_cmd(self):
-        return self("EROR", "UNKNOWN CMD")
-    @classmethod
-    def e_bad_move(self):
-        return self("EROR", "BAD MOVE")
-    @classmethod
-    def e_no_game(self):
-        return self("EROR", "NO GAME")
-
-
-class Board:
-    """ Class for representing tic-tac-toe board.
-        A board is represented as an int[9] of square values(empty, X, O).
+class SharedAI(AI):
+    """ AI whose searches go through the worker's SingleFlight registry and
+        snapshot or transposition table.
     """
-    board:list[int]
-
-    class InvalidMove:
-        """ For throwing invalid move exceptions """
-        pass
-
-    def __init__(self, board_list=None):
-        if board_list == None:
-            board_list = [2]*9
-        # Check for valilidity
-        if not all(isinstance(sq, int) for sq in board_list):
-            raise TypeError("board_list is not int array")
-        if len(board_list) != 9:
-            raise ValueError("board_list's length is not 9")
-        for sq in board_list:
-            if sq not in [X, O, empty]:
-                raise ValueError("board_list contains an invalid sq. value")
-        self.board = board_list
-
-    def __getitem__(self, key):
-        """ Return evaluation of self[key]. """
-        return self.board[key]
-
-    def copy(self):
-        """ Return a new instance(independent) of Board derived from self """
-        return Board(self.board[:])
-
-    @classmethod
-    def create_from_packet(self, board_packet:Packet):
-        if board_packet.id != Packet.board:
-            raise ValueError("wrong packet type")
-
-        return self(list(map(int, board_packet.content.split(","))))
-
-    def to_packet(self):
-        return Packet(Packet.board, self.board[:])
-
-    def is_empty(self):
-        for sq in self.board:
-            if sq != empty:
-                break
-        else:
-            return True
-        return False
-
-    def move(self, x, y, player):
-        # Validate x,y
-        if (not (0 <= x <= 3)) or (not (0 <= y <= 3)):
-            raise InvalidMove()
+    __slots__ = ()
 
-        # Linearize (x,y) into square_pos
-        sq_pos = y*3 + x
-        
-        if self.board[sq_pos] != empty:
-            print(sq_pos)
-            raise Board.InvalidMove()
-        else:
-            self.board[sq_pos] = player
+    def __init__(self, player=X):
+        AI.__init__(self, player, transposition_table 
+                        if transposition_table != None else snapshot)
+
+    def search(self, board, stop=None):
+        if single_flight == None or stop != None:
+            return AI.search(self, board, stop)
+        return single_flight.search((board.code(), self.player), 
+                                    lambda: AI.search(self, board))
+
+
+class Ponderer:
+    """ Precomputes AI's replies to each of the client's possible moves while
+        the client is thinking, in a background thread of the session.
+        The thread runs at a lower priority, gives up after PONDER_BUDGET
+        secs and is stopped as soon as the session has work to do, so it
+        only ever uses otherwise idle CPU.
+    """
+    ai:AI
+    cache:dict  # tuple(board after client's move) -> AI's move (x,y,eval)
+    hits:int
+    misses:int
+
+    def __init__(self, ai):
+        self.ai = ai
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self, board):
+        """ Start pondering on client's replies in position `board`. """
+        self.stop()
+        self.cache = {}
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__ponder, 
+                                            args=(board.copy(),), daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """ Stop pondering, keeping what's been computed. """
+        if self.__thread != None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
 
-    def get_game_result(self):
-        """ Returns the result of game(x_won, o_won, draw)  if it has ended, 
-            otherwise return None
+    def best_move(self, board):
+        """ Returns AI's best move as AI.best_move(), from cache if pondered.
         """
-        # 2d representation in terms of linear indices [0..8]
-        #  0 1 2
-        #  3 4 5
-        #  6 7 8
-
-        # Check for win
-        # For rows
-        for y in range(3):
-            player = None   # Player to check for win
-            for x in range(3):
-                # Linearize (x,y) into square_pos
-                sq_pos = y*3 + x
-
-                if self.board[sq_pos] == empty:
-                    break
-                if player == None:
-                    player = self.board[sq_pos]
-
-                if player != self.board[sq_pos]:
-                    break
-            else:
-                # Player won
-                return player
-        # For cols
-        for x in range(3):
-            player = None # Player to check for win
-            for y in range(3):
-                # Linearize (x,y) into square_pos
-                sq_pos = y*3 + x
-
-                if self.board[sq_pos] == empty:
-                    break
-                if player == None:
-                    player = self.board[sq_pos]
-
-                if player != self.board[sq_pos]:
-                    break
-            else:
-                # Player won
-                return player
-
-        # For diagonals
-        # principal diagonal
-        player = None
-        for sq_pos in [0,4,8]:
-            if self.board[sq_pos] == empty:
-                break
-            if player == None:
-                player = self.board[sq_pos]
+        ai_move = self.cache.get(tuple(board.board))
+        if ai_move != None:
+            self.hits += 1
+            return ai_move
+        self.misses += 1
+        return self.ai.best_move(board)
+
+    def __ponder(self, board):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(),
+                            PONDER_NICE)
+        except (AttributeError, OSError):
+            pass    # Per-thread priority isn't supported here
+
+        deadline = time.monotonic() + PONDER_BUDGET
+        client = O if self.ai.player == X else X
+        for child, move in board.child_boards(client):
+            if self.__stop.is_set() or time.monotonic() > deadline:
+                return
+            if child.get_game_result() != None:
+                continue
+            try:
+                self.cache[tuple(child.board)] = self.ai.best_move(child,
+                                                                self.__stop)
+            except AI.Stopped:
+                return
+
+
+class OutputBuffer:
+    """ Per-connection buffer of the replies to a request, so that they're
+        sent with one sendmsg() call (one segment) instead of a write each.
+    """
+    conn:socket.socket
+    packets:list    # bytes of packets buffered
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.packets = []
+
+    def write(self, packet:Packet, game_id=None):
+        """ Buffer `packet`, in an envelope of game `game_id` if given. """
+        packet.game_id = game_id
+        self.packets.append(packet.to_bytes())
+
+    def flush(self):
+        """ Send all buffered packets. """
+        buffers = self.packets
+        self.packets = []
+        while buffers:
+            sent = self.conn.sendmsg(buffers)
+            # Drop what has been sent, in case the send was partial
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+
+class Matchmaker:
+    """ Queues of players waiting for an opponent, by rating bucket.
+        Joining, being matched and leaving are all O(1): each bucket is a
+        FIFO (OrderedDict) and a player is only matched within its bucket 
+        and the two neighbouring ones.
+    """
+    bucket_width:int    # None to put everyone in one bucket
+    queues:dict         # bucket -> OrderedDict(player -> None), oldest first
+    waiting:dict        # player -> bucket
 
-            if player != self.board[sq_pos]:
-                break
-        else:
-            # Player won
-            return player
-        # secondary diagonal
-        player = None
-        for sq_pos in [6,4,2]:
-            if self.board[sq_pos] == empty:
-                break
-            if player == None:
-                player = self.board[sq_pos]
+    def __init__(self, bucket_width=RATING_BUCKET):
+        self.bucket_width = bucket_width
+        self.queues = {}
+        self.waiting = {}
 
-            if player != self.board[sq_pos]:
-                break
-        else:
-            # Player won
-            return player
+    def __len__(self):
+        return len(self.waiting)
 
-        # Check for draw
-        for sq in self.board:
-            if sq == empty:
-                break
+    def join(self, player, rating=0):
+        """ Return the longest waiting opponent for `player` or None, in
+            which case `player` waits in the queue of its rating.
+        """
+        if self.bucket_width == None:
+            bucket = 0
+            buckets = (0,)
         else:
-            return draw
-
-        # Game has not ended yet
+            bucket = rating // self.bucket_width
+            buckets = (bucket, bucket-1, bucket+1)
+
+        for opponent_bucket in buckets:
+            queue = self.queues.get(opponent_bucket)
+            if queue:
+                opponent = queue.popitem(last=False)[0]
+                if not queue:
+                    del self.queues[opponent_bucket]
+                del self.waiting[opponent]
+                return opponent
+
+        queue = self.queues.setdefault(bucket, collections.OrderedDict())
+        queue[player] = None
+        self.waiting[player] = bucket
         return None
 
-    def get_turn(self):
-        """ Return player with the turn to play (X or O) 
-            Note: Assumes that the game has not ended.
-        """
-        n_x = 0
-        n_o = 0
-
-        for sq in self.board:
-            if sq == X:
-                n_x += 1
-            elif sq == O:
-                n_o += 1
-
-        return (O if n_x > n_o else X)
-
-    def child_boards(self, player):
-        """ A generator method for iterating over all possible board positions
-            from current position for `player`s turn.
-            Returns an iterator to iterate over child `Board` objects.
-            The iterator gives (child:Board, move:int) tuples. (move is move 
-            from parent board to get to the child)
-        """
-        if player not in [X,O]:
-            raise ValueError
-        for sq_pos in range(9):
-            if self[sq_pos] == empty:
-                new_board_list = self.board[:]
-                new_board_list[sq_pos] = player
-                yield (Board(new_board_list), sq_pos)
-                
-
-
-class Game:
-    """ Class for representing a game session with a client """
-    game_on:bool
-    game_ended:bool
-    game_result:int # (x_won, o_won, draw) / None if (not game_ended)
-    board:Board
-    turn:int   # X or O / None if game_ended or (not game_on)
-
-    def __init__(self, game_on=False, game_ended=False, game_result=None,
-                    board=None, turn=None):
-        # Argument validation
-        if not (isinstance(game_on, bool) and isinstance(game_ended, bool)):
-            raise TypeError
-        if game_result != None and not isinstance(game_result, int):
-            raise TypeError
-        if board != None and not isinstance(board, Board):
-            raise TypeError
-        if turn != None and not isinstance(turn, int):
-            raise TypeError
-        if game_on and (board == None or game_ended or turn not in (X,O)):  
-            raise ValueError
-        if game_ended and (game_result not in (x_won, o_won, draw) or 
-                            board == None or turn != None):
-            raise ValueError
-        if (not game_ended) and (game_result != None):
-            raise ValueError
-        if game_on or game_ended:
-            if board.get_game_result() != game_result:
-                if game_result != draw: # draw might indicate an Aborted Game
-                    raise ValueError
-
-        self.game_on = game_on
-        self.game_ended = game_ended
-        self.game_result = game_result
-        self.board = board
-        self.turn = turn
-
-    def start_new_game(self):
-        self.board = Board()
-        self.game_on = True
-        self.game_ended = False
-        self.game_result = None
-        self.turn = X
-
-    def load_game(self, board):
-        if not isinstance(board, Board):
-            raise TypeError
-
-        self.board = board
-        self.game_on = True
-        self.game_ended = False
-
-        # Has game ended?
-        self.game_result = self.board.get_game_result()
-        if self.game_result != None:
-            self.game_on = False
-            self.game_ended = True
-            self.turn = None
-        else:
-            self.turn = self.board.get_turn()
+    def leave(self, player):
+        """ Take `player` out of the queue it's waiting in, if any. """
+        bucket = self.waiting.pop(player, None)
+        if bucket != None:
+            queue = self.queues[bucket]
+            del queue[player]
+            if not queue:
+                del self.queues[bucket]
+
+
+class LobbySession:
+    """ A PvP player's or spectator's connection, handled by the Lobby. """
+    __slots__ = ("conn", "fd", "address", "inbuf", "outbuf", "writing", 
+                 "match", "side", "opponent", "watching")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fd = conn.fileno()
+        self.address = client_address(conn)
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.writing = False    # Waiting for socket to be writable
+        self.match = None       # Match played with opponent
+        self.side = None        # X/O
+        self.opponent = None    # LobbySession
+        self.watching = None    # Match spectated
+
+
+class Match:
+    """ A lobby game between two players, and its spectators. """
+    __slots__ = ("id", "game", "spectators", "session")
+
+    def __init__(self, id):
+        self.id = id            # For SPEC, None if all ids are taken
+        self.session = journal.new_session() if journal != None else 0
+        self.game = Game()
+        self.game.start_new_game()
+        self.spectators = set() # LobbySessions
+
+
+class Lobby:
+    """ PvP lobby: pairs players who JOIN through a Matchmaker and relays 
+        their games, holding the authoritative Game of each pair, to them
+        and to the spectators of the game (SPEC).
+        All its connections are non-blocking and served from the main 
+        process' selector, so waiting players cost no worker (or polling).
+    """
 
-    def end_game(self):
-        """ End/Abort the game based on self.game_result.
-            Note: Assumes the self.game_result is already computed.
-                 (using Board.get_game_result())
+    def __init__(self, selector, bucket_width=RATING_BUCKET, store=None):
+        self.selector = selector
+        self.store = store      # GameStore of the games played, or None
+        self.matchmaker = Matchmaker(bucket_width)
+        self.matches = {}       # id -> Match in play
+        self.next_match_id = 0
+        self.unflushed = set()  # Sessions sent to since last flush
+
+    def add(self, conn):
+        """ Take over client connection `conn` (its first packet is JOIN or
+            SPEC).
         """
-        if self.game_on:
-            self.game_on = False
-            self.game_ended = True
-            if self.game_result == None: # Abort the game if not already ended.
-                self.game_result = draw
-            self.turn = None
-
-    def move(self, x, y):
-        if not self.game_on:
-            raise RuntimeError("Can't move without a game")
-        
-        self.board.move(x,y,self.turn)
-        # Check game_result
-        self.game_result = self.board.get_game_result()
-        if self.game_result != None: # Game has ended
-            self.end_game()
+        conn.setblocking(False)
+        session = LobbySession(conn)
+        self.selector.register(conn, selectors.EVENT_READ, session)
+        print("\n[+%d]: Connected to lobby" % session.fd)
+
+    def handle_events(self, session, events):
+        """ Serve selector `events` of `session`. """
+        if events & selectors.EVENT_WRITE:
+            self.flush(session)
+        if not events & selectors.EVENT_READ or session.conn == None:
+            return
+
+        try:
+            data = session.conn.recv(LOBBY_RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if data == b"":
+            self.drop(session)
         else:
-            self.turn = O if self.turn == X else X
+            session.inbuf += data
+            while session.conn != None:
+                try:
+                    packet = self.parse_packet(session)
+                    if packet == None:
+                        break
+                    self.handle_packet(session, packet)
+                except Error as e:
+                    print("[%d]: Error - (%s)" % (session.fd, e.content))
+                    self.send(session, e.to_bytes())
+
+        # Send the replies to all players and spectators involved
+        while self.unflushed:
+            self.flush(self.unflushed.pop())
+
+    def parse_packet(self, session):
+        """ Return next complete packet in session's input or None. 
+            Raises Error for an unknown packet, after skipping the input.
+        """
+        inbuf = session.inbuf
+        if len(inbuf) < 4:
+            return None
+        packet_id = str(inbuf[:4], "UTF-8", "replace")
+        size = LOBBY_PACKET_SIZES.get(packet_id)
+        if size == None:
+            inbuf.clear()    # Can't tell where next packet starts
+            raise Error.e_unknown_cmd()
+        if size:
+            size += 1   # ':' separator
+        if len(inbuf) < 4 + size:
+            return None
 
-    def create_over_packet(self, ai):
-        if not self.game_ended:
-            if self.game_on:
-                raise RuntimeError("Game hasn't ended.")
+        packet_bytes = bytes(inbuf[:4+size])
+        del inbuf[:4+size]
+        try:
+            return Packet.from_bytes(packet_bytes)
+        except ValueError:
+            raise Error.e_unknown_cmd()
+
+    def handle_packet(self, session, packet):
+        if packet.id == Packet.join:
+            if (session.match != None or session.watching != None or 
+                    session in self.matchmaker.waiting):
+                raise Error.e_unknown_cmd()
+            opponent = self.matchmaker.join(session, packet.content)
+            if opponent == None:
+                print("[%d]: Waiting in lobby, rating %d (%d waiting)" % (
+                        session.fd, packet.content, len(self.matchmaker)))
+            else:
+                self.start_match(opponent, session)
+
+        elif packet.id == Packet.spectate:
+            if (session.match != None or session.watching != None or
+                    session in self.matchmaker.waiting):
+                raise Error.e_unknown_cmd()
+            match = self.matches.get(packet.content)
+            if match == None:
+                raise Error.e_no_game()
+            match.spectators.add(session)
+            session.watching = match
+            self.send(session, match.game.board.to_packet().to_bytes())
+            print("[%d]: Spectating game %04d (%d spectators)" % (session.fd,
+                    match.id, len(match.spectators)))
+
+        elif packet.id == Packet.move:
+            match = session.match
+            if match == None or not match.game.game_on:
+                raise Error.e_no_game()
+            game = match.game
+            x, y = packet.content[::-1]
+            if game.turn != session.side or game.board[y*3+x] != empty:
+                raise Error.e_bad_move()
+            play_move(game, x, y, match.session, by_player)
+            print("[%d]: Player move" % session.fd, [x, y])
+            if game.game_ended:
+                self.end_match(session)
             else:
-                raise RuntimeError("No game.")
+                self.broadcast(match, game.board.to_packet(), 
+                               (session, session.opponent))
+
+        elif packet.id == Packet.end_game:
+            if session.match == None or not session.match.game.game_on:
+                raise Error.e_no_game()
+            session.match.game.end_game()
+            print("[%d]: Game aborted by player" % session.fd)
+            self.end_match(session)
+
+        elif packet.id == Packet.close:
+            self.send(session, Packet(Packet.close).to_bytes())
+            self.flush(session)
+            self.drop(session)
+
+    def start_match(self, player_a, player_b):
+        """ Start a game between the two matched players. """
+        match = Match(self.new_match_id())
+        if match.id != None:
+            self.matches[match.id] = match
+        sides = random.choice(((X, O), (O, X)))
+        for player, side, opponent in ((player_a, sides[0], player_b), 
+                                       (player_b, sides[1], player_a)):
+            player.match = match
+            player.side = side
+            player.opponent = opponent
+            content = "X" if side == X else "O"
+            if match.id != None:
+                content += ",%04d" % match.id
+            self.send(player, Packet(Packet.pair, content).to_bytes())
+            self.send(player, match.game.board.to_packet().to_bytes())
+        print("[%d]: Paired with [%d] in game %s (%d waiting)" % (player_a.fd,
+                    player_b.fd, "----" if match.id == None else 
+                    "%04d" % match.id, len(self.matchmaker)))
+
+    def new_match_id(self):
+        """ Return an id no match in play has, or None if they're all taken.
+        """
+        if len(self.matches) > Packet.max_game_id:
+            return None
+        num_ids = Packet.max_game_id + 1
+        while self.next_match_id in self.matches:
+            self.next_match_id = (self.next_match_id+1) % num_ids
+        match_id = self.next_match_id
+        self.next_match_id = (match_id+1) % num_ids
+        return match_id
+
+    def end_match(self, session):
+        """ Send OVER of session's ended game to both players, each from 
+            its own view, and to the spectators (from X's view). Players can
+            JOIN again and spectators SPEC again.
+        """
+        match = session.match
+        game = match.game
+        if self.store != None:
+            player_x, player_o = sorted((session, session.opponent), 
+                                        key=lambda player: player.side)
+            self.store.record(game, "pvp", "%s vs %s" % (player_x.address, 
+                                                         player_o.address))
+        if journal != None:
+            journal.flush()
+        for player in (session, session.opponent):
+            self.send(player, self.over_packet(game, player.side).to_bytes())
+            player.match = player.side = None
+        session.opponent.opponent = None
+        session.opponent = None
+
+        self.broadcast(match, self.over_packet(game, X))
+        for spectator in match.spectators:
+            spectator.watching = None
+        match.spectators.clear()
+        self.matches.pop(match.id, None)
+
+        print("[%d]: Game end: %s" % (session.fd, "Draw" 
+                if game.game_result == draw else "Player %s won" % 
+                ("X" if game.game_result == X else "O")))
 
-        if self.game_result == ai.player:   # AI won
-            winner = "S"
-        elif self.game_result == ai.player^1:
+    @staticmethod
+    def over_packet(game:Game, side):
+        """ Return OVER packet of ended `game` as seen by player of `side`."""
+        if game.game_result == side:
             winner = "C"
-        else:
+        elif game.game_result == draw:
             winner = "N"
+        else:
+            winner = "S"
+        return Packet(Packet.over, [winner]+game.board.board)
 
-        return Packet(Packet.over, [winner]+self.board.board)
-
-class AI:
-    """ Class for representing CPU player. """
-    player:int # X/O
-
-    def __init__(self, player=X):
-        self.set_player(player)
-
-    def set_player(self, player):
-        if player not in (X,O):
-            if isinstance(player, int):
-                raise ValueError
-            raise TypeError
-
-        self.player = player
-
-    def best_move(self, board):
-        """ Returns best move as (x,y) """
-        # Move random for first move
-        if board.is_empty():
-            best_move = (0, random.randint(0,8)) # Eval is 0 for any first move
+    def broadcast(self, match, packet:Packet, players=()):
+        """ Send `packet` to `players` and the spectators of `match`. The 
+            packet is serialized once, spectators that let too much of it 
+            pile up unread are dropped.
+        """
+        frame = packet.to_bytes()
+        for player in players:
+            self.send(player, frame)
+
+        lagging = []
+        for spectator in match.spectators:
+            self.send(spectator, frame)
+            if len(spectator.outbuf) > SPECTATOR_MAX_OUTPUT:
+                lagging.append(spectator)
+        for spectator in lagging:
+            print("[%d]: Spectator lagging, dropped" % spectator.fd)
+            self.drop(spectator)
+
+    def send(self, session, frame:bytes):
+        """ Buffer `frame` for `session`, sent by flush(). """
+        if session.conn != None:
+            session.outbuf += frame
+            self.unflushed.add(session)
+
+    def flush(self, session):
+        """ Send as much of session's output as the socket takes, the rest
+            when it's writable. Players not reading are dropped.
+        """
+        if session.conn == None:
+            return
+        if session.outbuf:
+            try:
+                sent = session.conn.send(session.outbuf)
+                del session.outbuf[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.drop(session)
+                return
+        if len(session.outbuf) > LOBBY_MAX_OUTPUT:
+            print("[%d]: Not reading, dropped" % session.fd)
+            self.drop(session)
+            return
+        if session.writing != bool(session.outbuf):
+            session.writing = bool(session.outbuf)
+            self.selector.modify(session.conn, selectors.EVENT_READ | 
+                    (selectors.EVENT_WRITE if session.writing else 0), session)
+
+    def drop(self, session):
+        """ Close session's connection. Its opponent wins the game if any."""
+        if session.conn == None:
+            return
+        self.matchmaker.leave(session)
+        if session.opponent != None:
+            session.match.game.game_result = session.opponent.side # Forfeit
+            session.match.game.end_game()
+            self.end_match(session)
+        if session.watching != None:
+            session.watching.spectators.discard(session)
+            session.watching = None
+
+        self.selector.unregister(session.conn)
+        session.conn.close()
+        session.conn = None
+        print("[-%d]: Left lobby" % session.fd)
+
+
+class Router:
+    """ Hands new connections, once their first packet has arrived, to the
+        lobby if it's JOIN or SPEC and to a worker process otherwise.
+        The first packet is only peeked at, so a connection whose first 
+        bytes could still be JOIN/SPEC stays readable: it's parked (taken 
+        off the selector) for ROUTE_RECHECK secs instead of being polled. 
+        Connections without their first packet in FIRST_PACKET_TIMEOUT 
+        secs are closed.
+    """
+    lobby_ids = (bytes(Packet.join, "UTF-8"), bytes(Packet.spectate, "UTF-8"))
+
+    def __init__(self, selector, lobby:Lobby, executor):
+        self.selector = selector
+        self.lobby = lobby
+        self.executor = executor
+        # Both in order of their times, as they're all the same delay away
+        self.deadlines = {}     # conn -> time its first packet is due by
+        self.parked = {}        # conn -> time to peek at it again
+
+    def add(self, conn):
+        """ Wait for the first packet of new connection `conn`. """
+        self.selector.register(conn, selectors.EVENT_READ, NEW_CONN)
+        self.deadlines[conn] = time.monotonic() + FIRST_PACKET_TIMEOUT
+
+    def route(self, conn):
+        """ Hand `conn`, readable, on if its first packet is in. """
+        try:
+            first = conn.recv(4, socket.MSG_PEEK)
+        except OSError:
+            first = b""
+        self.selector.unregister(conn)
+        if len(first) in (1, 2, 3) and any(id.startswith(first) 
+                                             for id in self.lobby_ids):
+            # Could be JOIN/SPEC, wait for the rest
+            self.parked[conn] = time.monotonic() + ROUTE_RECHECK
+            return
+
+        del self.deadlines[conn]
+        if first == b"":
+            conn.close()
+        elif first in self.lobby_ids:
+            self.lobby.add(conn)
         else:
-            best_move = AI.minimax(board, self.player, True)
+            self.executor.submit(handle_client, conn, PONDER, TCP_QUICKACK)
 
-        return (best_move[1]%3, best_move[1]//3, best_move[0])  # (x,y,eval)
-    
-    @staticmethod
-    def minimax(board, turn, maximizing_player):
-        """ Min/max algorithm for tic-tac-toe.
-            Returns (minimax_payoff, best_move:int) where `best_move` is the 
-            move from parent node to get to the child_node with the best payoff.
+    def tick(self):
+        """ Peek again at the parked connections that are due and close the
+            ones past their deadline. Returns secs till the next of these,
+            None if there's none (for selector.select()).
         """
-        # Check for terminating node and compute payoff
-        game_result = board.get_game_result()
-        if game_result != None:
-            if game_result == draw:
-                payoff = 0
-            elif game_result == turn:
-                payoff = 10
-            else:
-                payoff = -10
-            if not maximizing_player:
-                payoff *= -1
-            return (payoff, -1)
-
-        # Find all child nodes and get the min/max payoff value
-        value = math.inf
-        best_move = -1
-        if maximizing_player:
-            value *= -1
-        for child_node,move in board.child_boards(turn):
-            if maximizing_player:
-                child_payoff = AI.minimax(child_node, O if turn == X else X,
-                                            False)[0]
-                if child_payoff > value:
-                    value = child_payoff
-                    best_move = move
-            else:
-                child_payoff = AI.minimax(child_node, O if turn == X else X,
-                                            True)[0]
-                if child_payoff < value:
-                    value = child_payoff
-                    best_move = move
+        now = time.monotonic()
+        for conn, due in list(self.parked.items()):
+            if due > now:
+                break
+            del self.parked[conn]
+            self.selector.register(conn, selectors.EVENT_READ, NEW_CONN)
+        for conn, deadline in list(self.deadlines.items()):
+            if deadline > now:
+                break
+            del self.deadlines[conn]
+            if self.parked.pop(conn, None) == None:
+                self.selector.unregister(conn)
+            print("[-%d]: No first packet in %.0fs, closing" % (
+                    conn.fileno(), FIRST_PACKET_TIMEOUT))
+            conn.close()
 
-        return (value, best_move)
+        times = [next(iter(pending.values())) 
+                 for pending in (self.parked, self.deadlines) if pending]
+        return max(min(times) - now, 0) if times else None
 
 
+def tune_socket(sock):
+    """ Set the configured socket options on `sock`, a client connection or 
+        the listener (accepted connections inherit its options).
+    """
+    if SO_SNDBUF != None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SO_SNDBUF)
+    if SO_RCVBUF != None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SO_RCVBUF)
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, TCP_NODELAY)
+
+def quick_ack(conn):
+    """ Have the kernel ack received data right away. Linux turns quickack
+        mode off by itself, so it's set again after each receive.
+    """
+    if hasattr(socket, "TCP_QUICKACK") and conn.family != socket.AF_UNIX:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
 def recv_all(conn, bufsize):
     """ Receive bufsize num of bytes from conn socket. The function will return
         only when said num of bytes are received.
@@ -535,9 +880,11 @@ def recv_all(conn, bufsize):
         buffer += data 
     return buffer
 
-def recv_packet(conn):
+def recv_packet(conn, in_envelope=False):
     """ Receive a packet from client and return corresponding Packet object.
-        Raise Error exception if there's problem receiving a packet.
+        Packets in a GAME envelope get its game_id.
+        Raise Error exception if there's problem receiving a packet, with
+        the game_id of the envelope if it's the enveloped packet's problem.
         Throw an ValueError exception if connection is closed.
     """
     if not conn:
@@ -545,14 +892,26 @@ def recv_packet(conn):
 
     packet_id = recv_all(conn, 4)
     s_packet_id = str(packet_id, "UTF-8")
-    if s_packet_id in (Packet.new_game,   # Contentless packet
+    if s_packet_id == Packet.game and not in_envelope:
+        header = recv_all(conn, 6)          # :dddd:
+        game_id = header[1:5]
+        if header[:1] != b':' or header[5:] != b':' or not game_id.isdigit():
+            raise Error.e_unknown_cmd()
+        try:
+            packet = recv_packet(conn, True)
+        except Error as e:
+            e.game_id = int(game_id)    # Reply in the envelope
+            raise
+        packet.game_id = int(game_id)
+        return packet
+    elif s_packet_id in (Packet.new_game,   # Contentless packet
             Packet.end_game, Packet.close): 
         return Packet.from_bytes(packet_id)
     else:
         if recv_all(conn, 1) != b':':
             raise Error.e_unknown_cmd()
 
-        if s_packet_id == Packet.load_game:            
+        if s_packet_id in (Packet.load_game, Packet.query):
             content = recv_all(conn, 19)     # (X|O),i,i,i,i,i,i,i,i,i
         elif s_packet_id == Packet.move:
             content = recv_all(conn, 3)      # i,i
@@ -561,61 +920,78 @@ def recv_packet(conn):
 
         return Packet.from_bytes(packet_id+b':'+content)
 
-def packet_handler(packet:Packet, conn, game:Game, ai:AI):
+def packet_handler(packet:Packet, conn, out:OutputBuffer, game:Game, ai:AI, 
+                   ponderer=None, session=0):
     """ Handle packet received from client, perform the appropriate 
-        operations and send packet back to client if needed.
+        operations and write packets back to client to `out` if needed.
+        AI's replies to client's moves are taken from `ponderer` if given.
+        Moves are journaled in `session`.
+        Replies to a packet of a multiplexed game (packet.game_id) are sent in
+        its envelope.
         Raises ValueError exception if client closes connection.
     """
+    if packet.game_id == None:
+        tag = "%d" % conn.fileno()
+    else:
+        tag = "%d:%04d" % (conn.fileno(), packet.game_id)
+
     if packet.id == Packet.new_game:
+        if game.game_on:
+            record_game(game, conn, ai)     # Abandoned for a new one
         game.start_new_game()
         ai.set_player(random.choice((X,O)))
-        print("[%d]: New game with client as %s" % (conn.fileno(), 
+        print("[%s]: New game with client as %s" % (tag, 
                                             "X" if ai.player == O else "O"))
         if ai.player == X:
-            ai_move = ai.best_move(game.board)
-            game.move(*ai_move[:-1])
-            print("[%d]: AI move" % (conn.fileno()), ai_move[:-1], 
+            ai_move = play_ai_move(game, ai, session)
+            print("[%s]: AI move" % (tag), ai_move[:-1], 
                     "[%d]" % ai_move[2])
-        conn.sendall(game.board.to_packet().to_bytes())
+        out.write(game.board.to_packet(), packet.game_id)
         return
 
     elif packet.id == Packet.load_game:
+        if game.game_on:
+            record_game(game, conn, ai)
         ai.set_player(X if packet.content[0]=="O" else O)
         game.load_game(Board(packet.content[1:]))
-        print("[%d]: Loaded game with client as %s:" % (conn.fileno(), 
+        print("[%s]: Loaded game with client as %s:" % (tag, 
                                         packet.content[0]), game.board.board)
         if not game.game_ended:
             if game.turn == ai.player:
-                ai_move = ai.best_move(game.board)
-                game.move(*ai_move[:-1])
-                print("[%d]: AI move" % (conn.fileno()), ai_move[:-1], 
+                ai_move = play_ai_move(game, ai, session)
+                print("[%s]: AI move" % (tag), ai_move[:-1], 
                         "[%d]" % ai_move[2])
-            conn.sendall(game.board.to_packet().to_bytes())
+            out.write(game.board.to_packet(), packet.game_id)
 
     elif packet.id == Packet.end_game:
         if not game.game_on:
             raise Error.e_no_game()
         game.end_game()
-        print("[%d]: Game aborted by client" % (conn.fileno()))
-        conn.sendall(game.create_over_packet(ai).to_bytes())
+        print("[%s]: Game aborted by client" % (tag))
+        out.write(game.create_over_packet(ai), packet.game_id)
+        record_game(game, conn, ai)
         return
 
     elif packet.id == Packet.move:
         if not game.game_on:
             raise Error.e_no_game()
-        print("[%d]: Client move" % (conn.fileno()), packet.content[::-1])
-        game.move(*packet.content[::-1])
+        print("[%s]: Client move" % (tag), packet.content[::-1])
+        play_move(game, *packet.content[::-1], session, by_client)
         if not game.game_ended:
-            ai_move = ai.best_move(game.board)
-            game.move(*ai_move[:-1])
-            print("[%d]: AI move" % (conn.fileno()), ai_move[:-1], 
+            ai_move = play_ai_move(game, ponderer or ai, session)
+            print("[%s]: AI move" % (tag), ai_move[:-1], 
                     "[%d]" % ai_move[2])
             if not game.game_ended:
-                conn.sendall(game.board.to_packet().to_bytes())
+                out.write(game.board.to_packet(), packet.game_id)
+
+    elif packet.id == Packet.query:
+        out.write(answer_query(packet), packet.game_id)
+        return
 
     elif packet.id == Packet.close:
         try:
-            conn.sendall(Packet(Packet.close).to_bytes())
+            out.write(Packet(Packet.close))
+            out.flush()
         except OSError:
             pass
         finally:
@@ -628,37 +1004,240 @@ def packet_handler(packet:Packet, conn, game:Game, ai:AI):
             result = "Draw"
         else:
             result = "Client won"
-        print("[%d]: Game end: %s" % (conn.fileno(), result))
-        conn.sendall(game.create_over_packet(ai).to_bytes())
+        print("[%s]: Game end: %s" % (tag, result))
+        out.write(game.create_over_packet(ai), packet.game_id)
+        record_game(game, conn, ai)
+
+def play_move(game:Game, x, y, session, mover, search_time=0.0):
+    """ Play move (x, y) in `game`, journaling it in `session` as played by
+        `mover` (found in `search_time` secs by AI).
+    """
+    if journal == None:
+        game.move(x, y)
+        return
+    board = game.board
+    code = board.code()
+    ply = 9 - board.board.count(empty)
+    game.move(x, y)
+    journal.record(session, code, ply, y*3+x, search_time, mover)
+
+def play_ai_move(game:Game, ai, session):
+    """ Play the best move of `ai` (AI or Ponderer) in `game`, journaling it
+        in `session`. Returns the move as AI.best_move().
+    """
+    start = time.perf_counter()
+    ai_move = ai.best_move(game.board)
+    play_move(game, ai_move[0], ai_move[1], session, by_ai, 
+              time.perf_counter() - start)
+    return ai_move
+
+def answer_query(packet:Packet):
+    """ Returns ANSR packet for a QURY packet: the board after AI's reply
+        with AI playing packet.content[0], and the state of the game after it
+        from AI's view (S - AI won, C - client won, N - draw, P - in play).
+        The session's game is not touched, so clients can ask ahead.
+    """
+    board = Board(packet.content[1:])
+    ai = SharedAI(X if packet.content[0] == "X" else O)
 
-def handle_client(conn):
-    """ Handle a game session with a client """
+    game_result = board.get_game_result()
+    if game_result == None:
+        ai_move = ai.best_move(board)
+        board.move(ai_move[0], ai_move[1], ai.player)
+        game_result = board.get_game_result()
 
-    remote_addr = conn.getpeername()
+    if game_result == None:
+        state = "P"
+    elif game_result == ai.player:
+        state = "S"
+    elif game_result == draw:
+        state = "N"
+    else:
+        state = "C"
+
+    return Packet(Packet.answer, [state]+board.board)
+
+def init_worker(shared_single_flight, shared_table, shared_snapshot, 
+                store_path, journal_dir):
+    """ Set up the shared state in a worker process. """
+    global single_flight, transposition_table, snapshot, game_store, journal
+    single_flight = shared_single_flight
+    transposition_table = shared_table
+    snapshot = shared_snapshot
+    if store_path != None:
+        game_store = GameStore(store_path)
+    journal = Journal(journal_dir) if journal_dir != None else None
+
+    # Write the games and moves still buffered when the worker exits (e.g.
+    # on SIGINT), a worker process doesn't run atexit hooks
+    if game_store != None:
+        multiprocessing.util.Finalize(game_store, game_store.close, 
+                                      exitpriority=10)
+    if journal != None:
+        multiprocessing.util.Finalize(journal, journal.close, 
+                                      exitpriority=10)
+
+def warm_up():
+    """ Task run once by each worker process before the server accepts 
+        connections. Returns the worker's pid.
+    """
+    SharedAI(X).best_move(Board([X, empty, empty, empty, O, 
+                                 empty, empty, empty, empty]))
+    return os.getpid()
+
+def client_address(conn):
+    """ Return address of client at `conn` as text. """
+    try:
+        addr = conn.getpeername()
+    except OSError:     # Disconnected
+        return None
+    if isinstance(addr, tuple):
+        return "%s:%d" % addr[:2]
+    return "unix:%s" % (addr or conn.getsockname())
+
+def record_game(game:Game, conn, ai:AI):
+    """ Store `game` played over `conn` against `ai`, if it's been played. """
+    if game_store != None:
+        game_store.record(game, "ai", client_address(conn), ai.player^1)
+
+def handle_multiplexed(packet:Packet, conn, out:OutputBuffer, games:dict):
+    """ Handle `packet` of multiplexed game packet.game_id, with `games` the 
+        connection's table of games in play. Games are added to it as they're 
+        started and dropped as they end.
+    """
+    if packet.id == Packet.close:   # Connection's, not a game's
+        raise Error.e_unknown_cmd()
+
+    entry = games.get(packet.game_id)
+    if entry == None:
+        entry = (Game(), SharedAI(), 
+                 journal.new_session() if journal != None else 0)
+    try:
+        packet_handler(packet, conn, out, entry[0], entry[1], 
+                       session=entry[2])
+    finally:
+        if entry[0].game_on:
+            games[packet.game_id] = entry
+        else:
+            games.pop(packet.game_id, None)
+
+def create_listeners(port=None, unix_path=None):
+    """ Return list of listening sockets, on TCP `port` and/or the Unix
+        domain socket at `unix_path`.
+    """
+    listeners = []
+    try:
+        if port != None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listeners.append(listener)
+            tune_socket(listener)
+            listener.bind((HOST, port))
+            listener.listen(16)
+
+        if unix_path != None:
+            # Remove socket left behind by a previous run
+            try:
+                if stat.S_ISSOCK(os.stat(unix_path).st_mode):
+                    os.unlink(unix_path)
+            except FileNotFoundError:
+                pass
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listeners.append(listener)
+            tune_socket(listener)
+            listener.bind(unix_path)
+            listener.listen(16)
+    except OSError:
+        for listener in listeners:
+            listener.close()
+        raise
+
+    return listeners
+
+def handle_client(conn, ponder=False, quickack=False):
+    """ Handle a game session with a client.
+        Besides the connection's own game, the client can play a game of each
+        id 0-Packet.max_game_id over it, by sending packets in GAME envelopes.
+        With `ponder`, AI thinks on client's replies during client's turn
+        (in the connection's own game).
+        With `quickack`, client's packets are acked right away.
+    """
+
+    remote_addr = conn.getpeername() or "unix:%s" % conn.getsockname()
     print("\n[+%d]: Connected to client at" % conn.fileno(), remote_addr)
 
     game = Game()
-    ai = AI()
+    ai = SharedAI()
+    ponderer = Ponderer(ai) if ponder else None
+    session = journal.new_session() if journal != None else 0
+    games = {}  # game_id -> (Game, SharedAI, journal session) of 
+                # multiplexed games in play
+    out = OutputBuffer(conn)
     while conn:
         # Main loop for receiving packets from client
+        game_id = None
         try:
             packet = recv_packet(conn)
-
-            packet_handler(packet, conn, game, ai)
+            game_id = packet.game_id
+            if quickack:
+                quick_ack(conn)
+
+            if game_id == None:
+                if ponderer != None:
+                    ponderer.stop()
+                packet_handler(packet, conn, out, game, ai, ponderer, 
+                               session)
+                out.flush()
+
+                # Client's turn, think ahead
+                if (ponderer != None and game.game_on and 
+                        game.turn != ai.player):
+                    ponderer.start(game.board)
+            else:
+                # Own game's pondering goes on
+                handle_multiplexed(packet, conn, out, games)
+                out.flush()
 
         except Error as e:
-            print("[%d]: Error - (%s)" % (conn.fileno(), e.content)) 
-            # Send error packet
-            conn.sendall(e.to_bytes())
+            if game_id == None:     # Enveloped packet's, if it was in one
+                game_id = e.game_id
+            print("[%d%s]: Error - (%s)" % (conn.fileno(), 
+                "" if game_id == None else ":%04d" % game_id, e.content))
+            # Send error packet, after any replies before it
+            out.write(e, game_id)
+            out.flush()
         except (BrokenPipeError, ValueError, KeyboardInterrupt):
             break
 
+    # Games left in play are abandoned
+    if game.game_on:
+        record_game(game, conn, ai)
+    for multiplexed_game, multiplexed_ai, session in games.values():
+        record_game(multiplexed_game, conn, multiplexed_ai)
+    if journal != None:
+        journal.flush()
+    if games:
+        print("[%d]: %d multiplexed games left in play" % (conn.fileno(), 
+                                                            len(games)))
+    if ponderer != None:
+        ponderer.stop()
+        print("[%d]: Pondered replies used %d/%d" % (conn.fileno(), 
+                    ponderer.hits, ponderer.hits+ponderer.misses))
+    if single_flight != None:
+        print("[%d]: Coalescing rate %.1f%%" % (conn.fileno(), 
+                    single_flight.coalescing_rate()*100))
+    if transposition_table != None:
+        stats = transposition_table.stats()
+        print("[%d]: Transposition table %.1f%% full, %d/%d hits, "
+              "%d collisions" % (conn.fileno(), stats["occupancy"]*100, 
+                    stats["hits"], stats["lookups"], stats["collisions"]))
+
     # Close the socket
     print("[-%d]: Connection closed to" % conn.fileno(), remote_addr)
     conn.close()
 
 
 if __name__ == "__main__":
+    start_time = time.time()
 
     # Hook the interrupt signal to an exit
 
@@ -669,23 +1248,114 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, exit_handler)
 
     # Parse arguments
-    if len(sys.argv) > 1:
+    port_given = False
+    for arg in sys.argv[1:]:
+        if arg == "--ponder":
+            PONDER = True
+            continue
+        if arg == "--coalesce":
+            COALESCE = True
+            continue
+        if arg == "--table":
+            TABLE = True
+            continue
+        if arg == "--no-snapshot":
+            SNAPSHOT = False
+            continue
+        if arg == "--no-nodelay":
+            TCP_NODELAY = False
+            continue
+        if arg == "--quickack":
+            TCP_QUICKACK = True
+            continue
+        if arg.startswith("--sndbuf="):
+            SO_SNDBUF = int(arg[len("--sndbuf="):])
+            continue
+        if arg.startswith("--rcvbuf="):
+            SO_RCVBUF = int(arg[len("--rcvbuf="):])
+            continue
+        if arg.startswith("--store="):
+            STORE = arg[len("--store="):]
+            continue
+        if arg == "--no-store":
+            STORE = None
+            continue
+        if arg.startswith("--journal="):
+            JOURNAL = arg[len("--journal="):]
+            continue
+        if arg.startswith("--rating-bucket="):
+            RATING_BUCKET = int(arg[len("--rating-bucket="):])
+            continue
+        if arg.startswith("unix:"):
+            UNIX_PATH = arg[len("unix:"):]
+            continue
         try:
-            PORT = int(sys.argv[1])
+            PORT = int(arg)
+            port_given = True
         except ValueError:
             pass
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
-        # Listen 
-        listener.bind((HOST,PORT))
-        listener.listen(16)
-
-        print("Listening on port %d..." % PORT, end="", flush=True)
-        try:
-            with concurrent.futures.ProcessPoolExecutor() as executor:
-                while True:
-                    conn, addr = listener.accept()
-                    future = executor.submit(handle_client,conn)
-        except KeyboardInterrupt:
-            pass 
-
+    # Listen on TCP unless only a Unix domain socket is asked for
+    if UNIX_PATH != None and not port_given:
+        PORT = None
+    listeners = create_listeners(PORT, UNIX_PATH)
+    selector = selectors.DefaultSelector()
+    for listener in listeners:
+        selector.register(listener, selectors.EVENT_READ, LISTENER)
+    store = GameStore(STORE) if STORE != None else None
+    if JOURNAL != None:
+        journal = Journal(JOURNAL)
+    lobby = Lobby(selector, RATING_BUCKET, store)
+
+    shared_table = None
+    try:
+        # Shared state for the workers
+        shared_single_flight = None
+        if COALESCE:
+            manager = multiprocessing.Manager()
+            shared_single_flight = SingleFlight(manager)
+        if TABLE:
+            shared_table = TranspositionTable()
+        shared_snapshot = None
+        if SNAPSHOT and not TABLE:
+            shared_snapshot = Snapshot(SNAPSHOT_PATH)
+
+        print("Listening on %s..." % " and ".join(
+                (["port %d" % PORT] if PORT != None else []) +
+                (["unix:%s" % UNIX_PATH] if UNIX_PATH != None else [])), 
+              end="", flush=True)
+        with concurrent.futures.ProcessPoolExecutor(MAX_WORKERS,
+                initializer=init_worker, 
+                initargs=(shared_single_flight, shared_table, 
+                          shared_snapshot, STORE, JOURNAL)) as executor:
+            # Warm up the workers before accepting connections
+            warm_ups = [executor.submit(warm_up) 
+                        for i in range(MAX_WORKERS)]
+            concurrent.futures.wait(warm_ups)
+            print(" ready in %.2fs" % (time.time() - start_time), 
+                  flush=True)
+            router = Router(selector, lobby, executor)
+            while True:
+                for key, events in selector.select(router.tick()):
+                    if key.data == LISTENER:
+                        conn, addr = key.fileobj.accept()
+                        tune_socket(conn)
+                        # Wait for its first packet to tell PvP players
+                        router.add(conn)
+                    elif key.data == NEW_CONN:
+                        router.route(key.fileobj)
+                    else:
+                        lobby.handle_events(key.data, events)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if shared_table != None:
+            shared_table.close(unlink=True)
+        if store != None:
+            store.close()
+        if journal != None:
+            journal.close()
+        for listener in listeners:
+            listener.close()
+        if UNIX_PATH != None:
+            os.unlink(UNIX_PATH)
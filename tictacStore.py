@@ -0,0 +1,278 @@
+# Persistent store of the games played on the tic-tac-toe server
+# (tictacServer.py), in an SQLite database in WAL mode, and a command line
+# report of them.
+"""
+    Usage: python3 tictacStore.py [DB] [--since=DATE] [--until=DATE]
+                                  [--result=X|O|D|A] [--mode=ai|pvp]
+                                  [--limit=N]
+
+    Prints a summary of the games in DB (tictac.db by default) that ended
+    in the given time range, and the latest of them.
+    DATE is YYYY-MM-DD or "YYYY-MM-DD HH:MM". Results are X/O (won by X/O),
+    D (draw) and A (aborted).
+"""
+
+import os
+import sys
+import time
+import queue
+import sqlite3
+import threading
+
+from tictacEngine import X, O, Game
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "tictac.db")
+
+# Batching writer
+BATCH_SIZE = 256        # Max games written in one transaction
+FLUSH_INTERVAL = 0.5    # Max secs a game waits to be written
+BUSY_TIMEOUT = 10.0     # Secs to wait for other processes' transactions
+
+# Results
+x_won = "X"
+o_won = "O"
+drawn = "D"
+aborted = "A"   # Ended by a player (or its connection) before its end
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        started REAL NOT NULL,      -- Unix time
+        ended REAL NOT NULL,
+        mode TEXT NOT NULL,         -- ai (against server's AI) or pvp
+        client TEXT,                -- Address of client(s)
+        client_side TEXT,           -- X/O played by client against AI
+        start_board TEXT NOT NULL,  -- 9 squares, 0 X, 1 O, 2 empty
+        moves TEXT NOT NULL,        -- Squares played (0-8)
+        move_times TEXT NOT NULL,   -- Comma separated ms since started
+        result TEXT NOT NULL        -- X, O, D or A
+    );
+    CREATE INDEX IF NOT EXISTS games_ended ON games (ended);
+    CREATE INDEX IF NOT EXISTS games_result ON games (result, ended);
+"""
+
+
+#==============================================================================
+
+def result_of(game:Game):
+    """ Return result of ended `game` (x_won, o_won, drawn or aborted). """
+    if game.game_result == X:
+        return x_won
+    elif game.game_result == O:
+        return o_won
+    elif game.game_on or game.board.get_game_result() == None:
+        return aborted
+    return drawn
+
+
+class GameStore:
+    """ Store of game records in an SQLite database.
+        Games are recorded without touching the disk: a background writer
+        thread inserts them in batches, so the server's request path never
+        waits on the database. Any number of processes can record to the
+        same database, each with its own GameStore.
+    """
+    path:str
+
+    def __init__(self, path=STORE_PATH, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.__queue = None
+        self.__writer = None
+        self.__pid = None
+
+    def record(self, game:Game, mode, client, client_side=None):
+        """ Record `game` (ended or abandoned), played in `mode` ("ai"/"pvp")
+            by `client` (address text or None), as `client_side` (X/O) 
+            against AI.
+        """
+        if game.start_board == None or not game.moves:
+            return      # Nothing played
+
+        # Writer thread is started on first record of the process, so a
+        # forked process doesn't end up with its parent's (dead) writer
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__queue = queue.Queue()
+            self.__writer = threading.Thread(target=self.__write_loop,
+                                             daemon=True)
+            self.__writer.start()
+
+        self.__queue.put((game.started, time.time(), mode, client,
+                None if client_side == None else "XO"[client_side],
+                game.start_board[:], game.moves[:], game.move_times[:],
+                result_of(game)))
+
+    def close(self):
+        """ Write the games recorded so far and stop the writer thread. """
+        if self.__pid == os.getpid():
+            self.__queue.put(None)
+            self.__writer.join()
+            self.__pid = None
+
+    def connect(self):
+        """ Return a new connection to the database, creating it if needed.
+        """
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")   # Safe in WAL mode
+        conn.executescript(SCHEMA)
+        return conn
+
+    def __write_loop(self):
+        """ Writer thread: insert recorded games in batches, a batch being
+            what's recorded within self.flush_interval of its first game.
+        """
+        conn = None
+        stop = False
+        while not stop:
+            game = self.__queue.get()
+            if game == None:
+                break
+            batch = [game]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    game = self.__queue.get(timeout=max(0,
+                                            deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if game == None:
+                    stop = True
+                    break
+                batch.append(game)
+
+            rows = [(started, ended, mode, client, client_side,
+                     "".join(map(str, start_board)),
+                     "".join(map(str, moves)),
+                     ",".join("%d" % ((t - started)*1000) for t in times),
+                     result)
+                    for (started, ended, mode, client, client_side,
+                         start_board, moves, times, result) in batch]
+            try:
+                if conn == None:
+                    conn = self.connect()
+                with conn:
+                    conn.executemany("INSERT INTO games (started, ended, "
+                        "mode, client, client_side, start_board, moves, "
+                        "move_times, result) VALUES (?,?,?,?,?,?,?,?,?)", rows)
+            except sqlite3.Error as e:
+                print("GameStore: %d games not stored (%s)" % (len(rows), e))
+
+        if conn != None:
+            conn.close()
+
+    def query(self, since=None, until=None, result=None, mode=None,
+              limit=None):
+        """ Return rows (as dicts) of games that ended in [since, until)
+            (Unix times, None for no bound) with `result` and `mode` if
+            given, latest first.
+        """
+        where, args = self.__filter(since, until, result, mode)
+        sql = "SELECT * FROM games%s ORDER BY ended DESC" % where
+        if limit != None:
+            sql += " LIMIT %d" % limit
+        conn = self.connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, args)]
+        finally:
+            conn.close()
+
+    def summary(self, since=None, until=None, result=None, mode=None):
+        """ Return {result: (num of games, avg num of moves, avg secs)} of
+            games as selected by query().
+        """
+        where, args = self.__filter(since, until, result, mode)
+        conn = self.connect()
+        try:
+            return {result: (count, moves, secs) for result, count, moves,
+                    secs in conn.execute("SELECT result, COUNT(*), "
+                        "AVG(LENGTH(moves)), AVG(ended - started) "
+                        "FROM games%s GROUP BY result" % where, args)}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def __filter(since, until, result, mode):
+        """ Return (WHERE clause, its args) selecting games by the filters.
+        """
+        conditions = []
+        args = []
+        for condition, arg in (("ended >= ?", since), ("ended < ?", until),
+                               ("result = ?", result), ("mode = ?", mode)):
+            if arg != None:
+                conditions.append(condition)
+                args.append(arg)
+        if not conditions:
+            return ("", args)
+        return (" WHERE " + " AND ".join(conditions), args)
+
+
+def parse_date(date):
+    """ Return Unix time of local `date` (YYYY-MM-DD[ HH:MM]). """
+    for date_format in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(date, date_format))
+        except ValueError:
+            pass
+    raise ValueError("bad date: %s" % date)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    path = STORE_PATH
+    filters = {}
+    limit = 20
+    try:
+        for arg in sys.argv[1:]:
+            if arg.startswith("--since="):
+                filters["since"] = parse_date(arg[len("--since="):])
+            elif arg.startswith("--until="):
+                filters["until"] = parse_date(arg[len("--until="):])
+            elif arg.startswith("--result="):
+                filters["result"] = arg[len("--result="):].upper()
+            elif arg.startswith("--mode="):
+                filters["mode"] = arg[len("--mode="):].lower()
+            elif arg.startswith("--limit="):
+                limit = int(arg[len("--limit="):])
+            elif arg.startswith("--"):
+                raise ValueError("unknown option: %s" % arg)
+            else:
+                path = arg
+    except ValueError as e:
+        print(e)
+        print(__doc__)
+        exit(2)
+
+    if not os.path.isfile(path):
+        print("No game store at %s" % path)
+        exit(1)
+
+    store = GameStore(path)
+    summary = store.summary(**filters)
+    total = sum(count for count, moves, secs in summary.values())
+    print("%d games" % total)
+    for result, name in ((x_won, "X won"), (o_won, "O won"),
+                         (drawn, "Draw"), (aborted, "Aborted")):
+        if result in summary:
+            count, moves, secs = summary[result]
+            print("  %-8s %6d (%5.1f%%)  %.1f moves  %.1fs" % (name, count,
+                    count*100 / total, moves, secs))
+
+    games = store.query(limit=limit, **filters)
+    if games:
+        print("\nLatest %d games:" % len(games))
+    for game in games:
+        print("  %s  %-3s  %-24s  %s  %-9s  %s" % (
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(game["ended"])),
+                game["mode"], game["client"],
+                game["client_side"] or "-", game["moves"], game["result"]))
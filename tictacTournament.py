@@ -0,0 +1,311 @@
+# Self-play tournaments of the tic-tac-toe engine (tictacEngine.py), played
+# in-process, against a random player and a baseline version of the engine.
+"""
+    Usage: python3 tictacTournament.py [--games=N] [--seed=N] [--workers=N]
+                                       [--table=memo|snapshot|none]
+                                       [--baseline=PATH] [--mcts=N]
+
+    Plays --games (GAMES) games of each matchup, sides alternating:
+        engine vs random
+        engine vs baseline      (with --baseline)
+        baseline vs random      (with --baseline)
+        mcts vs random          (with --mcts)
+        engine vs mcts          (with --mcts)
+    with `engine` tictacEngine's AI, `random` a player of random legal moves
+    `baseline` the AI of the module at PATH, e.g. the previous engine:
+        git show HEAD~1:tictacEngine.py > /tmp/baseline.py
+    and `mcts` tictacEngine's AI searching by MCTS with N iterations a move,
+    and reports win/draw/loss, time and nodes (minimax calls) per move of
+    each player and games per second. Games are split in shards of
+    deterministic seeds (from --seed) across --workers processes, so a run
+    can be repeated exactly.
+    --table is engine's transposition table: memo (a table per shard, the
+    default), snapshot (tictac.snapshot, solved) or none. Baseline gets a
+    memo too with memo, if its AI takes a table.
+    Exits with status 1 if the engine loses any game.
+"""
+
+import os
+import sys
+import time
+import random
+import importlib.util
+import concurrent.futures
+
+from tictacEngine import X, O, empty, draw, Board, Game, AI, MCTS, \
+                         Snapshot, SNAPSHOT_PATH
+
+
+#==============================================================================
+# Symbolic Constants
+#==============================================================================
+GAMES = 10000           # Games per matchup
+SEED = 0
+MAX_WORKERS = os.cpu_count()
+SHARDS_PER_WORKER = 4
+
+# Players
+engine_player = "engine"
+baseline_player = "baseline"
+random_player = "random"
+mcts_player = "mcts"
+
+# Shared state set up in each worker process by init_worker()
+baseline = None         # Baseline engine's module
+snapshot = None
+mcts_iterations = None
+
+
+#==============================================================================
+
+class CountingTable:
+    """ Transposition table counting the nodes searched through it: AI
+        looks up every position it searches. Entries are kept in `inner`
+        (a table as AI's, or None for none).
+    """
+    __slots__ = ("inner", "nodes")
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.nodes = 0
+
+    def lookup(self, key):
+        self.nodes += 1
+        if self.inner == None:
+            return None
+        return self.inner.lookup(key)
+
+    def store(self, key, value, move, depth):
+        if self.inner != None:
+            self.inner.store(key, value, move, depth)
+
+
+class MemoTable:
+    """ Transposition table in a dict, for a single process. """
+    __slots__ = ("entries",)
+
+    def __init__(self):
+        self.entries = {}
+
+    def lookup(self, key):
+        return self.entries.get(key)
+
+    def store(self, key, value, move, depth):
+        self.entries[key] = (value, move, depth)
+
+
+class Player:
+    """ A tournament player: picks moves on a Game and keeps count of them,
+        of the secs and of the nodes they took.
+    """
+    __slots__ = ("name", "player", "ai", "board_class", "table", "rnd",
+                 "moves", "secs")
+
+    def __init__(self, name, player, rnd, table_kind):
+        self.name = name
+        self.player = player
+        self.rnd = rnd
+        self.moves = 0
+        self.secs = 0.0
+        self.table = None
+        self.ai = None
+        if name == engine_player:
+            self.board_class = Board
+            self.table = CountingTable(MemoTable() if table_kind == "memo"
+                    else snapshot if table_kind == "snapshot" else None)
+            self.ai = AI(player, self.table)
+        elif name == baseline_player:
+            self.board_class = baseline.Board
+            try:
+                self.table = CountingTable(MemoTable() 
+                                           if table_kind == "memo" else None)
+                self.ai = baseline.AI(player, self.table)
+            except TypeError:   # Baseline's AI predates tables
+                self.table = None
+                self.ai = baseline.AI(player)
+        elif name == mcts_player:
+            self.board_class = Board
+            self.ai = AI(player, mcts=MCTS(mcts_iterations, 
+                                           seed=rnd.getrandbits(32)))
+
+    @property
+    def nodes(self):
+        return self.table.nodes if self.table != None else None
+
+    def move(self, game:Game):
+        """ Play a move in `game`, it being the player's turn. """
+        start = time.perf_counter()
+        if self.ai == None:
+            square = self.rnd.choice([sq for sq in range(9)
+                                      if game.board[sq] == empty])
+            x, y = square % 3, square // 3
+        else:
+            board = self.board_class(game.board.board[:])
+            x, y = self.ai.best_move(board)[:2]
+        self.secs += time.perf_counter() - start
+        self.moves += 1
+        game.move(x, y)
+
+
+def init_worker(baseline_path, shared_snapshot, iterations):
+    """ Load the baseline engine and set up the snapshot and MCTS budget 
+        in a worker process.
+    """
+    global baseline, snapshot, mcts_iterations
+    snapshot = shared_snapshot
+    mcts_iterations = iterations
+    if baseline_path != None:
+        baseline = load_module(baseline_path)
+
+def load_module(path):
+    """ Return module loaded from python file at `path`. """
+    spec = importlib.util.spec_from_file_location("tictacBaseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def play_shard(names, first_game, num_games, seed, table_kind):
+    """ Worker's task: play games first_game..first_game+num_games-1 of
+        matchup `names` (player a, player b), player a being X in the even
+        ones. Returns dict of the results.
+    """
+    # Engines pick their first move with the random module
+    random.seed("%s:%s" % (seed, first_game))
+    rnd = random.Random("%s:%s:rnd" % (seed, first_game))
+    players = {side: {name: Player(name, side, rnd, table_kind)
+                      for name in names} for side in (X, O)}
+    wins = draws = losses = 0   # Of player a
+    for game_no in range(first_game, first_game + num_games):
+        a_side = X if game_no % 2 == 0 else O
+        movers = {a_side: players[a_side][names[0]],
+                  a_side^1: players[a_side^1][names[1]]}
+        game = Game()
+        game.start_new_game()
+        while game.game_on:
+            movers[game.turn].move(game)
+        if game.game_result == draw:
+            draws += 1
+        elif game.game_result == a_side:
+            wins += 1
+        else:
+            losses += 1
+
+    results = dict(wins=wins, draws=draws, losses=losses)
+    for i, name in enumerate(names):
+        side_players = [players[side][name] for side in (X, O)]
+        results[i] = dict(
+            moves=sum(player.moves for player in side_players),
+            secs=sum(player.secs for player in side_players),
+            nodes=None if side_players[0].nodes == None else
+                  sum(player.nodes for player in side_players))
+    return results
+
+def play_matchup(executor, names, games, seed, table_kind, shards):
+    """ Play `games` games of matchup `names` in `shards` shards on
+        `executor`. Returns (merged results as play_shard(), secs taken).
+    """
+    start = time.perf_counter()
+    shard_games = -(-games // shards)
+    futures = [executor.submit(play_shard, names, first,
+                               min(shard_games, games - first),
+                               "%s:%s:%s" % (seed, names[0], names[1]),
+                               table_kind)
+               for first in range(0, games, shard_games)]
+
+    merged = {"wins": 0, "draws": 0, "losses": 0,
+              0: dict(moves=0, secs=0.0, nodes=0),
+              1: dict(moves=0, secs=0.0, nodes=0)}
+    for future in futures:
+        results = future.result()
+        for key in ("wins", "draws", "losses"):
+            merged[key] += results[key]
+        for i in (0, 1):
+            for key in ("moves", "secs", "nodes"):
+                if results[i][key] == None or merged[i][key] == None:
+                    merged[i][key] = None
+                else:
+                    merged[i][key] += results[i][key]
+    return (merged, time.perf_counter() - start)
+
+def report(names, results, secs):
+    games = results["wins"] + results["draws"] + results["losses"]
+    print("%s vs %s: %d games, W %d  D %d  L %d, %.0f games/s" % (names[0],
+            names[1], games, results["wins"], results["draws"],
+            results["losses"], games / secs))
+    for i, name in enumerate(names):
+        stats = results[i]
+        moves = max(stats["moves"], 1)
+        print("  %-8s %9.1fus/move  %s nodes/move" % (name,
+                stats["secs"] / moves * 1000000,
+                "-" if stats["nodes"] == None else
+                "%.1f" % (stats["nodes"] / moves)))
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    games = GAMES
+    seed = SEED
+    workers = MAX_WORKERS
+    table_kind = "memo"
+    baseline_path = None
+    iterations = None
+    try:
+        for arg in sys.argv[1:]:
+            if arg.startswith("--games="):
+                games = int(arg[len("--games="):])
+            elif arg.startswith("--seed="):
+                seed = int(arg[len("--seed="):])
+            elif arg.startswith("--workers="):
+                workers = int(arg[len("--workers="):])
+            elif arg.startswith("--table="):
+                table_kind = arg[len("--table="):]
+                if table_kind not in ("memo", "snapshot", "none"):
+                    raise ValueError("unknown table: %s" % table_kind)
+            elif arg.startswith("--baseline="):
+                baseline_path = arg[len("--baseline="):]
+            elif arg.startswith("--mcts="):
+                iterations = int(arg[len("--mcts="):])
+            else:
+                raise ValueError("unknown argument: %s" % arg)
+    except ValueError as e:
+        print(e)
+        print(__doc__)
+        exit(2)
+
+    matchups = [(engine_player, random_player)]
+    if baseline_path != None:
+        matchups += [(engine_player, baseline_player),
+                     (baseline_player, random_player)]
+    if iterations != None:
+        matchups += [(mcts_player, random_player),
+                     (engine_player, mcts_player)]
+
+    shared_snapshot = Snapshot(SNAPSHOT_PATH) if table_kind == "snapshot" \
+                      else None
+    engine_lost = False
+    per_move = {}   # (matchup, player name) -> secs per move
+    with concurrent.futures.ProcessPoolExecutor(workers,
+            initializer=init_worker,
+            initargs=(baseline_path, shared_snapshot, 
+                      iterations)) as executor:
+        for names in matchups:
+            results, secs = play_matchup(executor, names, games, seed,
+                                table_kind, workers * SHARDS_PER_WORKER)
+            report(names, results, secs)
+            for i, name in enumerate(names):
+                per_move[(names, name)] = (results[i]["secs"] /
+                                           max(results[i]["moves"], 1))
+            if names[0] == engine_player and results["losses"]:
+                engine_lost = True
+
+    if baseline_path != None:
+        engine_time = per_move[((engine_player, random_player),
+                                engine_player)]
+        baseline_time = per_move[((baseline_player, random_player),
+                                  baseline_player)]
+        print("engine's time per move vs random is %.2fx baseline's" % (
+                engine_time / baseline_time if baseline_time else 0))
+
+    if engine_lost:
+        print("FAIL: engine lost games")
+        exit(1)